@@ -1,15 +1,113 @@
 from __future__ import annotations
 
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.db.schema import schema_metrics
+from app.db.session import pool_metrics
+from app.services.followup_service import followup_metrics
+from app.services.order_dispatcher import order_dispatch_metrics
+from app.services.outbound_queue import outbound_metrics
+from app.services.pix_validator import pix_metrics
+from app.services.saipos_token_cache import get_saipos_token_cache
+from app.services.status_notifier import status_notify_metrics
+from app.services.transcription_service import get_transcription_service
+from app.utils.dedupe import get_message_filter
+from app.utils.metrics import REGISTRY, dict_collector
+from app.utils.tracing import tracing_metrics
 
 router = APIRouter()
 
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _dedupe_metrics():
+    dedupe = get_message_filter()
+    return dedupe.metrics() if dedupe is not None else {"enabled": False}
+
+
+# os mesmos contadores dos /healthz/* viram gauges no /metrics (lidos só no scrape)
+for _prefix, _source in (
+    ("lia_db_pool", pool_metrics),
+    ("lia_schema", schema_metrics),
+    ("lia_dedupe", _dedupe_metrics),
+    ("lia_transcription", lambda: get_transcription_service().metrics()),
+    ("lia_followup", followup_metrics),
+    ("lia_pix", pix_metrics),
+    ("lia_saipos_token", lambda: get_saipos_token_cache().metrics()),
+    ("lia_order_dispatch", order_dispatch_metrics),
+    ("lia_status_events", status_notify_metrics),
+    ("lia_outbound", outbound_metrics),
+    ("lia_tracing", tracing_metrics),
+):
+    REGISTRY.add_collector(dict_collector(_prefix, _source))
+
 
 @router.get("/healthz")
 def healthz():
     return {"status": "ok"}
 
 
+@router.get("/healthz/db-pool")
+def healthz_db_pool():
+    return pool_metrics()
+
+
+@router.get("/healthz/schema")
+def healthz_schema():
+    return schema_metrics()
+
+
+@router.get("/healthz/dedupe")
+def healthz_dedupe():
+    return _dedupe_metrics()
+
+
+@router.get("/healthz/transcription")
+def healthz_transcription():
+    return get_transcription_service().metrics()
+
+
+@router.get("/healthz/followup")
+def healthz_followup():
+    return followup_metrics()
+
+
+@router.get("/healthz/pix")
+def healthz_pix():
+    return pix_metrics()
+
+
+@router.get("/healthz/saipos-token")
+def healthz_saipos_token():
+    return get_saipos_token_cache().metrics()
+
+
+@router.get("/healthz/order-dispatch")
+def healthz_order_dispatch():
+    return order_dispatch_metrics()
+
+
+@router.get("/healthz/status-events")
+def healthz_status_events():
+    return status_notify_metrics()
+
+
+@router.get("/healthz/outbound")
+def healthz_outbound():
+    return outbound_metrics()
+
+
+@router.get("/healthz/tracing")
+def healthz_tracing():
+    return tracing_metrics()
+
+
+@router.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @router.get("/")
 def root():
     return {"status": "ok"}
@@ -1,26 +1,39 @@
 from __future__ import annotations
 
-import base64
 import json
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, Dict, Optional
+
+try:  # opcional (extra `fast`): decodificação bem mais barata do corpo do webhook
+    import orjson
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
 
 from fastapi import APIRouter, BackgroundTasks, Request
 
-from app.db.session import get_db
+from app.db.session import get_db, savepoint, track_db_stats, unit_of_work
 from app.db import crud
+from app.services.conversation_lock import ConversationBusy, conversation_lock
 from app.services.debounce_queue import concat_messages, process_queue
 from app.services.evolution_client import EvolutionClient
 from app.services.geocode_service import GeocodeService
 from app.services.llm_agent import LLMAgent
+from app.services.media_store import get_media_store
 from app.services.menu_service import MenuService
 from app.services.order_service import OrderService
+from app.services.outbound_queue import send_messages
 from app.services.saipos_client import SaiposClient
+from app.services.status_notifier import record_intake
 from app.services.status_service import StatusService
+from app.services.transcription_service import get_transcription_service
 from app.settings import settings
 import logging
+from app.utils.dedupe import get_message_filter
+from app.utils.metrics import REGISTRY, StageTimer
 from app.utils.phone import extract_phone_from_jid, is_group_jid, normalize_phone
 from app.utils.text_splitter import split_messages
+from app.utils.tracing import start_trace
 from app.utils.time import format_horario
 
 router = APIRouter()
@@ -30,6 +43,13 @@ SUPPORTED_EVENTS = {"messages.upsert"}
 
 logger = logging.getLogger(__name__)
 
+TURN_STAGE_SECONDS = REGISTRY.histogram(
+    "lia_turn_stage_seconds",
+    "Duração de cada etapa do processamento de uma mensagem (debounce, lock_wait, ingest, agent, persist, send)",
+    ("stage",),
+)
+TURNS_TOTAL = REGISTRY.counter("lia_turns_total", "Mensagens processadas em background por resultado", ("result",))
+
 
 def _get_body(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not isinstance(payload, dict):
@@ -61,7 +81,12 @@ def _is_supported_payload(payload: Dict[str, Any]) -> tuple[bool, str | None]:
     return True, None
 
 
-def _missing_envs() -> list[str]:
+_MISSING_ENVS: Optional[list[str]] = None
+
+
+def validate_config() -> list[str]:
+    """Valida as envs obrigatórias uma vez (startup) e guarda o resultado para os webhooks."""
+    global _MISSING_ENVS
     missing = []
     if not settings.database_url:
         missing.append("DATABASE_URL")
@@ -71,9 +96,63 @@ def _missing_envs() -> list[str]:
         missing.append("EVOLUTION_API_KEY")
     if not settings.openai_api_key:
         missing.append("OPENAI_API_KEY")
+    _MISSING_ENVS = missing
     return missing
 
 
+def _missing_envs() -> list[str]:
+    if _MISSING_ENVS is None:
+        return validate_config()
+    return _MISSING_ENVS
+
+
+def _loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _message_type(message: Dict[str, Any]) -> str:
+    if message.get("audioMessage"):
+        return "audio"
+    if message.get("conversation"):
+        return "text"
+    if message.get("extendedTextMessage"):
+        return "text"
+    if message.get("stickerMessage"):
+        return "image/webp"
+    if message.get("documentMessage"):
+        return "documentMessage"
+    if message.get("imageMessage"):
+        return "image"
+    return "other"
+
+
+def classify_webhook(payload: Any) -> Optional[Dict[str, Any]]:
+    """
+    Classificação barata (só `event`, `data.key` e `data.message`) para descartar cedo o que será ignorado.
+    Retorna a resposta de ignore/degraded ou None se o evento deve seguir para o parse completo.
+    """
+    supported, reason = _is_supported_payload(payload)
+    if not supported:
+        return {"status": "ignored", "reason": reason or "unsupported_payload"}
+
+    missing = _missing_envs()
+    if missing:
+        logger.warning("missing_env", extra={"missing": missing})
+        return {"status": "degraded", "reason": "missing_env", "missing": missing}
+
+    data = _get_body(payload)["data"]
+    key = data["key"]
+    if key.get("fromMe"):
+        return {"status": "ignored", "reason": "from_me"}
+    if is_group_jid(key.get("remoteJid") or ""):
+        return {"status": "ignored", "reason": "group_message"}
+    if _message_type(data["message"]) not in ALLOWED_TYPES:
+        return {"status": "ignored", "reason": "unsupported_message_type"}
+    return None
+
+
 def parse_evolution_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
     body = _get_body(payload)
     data = (body or {}).get("data") or {}
@@ -85,19 +164,7 @@ def parse_evolution_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
 
     telefone = normalize_phone(extract_phone_from_jid(telefone_raw))
 
-    message_type = "other"
-    if message.get("audioMessage"):
-        message_type = "audio"
-    elif message.get("conversation"):
-        message_type = "text"
-    elif message.get("extendedTextMessage"):
-        message_type = "text"
-    elif message.get("stickerMessage"):
-        message_type = "image/webp"
-    elif message.get("documentMessage"):
-        message_type = "documentMessage"
-    elif message.get("imageMessage"):
-        message_type = "image"
+    message_type = _message_type(message)
 
     timestamp = data.get("messageTimestamp") or 0
     timestamp_iso = datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat() if timestamp else ""
@@ -129,7 +196,8 @@ def parse_evolution_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
         "trace_id": f"{key.get('id','')}-{timestamp}",
         "url_audio": (message.get("audioMessage") or {}).get("url") or "",
         "url_imagem": (message.get("imageMessage") or {}).get("url") or "",
-        "image_base64": (message.get("imageMessage") or {}).get("base64") or (message.get("imageMessage") or {}).get("jpegThumbnail"),
+        # sem o base64 completo a mídia é baixada do Evolution; a miniatura (jpegThumbnail) não serve para validar
+        "image_base64": (message.get("imageMessage") or {}).get("base64"),
         "image_mimetype": (message.get("imageMessage") or {}).get("mimetype") or "image/jpeg",
     }
 
@@ -152,47 +220,86 @@ def _build_agent(db):
 
 
 def _process_message(info: Dict[str, Any]) -> None:
-    try:
-        evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
+    # debounce fora do lock: só quem chegou por último processa a fila
+    # o trace_id montado no webhook vira o trace do turno: logs, spans e headers HTTP de saída
+    with start_trace("turn", trace_id=info.get("trace_id"), message_type=info.get("message_type") or "") as root:
+        stages = StageTimer(TURN_STAGE_SECONDS)
+        time.sleep(max(settings.debounce_wait_seconds, 0))
+        stages.lap("debounce")
+        result = "error"
+        with track_db_stats() as db_stats:
+            try:
+                with conversation_lock(info["telefone"]):
+                    result = _handle_message(info, stages)
+            except ConversationBusy:
+                result = "busy"
+                logger.warning("conversation_lock_timeout", extra={"telefone": info.get("telefone")})
+            except Exception:
+                root.status = "error"
+                logger.exception("background_process_failed")
+            finally:
+                TURNS_TOTAL.inc(result=result)
+                root.set(result=result, **db_stats.as_dict())
+                logger.info(
+                    "message_db_stats",
+                    extra={"message_id": info.get("id_mensagem"), "result": db_stats.as_dict()},
+                )
+
+
+def _media_content(evolution: EvolutionClient, info: Dict[str, Any]) -> str:
+    """Transcrição do áudio ou referência da mídia no media store ("" para texto)."""
+    if info.get("message_type") == "audio":
+        if settings.openai_api_key:
+            return get_transcription_service().transcribe_message(evolution, info)
+        return ""
+    if info.get("message_type") not in ("image", "documentMessage"):
+        return ""
+    base64_data = info.get("image_base64") or ""
+    if not base64_data:
+        try:
+            resp = evolution.get_base64_from_media(info.get("instancia"), info.get("id_mensagem"), base_url=info.get("url_evolution"))
+            base64_data = resp.get("base64") or resp.get("data") or ""
+        except Exception:
+            base64_data = ""
+    mime_type = info.get("image_mimetype") or info.get("media_mime") or "application/octet-stream"
+    # a mídia vai para o media store; o texto da mensagem (LLM + histórico) leva só a referência
+    media_id = get_media_store().put_base64(base64_data, mime_type) if base64_data else ""
+    del base64_data
+    media_payload = {
+        "tipo": "media",
+        "media_id": media_id,
+        "mime_type": mime_type,
+        "texto": info.get("mensagem") or "",
+    }
+    return json.dumps(media_payload, ensure_ascii=False)
 
-        with get_db() as db:
-            queue = process_queue(db, info["telefone"], info["id_mensagem"], settings.debounce_wait_seconds)
+
+def _handle_message(info: Dict[str, Any], stages: Optional[StageTimer] = None) -> str:
+    """Processa a fila do telefone; devolve "replied", "silent" (agente sem resposta) ou "empty" (fila já consumida)."""
+    stages = stages or StageTimer(TURN_STAGE_SECONDS)
+    stages.lap("lock_wait")
+    evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
+
+    with get_db() as db:
+        # Fase 0 (só leitura): se outra mensagem chegou depois desta, é ela quem processa a fila.
+        if not process_queue(db, info["telefone"], info["id_mensagem"], 0):
+            return "empty"
+        # encerra a transação da leitura: download/transcrição não podem segurar conexão "idle in transaction"
+        db.rollback()
+        content = _media_content(evolution, info)
+
+        # Fase 1: fila + histórico do cliente numa única transação, sem chamadas de rede.
+        with unit_of_work(db):
+            queue = process_queue(db, info["telefone"], info["id_mensagem"], 0)
             if not queue:
-                return
-
-            # build content
-            content = ""
-            if info.get("message_type") == "audio":
-                resp = evolution.get_base64_from_media(info.get("instancia"), info.get("id_mensagem"), base_url=info.get("url_evolution"))
-                base64_data = resp.get("base64") or resp.get("data") or ""
-                if base64_data:
-                    if "," in base64_data:
-                        base64_data = base64_data.split(",")[-1]
-                    audio_bytes = base64.b64decode(base64_data)
-                    agent = _build_agent(db)
-                    content = agent.transcribe_audio(audio_bytes)
-            elif info.get("message_type") in ("image", "documentMessage"):
-                base64_data = info.get("image_base64") or ""
-                if not base64_data:
-                    try:
-                        resp = evolution.get_base64_from_media(info.get("instancia"), info.get("id_mensagem"), base_url=info.get("url_evolution"))
-                        base64_data = resp.get("base64") or resp.get("data") or ""
-                    except Exception:
-                        base64_data = ""
-                if base64_data and "," in base64_data:
-                    base64_data = base64_data.split(",")[-1]
-                media_payload = {
-                    "tipo": "media",
-                    "media_base64": base64_data,
-                    "mime_type": info.get("image_mimetype") or info.get("media_mime") or "application/octet-stream",
-                    "texto": info.get("mensagem") or "",
-                }
-                content = json.dumps(media_payload, ensure_ascii=False)
+                return "empty"
             if not content:
                 content = concat_messages(queue) or info.get("mensagem") or ""
 
+            # best-effort dentro do unit of work: o savepoint impede que um erro aqui aborte a transação
             try:
-                historico = crud.fetch_client_snapshot(db, info.get("telefone")) or {}
+                with savepoint(db):
+                    historico = crud.fetch_client_snapshot(db, info.get("telefone")) or {}
             except Exception:
                 logger.warning("snapshot_fetch_failed", exc_info=True)
                 historico = {}
@@ -202,63 +309,72 @@ def _process_message(info: Dict[str, Any]) -> None:
                 horario = format_horario(datetime.fromtimestamp(info["timestamp"], tz=timezone.utc), settings.timezone)
 
             try:
-                crud.insert_chat_history(db, info.get("telefone"), "human", content)
+                with savepoint(db):
+                    crud.insert_chat_history(db, info.get("telefone"), "human", content)
             except Exception:
                 logger.warning("history_insert_failed", exc_info=True)
 
-            agent = _build_agent(db)
-            reply = agent.run(content, info.get("telefone"), horario, historico)
-            if reply is None:
-                reply = ""
-
-            crud.clear_messages(db, info.get("telefone"))
-
+        stages.lap("ingest")
+        # O agente roda fora do unit of work: as chamadas ao LLM não seguram locks de active_sessions.
+        agent = _build_agent(db)
+        reply = agent.run(content, info.get("telefone"), horario, historico)
+        if reply is None:
+            reply = ""
+        stages.lap("agent")
+
+        # Fase 2: fechamento da mensagem numa única transação, antes do envio.
+        with unit_of_work(db):
+            crud.clear_messages(db, info.get("telefone"), ids=[m.get("id") for m in queue])
             if reply.strip():
-                parts = split_messages(reply)
-                for part in parts:
-                    evolution.send_text(info.get("instancia"), info.get("telefone"), part, base_url=info.get("url_evolution"))
-
                 crud.update_active_session_ai(db, info.get("telefone"), reply)
                 try:
-                    crud.insert_chat_history(db, info.get("telefone"), "ai", reply)
+                    with savepoint(db):
+                        crud.insert_chat_history(db, info.get("telefone"), "ai", reply)
                 except Exception:
                     logger.warning("history_insert_failed", exc_info=True)
-    except Exception:
-        logger.exception("background_process_failed")
+        stages.lap("persist")
+
+        if not reply.strip():
+            return "silent"
+        # só enfileira: o OutboundSender envia as partes em ordem, sem segurar esta thread
+        send_messages(
+            db,
+            evolution,
+            info.get("telefone"),
+            split_messages(reply),
+            instance=info.get("instancia"),
+            base_url=info.get("url_evolution"),
+            source="reply",
+        )
+        stages.lap("send")
+    return "replied"
 
 
 @router.post("/v3.1")
 async def webhook_v3(request: Request, background_tasks: BackgroundTasks):
     try:
-        payload = await request.json()
+        payload = _loads(await request.body())
     except Exception:
         return {"status": "ignored", "reason": "invalid_json"}
 
-    supported, reason = _is_supported_payload(payload)
-    if not supported:
-        return {"status": "ignored", "reason": reason or "unsupported_payload"}
-
-    missing = _missing_envs()
-    if missing:
-        logger.warning("missing_env", extra={"missing": missing})
-        return {"status": "degraded", "reason": "missing_env", "missing": missing}
+    rejected = classify_webhook(payload)
+    if rejected is not None:
+        return rejected
 
     info = parse_evolution_payload(payload)
-
-    if info.get("fromMe"):
-        return {"status": "ignored", "reason": "from_me"}
-    if info.get("mensagem_de_grupo"):
-        return {"status": "ignored", "reason": "group_message"}
-    if info.get("message_type") not in ALLOWED_TYPES:
-        return {"status": "ignored", "reason": "unsupported_message_type"}
     if not info.get("telefone") or len(info.get("telefone")) < 10:
         return {"status": "ignored", "reason": "invalid_phone"}
 
-    with get_db() as db:
-        if crud.is_duplicate_message(db, info.get("telefone"), info.get("id_mensagem")):
+    dedupe = get_message_filter()
+    dedupe_key = (info.get("telefone"), info.get("id_mensagem"))
+    hit = False
+    if dedupe is not None:
+        hit, verify = dedupe.check(dedupe_key)
+        if not verify:
             return {"status": "duplicate"}
 
-        crud.enqueue_message(
+    with get_db() as db:
+        queued = crud.ingest_inbound_message(
             db,
             {
                 "telefone": info.get("telefone"),
@@ -272,15 +388,12 @@ async def webhook_v3(request: Request, background_tasks: BackgroundTasks):
                 "message_type": info.get("message_type"),
                 "status": "pending",
             },
-        )
-
-        crud.upsert_active_session(
-            db,
-            session_id=info.get("telefone"),
             last_message=info.get("mensagem") or "",
-            last_message_type="human",
-            last_message_id=info.get("id_mensagem"),
         )
+    if dedupe is not None:
+        dedupe.record(dedupe_key, hit=hit, queued=queued)
+    if not queued:
+        return {"status": "duplicate"}
 
     background_tasks.add_task(_process_message, info)
     return {"status": "queued"}
@@ -312,6 +425,19 @@ async def cancelar_pedido(request: Request):
         return result
 
 
+def _handle_status_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    with get_db() as db:
+        evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
+        status_service = StatusService(db, evolution)
+        if not settings.status_events_async:
+            return status_service.process_event(payload)
+        # grava e responde; o aviso ao cliente sai pelo StatusNotifier (a Saipos não espera o Evolution)
+        result = status_service.record_event(payload)
+        if "queued" in result:
+            record_intake(result)
+        return result
+
+
 @router.post("/saipos-central")
 async def saipos_central(request: Request):
     payload = await request.json()
@@ -320,10 +446,7 @@ async def saipos_central(request: Request):
     if cod_store and settings.saipos_cod_store and cod_store != settings.saipos_cod_store:
         return {"status": "ignored"}
 
-    with get_db() as db:
-        evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
-        status_service = StatusService(db, evolution)
-        return status_service.process_event(payload)
+    return _handle_status_event(payload)
 
 
 @router.post("/webhooks/saipos")
@@ -334,7 +457,4 @@ async def saipos_alias(request: Request):
 @router.post("/marcio_lanches")
 async def marcio_lanches(request: Request):
     payload = await request.json()
-    with get_db() as db:
-        evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
-        status_service = StatusService(db, evolution)
-        return status_service.process_event(payload)
+    return _handle_status_event(payload)
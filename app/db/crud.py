@@ -1,19 +1,33 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 import uuid
 import json
 import logging
 import unicodedata
 
 from sqlalchemy import text
-from sqlalchemy.exc import ProgrammingError
 
+from app.db.schema import get_schema_capabilities
+from app.db.session import in_unit_of_work, savepoint
 from app.settings import settings
+from app.utils.metrics import REGISTRY, timed
 
 logger = logging.getLogger(__name__)
-_ORDERS_COLUMNS_CACHE: set[str] | None = None
+# só as funções do caminho quente levam @timed (label = nome, conjunto fechado); uma chamada a outra
+# função medida contaria o mesmo tempo duas vezes, então as internas usam os helpers com "_"
+DB_CALL_SECONDS = REGISTRY.histogram(
+    "lia_db_call_seconds", "Duração das funções de crud do caminho quente (SQL + commit)", ("fn",)
+)
+_ORDERS_JSONB_COLUMNS = frozenset({"payload", "response", "payload_snapshot", "address_snapshot"})
+
+
+def _commit(db) -> None:
+    # Dentro de um unit of work quem chamou é dono da transação: aqui só executamos.
+    if not in_unit_of_work(db):
+        db.commit()
 
 
 def _normalize_text(value: str) -> str:
@@ -46,96 +60,6 @@ def _normalize_phone_digits(phone: str | None) -> str:
     return "".join(ch for ch in str(phone) if ch.isdigit())
 
 
-def _find_client_id_by_phone(db, telefone: str) -> Optional[str]:
-    sql = text(
-        """
-        WITH inp AS (
-          SELECT regexp_replace(CAST(:tel AS text), '\\D', '', 'g') AS d
-        ),
-        cand AS (
-          SELECT d AS k FROM inp
-          UNION ALL SELECT CASE WHEN left(d,2)='55' THEN substring(d from 3) ELSE d END FROM inp
-          UNION ALL SELECT CASE WHEN left(d,2)='55' THEN d ELSE '55'||d END FROM inp
-        )
-        SELECT id
-        FROM archive.clients
-        WHERE regexp_replace(phone, '\\D', '', 'g') IN (SELECT k FROM cand)
-        LIMIT 1
-        """
-    )
-    result = db.execute(sql, {"tel": telefone}).mappings().first()
-    return result.get("id") if result else None
-
-
-def upsert_client(
-    db,
-    telefone: str,
-    nome: str | None = None,
-    email: str | None = None,
-    cpf_cnpj: str | None = None,
-    birthday: str | None = None,
-    last_purchase: datetime | None = None,
-) -> Optional[str]:
-    if not telefone:
-        return None
-    client_id = _find_client_id_by_phone(db, telefone)
-    now = datetime.utcnow()
-    if client_id:
-        sql = text(
-            """
-            UPDATE archive.clients
-            SET name = COALESCE(:name, name),
-                phone = COALESCE(:phone, phone),
-                email = COALESCE(:email, email),
-                cpf_cnpj = COALESCE(:cpf_cnpj, cpf_cnpj),
-                birthday = COALESCE(:birthday, birthday),
-                last_seen = :now,
-                last_purchase = COALESCE(:last_purchase, last_purchase)
-            WHERE id = :id
-            """
-        )
-        db.execute(
-            sql,
-            {
-                "id": client_id,
-                "name": nome,
-                "phone": telefone,
-                "email": email,
-                "cpf_cnpj": cpf_cnpj,
-                "birthday": birthday,
-                "last_purchase": last_purchase,
-                "now": now,
-            },
-        )
-        db.commit()
-        return str(client_id)
-
-    new_id = str(uuid.uuid4())
-    sql = text(
-        """
-        INSERT INTO archive.clients
-          (id, name, phone, email, cpf_cnpj, birthday, first_seen, last_seen, last_purchase)
-        VALUES
-          (:id, :name, :phone, :email, :cpf_cnpj, :birthday, :now, :now, :last_purchase)
-        """
-    )
-    db.execute(
-        sql,
-        {
-            "id": new_id,
-            "name": nome,
-            "phone": telefone,
-            "email": email,
-            "cpf_cnpj": cpf_cnpj,
-            "birthday": birthday,
-            "last_purchase": last_purchase,
-            "now": now,
-        },
-    )
-    db.commit()
-    return new_id
-
-
 def _address_fingerprint(addr: Dict[str, Any]) -> str:
     parts = [
         addr.get("street") or addr.get("rua") or "",
@@ -150,78 +74,135 @@ def _address_fingerprint(addr: Dict[str, Any]) -> str:
     return normalized
 
 
-def upsert_address(db, client_id: str, endereco: Dict[str, Any]) -> Optional[str]:
-    if not client_id or not isinstance(endereco, dict):
-        return None
-    fingerprint = _address_fingerprint(endereco)
-    if not fingerprint:
+@timed(DB_CALL_SECONDS, fn="upsert_client_address")
+def upsert_client_address(
+    db,
+    telefone: str,
+    nome: str | None = None,
+    last_purchase: datetime | None = None,
+    endereco: Dict[str, Any] | None = None,
+) -> Optional[str]:
+    """
+    Cliente e endereço num único statement (CTEs): localiza o cliente pelo telefone normalizado,
+    atualiza ou cria, e grava o endereço se o fingerprint ainda não existir para ele.
+    """
+    if not telefone:
         return None
-    existing = db.execute(
-        text(
-            """
-            SELECT id
-            FROM public.addresses
-            WHERE client_id = :client_id AND fingerprint = :fingerprint
-            LIMIT 1
-            """
-        ),
-        {"client_id": client_id, "fingerprint": fingerprint},
-    ).mappings().first()
-    if existing:
-        return str(existing.get("id"))
-
-    count = db.execute(
-        text("SELECT count(*) AS c FROM public.addresses WHERE client_id = :client_id"),
-        {"client_id": client_id},
-    ).mappings().first()
-    is_primary = True if (count and (count.get("c") or 0) == 0) else False
-
-    addr = {
-        "street": endereco.get("street") or endereco.get("rua") or "",
-        "number": endereco.get("number") or endereco.get("numero") or "",
-        "district": endereco.get("district") or endereco.get("bairro") or "",
-        "city": endereco.get("city") or endereco.get("cidade") or "",
-        "state": endereco.get("state") or endereco.get("estado") or "",
-        "postal_code": endereco.get("postal_code") or endereco.get("cep") or "",
-        "complement": endereco.get("complement") or endereco.get("complemento") or "",
-    }
-    new_id = str(uuid.uuid4())
+    endereco = endereco if isinstance(endereco, dict) else {}
+    fingerprint = _address_fingerprint(endereco) if any(endereco.values()) else ""
     sql = text(
         """
-        INSERT INTO public.addresses
-          (id, client_id, street, number, district, city, state, postal_code, complement, is_primary, fingerprint)
-        VALUES
-          (:id, :client_id, :street, :number, :district, :city, :state, :postal_code, :complement, :is_primary, :fingerprint)
+        WITH inp AS (
+          SELECT regexp_replace(CAST(:tel AS text), '\\D', '', 'g') AS d
+        ),
+        cand AS (
+          SELECT d AS k FROM inp
+          UNION ALL SELECT CASE WHEN left(d,2)='55' THEN substring(d from 3) ELSE d END FROM inp
+          UNION ALL SELECT CASE WHEN left(d,2)='55' THEN d ELSE '55'||d END FROM inp
+        ),
+        found AS (
+          SELECT id
+          FROM archive.clients
+          WHERE regexp_replace(phone, '\\D', '', 'g') IN (SELECT k FROM cand)
+          LIMIT 1
+        ),
+        upd AS (
+          UPDATE archive.clients c
+          SET name = COALESCE(CAST(:name AS text), c.name),
+              phone = COALESCE(CAST(:tel AS text), c.phone),
+              last_seen = CAST(:now AS timestamp),
+              last_purchase = COALESCE(CAST(:last_purchase AS timestamp), c.last_purchase)
+          FROM found
+          WHERE c.id = found.id
+          RETURNING c.id
+        ),
+        ins AS (
+          INSERT INTO archive.clients (id, name, phone, first_seen, last_seen, last_purchase)
+          SELECT CAST(:new_id AS uuid), CAST(:name AS text), CAST(:tel AS text), CAST(:now AS timestamp),
+                 CAST(:now AS timestamp), CAST(:last_purchase AS timestamp)
+          WHERE NOT EXISTS (SELECT 1 FROM found)
+          RETURNING id
+        ),
+        cli AS (
+          SELECT id FROM upd
+          UNION ALL
+          SELECT id FROM ins
+        ),
+        addr AS (
+          INSERT INTO public.addresses
+            (id, client_id, street, number, district, city, state, postal_code, complement, is_primary, fingerprint)
+          SELECT CAST(:addr_id AS uuid), cli.id, :street, :number, :district, :city, :state, :postal_code, :complement,
+                 NOT EXISTS (SELECT 1 FROM public.addresses a WHERE a.client_id = cli.id),
+                 CAST(:fingerprint AS text)
+          FROM cli
+          WHERE CAST(:fingerprint AS text) <> ''
+            AND NOT EXISTS (
+              SELECT 1 FROM public.addresses a
+              WHERE a.client_id = cli.id AND a.fingerprint = CAST(:fingerprint AS text)
+            )
+          RETURNING id
+        )
+        SELECT id FROM cli
         """
     )
-    db.execute(
+    row = db.execute(
         sql,
         {
-            "id": new_id,
-            "client_id": client_id,
-            **addr,
-            "is_primary": is_primary,
+            "tel": telefone,
+            "name": nome,
+            "now": datetime.utcnow(),
+            "last_purchase": last_purchase,
+            "new_id": str(uuid.uuid4()),
+            "addr_id": str(uuid.uuid4()),
+            "street": endereco.get("street") or endereco.get("rua") or "",
+            "number": endereco.get("number") or endereco.get("numero") or "",
+            "district": endereco.get("district") or endereco.get("bairro") or "",
+            "city": endereco.get("city") or endereco.get("cidade") or "",
+            "state": endereco.get("state") or endereco.get("estado") or "",
+            "postal_code": endereco.get("postal_code") or endereco.get("cep") or "",
+            "complement": endereco.get("complement") or endereco.get("complemento") or "",
             "fingerprint": fingerprint,
         },
+    ).mappings().first()
+    _commit(db)
+    return str(row.get("id")) if row and row.get("id") else None
+
+
+@lru_cache(maxsize=16)
+def _orders_insert_sql(cols: Tuple[str, ...], upsert: bool, touch_updated_at: bool, returning: bool):
+    """INSERT em public.orders para um conjunto de colunas (montado uma vez por combinação)."""
+    values = [f"CAST(:{c} AS jsonb)" if c in _ORDERS_JSONB_COLUMNS else f":{c}" for c in cols]
+    sql = f"INSERT INTO public.orders ({', '.join(cols)})\nVALUES ({', '.join(values)})"
+    if upsert:
+        updates = [f"{c} = EXCLUDED.{c}" for c in cols if c != "order_id"]
+        if touch_updated_at:
+            updates.append("updated_at = now()")
+        sql += f"\nON CONFLICT (order_id) DO UPDATE\nSET {', '.join(updates) or 'order_id = EXCLUDED.order_id'}"
+    if returning:
+        sql += "\nRETURNING id"
+    return text(sql)
+
+
+def _write_order_row(db, data: Dict[str, Any], returning: bool) -> Optional[str]:
+    caps = get_schema_capabilities(db)
+    columns = caps.columns("public.orders")
+    cols = tuple(c for c in data if c in columns)
+    if not cols:
+        return None
+    sql = _orders_insert_sql(
+        cols,
+        upsert=caps.has_unique("public.orders", "order_id"),
+        touch_updated_at="updated_at" in columns and "updated_at" not in cols,
+        returning=returning and "id" in columns,
     )
-    db.commit()
-    return new_id
-
-
-def _get_orders_columns(db) -> set[str]:
-    global _ORDERS_COLUMNS_CACHE
-    if _ORDERS_COLUMNS_CACHE is not None:
-        return _ORDERS_COLUMNS_CACHE
-    sql = text(
-        """
-        SELECT column_name
-        FROM information_schema.columns
-        WHERE table_schema = 'public' AND table_name = 'orders'
-        """
-    )
-    rows = db.execute(sql).mappings().all()
-    _ORDERS_COLUMNS_CACHE = {r.get("column_name") for r in rows if r.get("column_name")}
-    return _ORDERS_COLUMNS_CACHE
+    result = db.execute(sql, {c: data[c] for c in cols})
+    _commit(db)
+    if not returning:
+        return None
+    try:
+        return str(result.scalar_one())
+    except Exception:
+        return None
 
 
 def _calc_saipos_subtotal(payload: Dict[str, Any]) -> float:
@@ -247,10 +228,6 @@ def _insert_order_new_schema(
     cod_store: str,
     client_id: str | None = None,
 ) -> Optional[str]:
-    columns = _get_orders_columns(db)
-    if not columns:
-        return None
-
     payload: Dict[str, Any] = {}
     if payload_json:
         try:
@@ -271,57 +248,7 @@ def _insert_order_new_schema(
         "payload_snapshot": payload_json,
         "source": "lia_delivery",
     }
-
-    jsonb_cols = {"payload_snapshot", "address_snapshot"}
-    cols = [c for c in data.keys() if c in columns]
-    if not cols:
-        return None
-
-    values = []
-    for c in cols:
-        if c in jsonb_cols:
-            values.append(f"CAST(:{c} AS jsonb)")
-        else:
-            values.append(f":{c}")
-
-    updates = [f"{c} = EXCLUDED.{c}" for c in cols if c != "order_id"]
-    update_sql = ", ".join(updates) if updates else "order_id = EXCLUDED.order_id"
-
-    params = {c: data[c] for c in cols}
-    sql = text(
-        f"""
-        INSERT INTO public.orders ({', '.join(cols)})
-        VALUES ({', '.join(values)})
-        ON CONFLICT (order_id) DO UPDATE
-        SET {update_sql}
-        RETURNING id
-        """
-    )
-    try:
-        result = db.execute(sql, params)
-        db.commit()
-        try:
-            return str(result.scalar_one())
-        except Exception:
-            return None
-    except ProgrammingError as exc:
-        if "conflict" not in str(exc).lower():
-            db.rollback()
-            raise
-        db.rollback()
-        sql_no_conflict = text(
-            f"""
-            INSERT INTO public.orders ({', '.join(cols)})
-            VALUES ({', '.join(values)})
-            RETURNING id
-            """
-        )
-        result = db.execute(sql_no_conflict, params)
-        db.commit()
-        try:
-            return str(result.scalar_one())
-        except Exception:
-            return None
+    return _write_order_row(db, data, returning=True)
 
 
 def enqueue_message(db, data: Dict[str, Any]) -> None:
@@ -334,7 +261,7 @@ def enqueue_message(db, data: Dict[str, Any]) -> None:
         """
     )
     db.execute(sql, data)
-    db.commit()
+    _commit(db)
 
 
 def get_pending_messages(db, telefone: str) -> List[Dict[str, Any]]:
@@ -350,7 +277,19 @@ def get_pending_messages(db, telefone: str) -> List[Dict[str, Any]]:
     return result.mappings().all()
 
 
-def clear_messages(db, telefone: str) -> None:
+@timed(DB_CALL_SECONDS, fn="clear_messages")
+def clear_messages(db, telefone: str, ids: Optional[List[int]] = None) -> None:
+    """Remove a fila do telefone; com `ids`, só as mensagens já processadas (as novas continuam pendentes)."""
+    if ids is not None:
+        sql = text(
+            """
+            DELETE FROM public.n8n_fila_mensagens
+            WHERE telefone = :telefone AND id = ANY(:ids)
+            """
+        )
+        db.execute(sql, {"telefone": telefone, "ids": [int(i) for i in ids]})
+        _commit(db)
+        return
     sql = text(
         """
         DELETE FROM public.n8n_fila_mensagens
@@ -358,7 +297,7 @@ def clear_messages(db, telefone: str) -> None:
         """
     )
     db.execute(sql, {"telefone": telefone})
-    db.commit()
+    _commit(db)
 
 
 def upsert_active_session(
@@ -392,9 +331,10 @@ def upsert_active_session(
             "last_message_id": last_message_id,
         },
     )
-    db.commit()
+    _commit(db)
 
 
+@timed(DB_CALL_SECONDS, fn="update_active_session_ai")
 def update_active_session_ai(db, session_id: str, last_message: str) -> None:
     sql = text(
         """
@@ -406,10 +346,14 @@ def update_active_session_ai(db, session_id: str, last_message: str) -> None:
         """
     )
     db.execute(sql, {"session_id": session_id, "last_message": last_message})
-    db.commit()
+    _commit(db)
 
 
+@timed(DB_CALL_SECONDS, fn="increment_session_tokens")
 def increment_session_tokens(db, session_id: str, prompt_tokens: int, completion_tokens: int, total_tokens: int) -> None:
+    if not get_schema_capabilities(db).session_tokens:
+        # migração 005 ainda não aplicada
+        return
     sql = text(
         """
         UPDATE public.active_sessions
@@ -430,22 +374,32 @@ def increment_session_tokens(db, session_id: str, prompt_tokens: int, completion
             "total_tokens": int(total_tokens or 0),
         },
     )
-    db.commit()
+    _commit(db)
 
 
-def update_active_session_finished(db, session_id: str) -> None:
+@timed(DB_CALL_SECONDS, fn="finish_active_session")
+def finish_active_session(db, session_id: str) -> None:
+    """Encerra a sessão ativa e limpa o carrinho num único UPDATE (fim do pedido)."""
     sql = text(
         """
         UPDATE public.active_sessions
-        SET status = 'finished', updated_at = now()
+        SET status = 'finished',
+            cart_json = NULL,
+            cart_updated_at = now(),
+            updated_at = now()
         WHERE session_id = :session_id AND status = 'active'
         """
     )
     db.execute(sql, {"session_id": session_id})
-    db.commit()
+    _commit(db)
 
 
+@timed(DB_CALL_SECONDS, fn="fetch_cart")
 def fetch_cart(db, session_id: str) -> Optional[Dict[str, Any]]:
+    return _select_cart(db, session_id)
+
+
+def _select_cart(db, session_id: str) -> Optional[Dict[str, Any]]:
     sql = text(
         """
         SELECT cart_json
@@ -473,12 +427,13 @@ def update_cart(db, session_id: str, cart: Dict[str, Any]) -> Dict[str, Any]:
         """
     )
     db.execute(sql, {"session_id": session_id, "cart_json": json.dumps(cart)})
-    db.commit()
+    _commit(db)
     return cart
 
 
+@timed(DB_CALL_SECONDS, fn="patch_cart")
 def patch_cart(db, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
-    current = fetch_cart(db, session_id) or {}
+    current = _select_cart(db, session_id) or {}
     if not isinstance(current, dict):
         current = {}
     for key, value in patch.items():
@@ -488,6 +443,7 @@ def patch_cart(db, session_id: str, patch: Dict[str, Any]) -> Dict[str, Any]:
     return update_cart(db, session_id, current)
 
 
+@timed(DB_CALL_SECONDS, fn="clear_cart")
 def clear_cart(db, session_id: str) -> None:
     sql = text(
         """
@@ -499,7 +455,7 @@ def clear_cart(db, session_id: str) -> None:
         """
     )
     db.execute(sql, {"session_id": session_id})
-    db.commit()
+    _commit(db)
 
 
 def get_active_session(db, session_id: str) -> Optional[Dict[str, Any]]:
@@ -515,13 +471,62 @@ def get_active_session(db, session_id: str) -> Optional[Dict[str, Any]]:
 
 
 def is_duplicate_message(db, session_id: str, message_id: str) -> bool:
-    session = get_active_session(db, session_id)
-    if not session:
-        return False
-    last_id = session.get("last_message_id")
+    sql = text(
+        """
+        SELECT last_message_id FROM public.active_sessions
+        WHERE session_id = :session_id AND status = 'active'
+        LIMIT 1
+        """
+    )
+    last_id = db.execute(sql, {"session_id": session_id}).scalar()
     return bool(last_id and message_id and last_id == message_id)
 
 
+@timed(DB_CALL_SECONDS, fn="ingest_inbound_message")
+def ingest_inbound_message(db, data: Dict[str, Any], last_message: str) -> bool:
+    """
+    Dedupe + enfileiramento + upsert da sessão num único statement.
+    Retorna False quando a mensagem já foi recebida (ainda na fila ou já processada).
+    """
+    sql = text(
+        """
+        WITH prev AS (
+          SELECT 1
+          FROM public.active_sessions
+          WHERE session_id = :telefone AND status = 'active' AND last_message_id = :id_mensagem
+        ),
+        ins AS (
+          INSERT INTO public.n8n_fila_mensagens
+            (telefone, mensagem, timestamp, id_mensagem, client_id, trace_id, message_id, remote_jid, message_type, status)
+          SELECT :telefone, :mensagem, :timestamp, :id_mensagem, :client_id, :trace_id, :message_id, :remote_jid,
+                 :message_type, :status
+          WHERE NOT EXISTS (SELECT 1 FROM prev)
+          ON CONFLICT (telefone, id_mensagem) DO NOTHING
+          RETURNING id
+        ),
+        sess AS (
+          INSERT INTO public.active_sessions AS s
+            (session_id, last_message, last_message_type, status, last_message_id)
+          SELECT :telefone, :last_message, 'human', 'active', :id_mensagem
+          WHERE EXISTS (SELECT 1 FROM ins)
+          ON CONFLICT (session_id) WHERE (status = 'active')
+          DO UPDATE
+             SET last_message = EXCLUDED.last_message,
+                 last_message_type = EXCLUDED.last_message_type,
+                 last_message_id = EXCLUDED.last_message_id,
+                 updated_at = now(),
+                 followup_sent_at = NULL
+          RETURNING s.id
+        )
+        SELECT EXISTS (SELECT 1 FROM ins) AS queued, (SELECT count(*) FROM sess) AS sessions
+        """
+    )
+    row = db.execute(sql, {**data, "last_message": last_message}).mappings().first()
+    _commit(db)
+    return bool(row and row.get("queued"))
+
+
+@timed(DB_CALL_SECONDS, fn="fetch_client_snapshot")
 def fetch_client_snapshot(db, telefone: str) -> Optional[Dict[str, Any]]:
     sql = text(
         """
@@ -544,11 +549,13 @@ def fetch_client_snapshot(db, telefone: str) -> Optional[Dict[str, Any]]:
     return result
 
 
+@timed(DB_CALL_SECONDS, fn="fetch_menu_search_index")
 def fetch_menu_search_index(db) -> List[Dict[str, Any]]:
     result = db.execute(text("SELECT * FROM v_menu_search_index"))
     return result.mappings().all()
 
 
+@timed(DB_CALL_SECONDS, fn="fetch_cardapio")
 def fetch_cardapio(db) -> List[Dict[str, Any]]:
     result = db.execute(
         text(
@@ -561,6 +568,7 @@ def fetch_cardapio(db) -> List[Dict[str, Any]]:
     return result.mappings().all()
 
 
+@timed(DB_CALL_SECONDS, fn="fetch_delivery_fee")
 def fetch_delivery_fee(db, bairro: str) -> List[Dict[str, Any]]:
     cidade = settings.delivery_city or "Itajaí"
     sql = text(
@@ -577,25 +585,20 @@ def fetch_delivery_fee(db, bairro: str) -> List[Dict[str, Any]]:
         LIMIT 10
         """
     )
-    try:
-        result = db.execute(sql, {"bairro": bairro, "cidade": cidade}).mappings().all()
-        return result
-    except ProgrammingError as exc:
-        if "unaccent" not in str(exc).lower():
-            raise
-        db.rollback()
-        logger.warning("delivery_fee_unaccent_missing_fallback", extra={"cidade": cidade})
-        fallback_sql = text(
-            """
-            SELECT district AS bairro, delivery_fee AS taxa_entrega, city AS cidade
-            FROM delivery_areas
-            WHERE active = true
-              AND lower(city) = lower(:cidade)
-            ORDER BY district
-            """
-        )
-        rows = db.execute(fallback_sql, {"cidade": cidade}).mappings().all()
-        return _filter_delivery_areas(rows, bairro)
+    if get_schema_capabilities(db).has_extension("unaccent"):
+        return db.execute(sql, {"bairro": bairro, "cidade": cidade}).mappings().all()
+    # sem a extensão unaccent: filtra pela cidade e compara o bairro sem acento em Python
+    fallback_sql = text(
+        """
+        SELECT district AS bairro, delivery_fee AS taxa_entrega, city AS cidade
+        FROM delivery_areas
+        WHERE active = true
+          AND lower(city) = lower(:cidade)
+        ORDER BY district
+        """
+    )
+    rows = db.execute(fallback_sql, {"cidade": cidade}).mappings().all()
+    return _filter_delivery_areas(rows, bairro)
 
 
 def fetch_stage_rules(db, stage: str) -> Optional[Dict[str, Any]]:
@@ -612,6 +615,7 @@ def fetch_stage_rules(db, stage: str) -> Optional[Dict[str, Any]]:
     return result
 
 
+@timed(DB_CALL_SECONDS, fn="insert_order")
 def insert_order(
     db,
     order_id: str,
@@ -624,22 +628,10 @@ def insert_order(
 ) -> Optional[str]:
     payload_json = json.dumps(payload) if payload is not None else None
     response_json = json.dumps(response) if response is not None else None
-    columns = _get_orders_columns(db)
-    if "payload_snapshot" in columns:
+    if get_schema_capabilities(db).orders_new_schema:
         return _insert_order_new_schema(db, order_id, status, payload_json, response_json, cod_store, client_id=client_id)
-    sql = text(
-        """
-        INSERT INTO public.orders (order_id, telefone, status, payload, response, cod_store)
-        VALUES (:order_id, :telefone, :status, CAST(:payload AS jsonb), CAST(:response AS jsonb), :cod_store)
-        ON CONFLICT (order_id) DO UPDATE
-        SET status = EXCLUDED.status,
-            payload = EXCLUDED.payload,
-            response = EXCLUDED.response,
-            cod_store = EXCLUDED.cod_store,
-            updated_at = now()
-        """
-    )
-    params = {
+    # schema antigo: grava só as colunas que existem (telefone é opcional em algumas instalações)
+    data = {
         "order_id": order_id,
         "telefone": telefone,
         "status": status,
@@ -647,37 +639,10 @@ def insert_order(
         "response": response_json,
         "cod_store": cod_store,
     }
-    try:
-        db.execute(sql, params)
-        db.commit()
-    except ProgrammingError as exc:
-        if "telefone" not in str(exc).lower():
-            db.rollback()
-            raise
-        db.rollback()
-        fallback_sql = text(
-            """
-            INSERT INTO public.orders (order_id, status, payload, response, cod_store)
-            VALUES (:order_id, :status, CAST(:payload AS jsonb), CAST(:response AS jsonb), :cod_store)
-            ON CONFLICT (order_id) DO UPDATE
-            SET status = EXCLUDED.status,
-                payload = EXCLUDED.payload,
-                response = EXCLUDED.response,
-                cod_store = EXCLUDED.cod_store,
-                updated_at = now()
-            """
-        )
-        fallback_params = {
-            "order_id": order_id,
-            "status": status,
-            "payload": payload_json,
-            "response": response_json,
-            "cod_store": cod_store,
-        }
-        db.execute(fallback_sql, fallback_params)
-        db.commit()
+    return _write_order_row(db, data, returning=False)
 
 
+@timed(DB_CALL_SECONDS, fn="insert_order_items")
 def insert_order_items(db, order_db_id: str, items: List[Dict[str, Any]]) -> None:
     if not order_db_id or not items:
         return
@@ -713,22 +678,24 @@ def insert_order_items(db, order_db_id: str, items: List[Dict[str, Any]]) -> Non
                     "notes": "",
                 }
             )
+    if not rows:
+        return
+    # um único INSERT para todos os itens e adicionais (uma ida ao banco, em vez de executemany)
     sql = text(
         """
         INSERT INTO public.order_items
           (id, order_id, pdv, description, item_type, quantity, unit_price, notes)
-        VALUES
-          (:id, :order_id, :pdv, :description, :item_type, :quantity, :unit_price, :notes)
+        SELECT r.id, r.order_id, r.pdv, r.description, r.item_type, r.quantity, r.unit_price, r.notes
+        FROM jsonb_populate_recordset(NULL::public.order_items, CAST(:rows AS jsonb)) AS r
         """
     )
-    db.execute(sql, rows)
-    db.commit()
+    db.execute(sql, {"rows": json.dumps(rows)})
+    _commit(db)
 
 
 def update_order_status(db, order_id: str, status: str, response: Dict[str, Any] | None = None) -> None:
     response_json = json.dumps(response) if response is not None else None
-    columns = _get_orders_columns(db)
-    if "response" not in columns:
+    if not get_schema_capabilities(db).has_columns("public.orders", "response"):
         sql = text(
             """
             UPDATE public.orders
@@ -737,7 +704,7 @@ def update_order_status(db, order_id: str, status: str, response: Dict[str, Any]
             """
         )
         db.execute(sql, {"order_id": order_id, "status": status})
-        db.commit()
+        _commit(db)
         return
     sql = text(
         """
@@ -747,7 +714,7 @@ def update_order_status(db, order_id: str, status: str, response: Dict[str, Any]
         """
     )
     db.execute(sql, {"order_id": order_id, "status": status, "response": response_json})
-    db.commit()
+    _commit(db)
 
 
 def get_order(db, order_id: str) -> Optional[Dict[str, Any]]:
@@ -759,52 +726,488 @@ def get_order(db, order_id: str) -> Optional[Dict[str, Any]]:
     return db.execute(sql, {"order_id": order_id}).mappings().first()
 
 
-def delete_saipos_menu_raw(db, client_id: str) -> None:
+_SAIPOS_MENU_COLUMNS = (
+    "client_id",
+    "tipo",
+    "categoria",
+    "tamanho",
+    "id_store_item",
+    "item",
+    "id_store_choice",
+    "complemento",
+    "complemento_item",
+    "price",
+    "codigo_saipos",
+    "store_item_enabled",
+    "store_choice_enabled",
+    "store_choice_item_enabled",
+    "item_type",
+    "pdv_code",
+    "parent_pdv_code",
+    "row_hash",
+)
+
+
+def fetch_saipos_menu_hashes(db, client_id: str) -> List[Dict[str, Any]]:
+    sql = text(
+        """
+        SELECT id, codigo_saipos, id_store_choice, row_hash
+        FROM public.saipos_menu_raw
+        WHERE client_id = CAST(:client_id AS uuid)
+        ORDER BY id
+        """
+    )
+    return db.execute(sql, {"client_id": client_id}).mappings().all()
+
+
+def fetch_menu_version(db, client_id: str) -> int:
+    sql = text(
+        """
+        SELECT version FROM public.menu_version WHERE client_id = CAST(:client_id AS uuid)
+        """
+    )
+    result = db.execute(sql, {"client_id": client_id}).mappings().first()
+    return int(result.get("version") or 0) if result else 0
+
+
+def fetch_menu_catalog_hash(db, client_id: str) -> Optional[str]:
+    sql = text(
+        """
+        SELECT catalog_hash FROM public.menu_version WHERE client_id = CAST(:client_id AS uuid)
+        """
+    )
+    result = db.execute(sql, {"client_id": client_id}).mappings().first()
+    return result.get("catalog_hash") if result else None
+
+
+def set_menu_catalog_hash(db, client_id: str, catalog_hash: str) -> None:
+    sql = text(
+        """
+        INSERT INTO public.menu_version AS v (client_id, version, catalog_hash, catalog_checked_at)
+        VALUES (CAST(:client_id AS uuid), 0, :catalog_hash, now())
+        ON CONFLICT (client_id) DO UPDATE
+        SET catalog_hash = EXCLUDED.catalog_hash,
+            catalog_checked_at = now()
+        """
+    )
+    db.execute(sql, {"client_id": client_id, "catalog_hash": catalog_hash})
+    _commit(db)
+
+
+def try_advisory_lock(conn, name: str) -> bool:
+    result = conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:name)) AS locked"), {"name": name})
+    return bool(result.scalar())
+
+
+def advisory_unlock(conn, name: str) -> None:
+    conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": name})
+
+
+def fetch_saipos_token(conn, cache_key: str) -> Optional[Tuple[str, float]]:
+    sql = text(
+        """
+        SELECT token, EXTRACT(EPOCH FROM expires_at) AS expires_at
+        FROM public.saipos_token
+        WHERE cache_key = :cache_key AND expires_at > now()
+        """
+    )
+    row = conn.execute(sql, {"cache_key": cache_key}).mappings().first()
+    if not row:
+        return None
+    return row["token"], float(row["expires_at"])
+
+
+def save_saipos_token(conn, cache_key: str, token: str, expires_at: float) -> None:
+    sql = text(
+        """
+        INSERT INTO public.saipos_token (cache_key, token, expires_at, updated_at)
+        VALUES (:cache_key, :token, to_timestamp(CAST(:expires_at AS double precision)), now())
+        ON CONFLICT (cache_key) DO UPDATE
+        SET token = EXCLUDED.token, expires_at = EXCLUDED.expires_at, updated_at = now()
+        """
+    )
+    conn.execute(sql, {"cache_key": cache_key, "token": token, "expires_at": expires_at})
+
+
+def try_conversation_lock(conn, telefone: str) -> bool:
+    result = conn.execute(
+        text("SELECT pg_try_advisory_lock(hashtext('lia_conversation'), hashtext(:telefone)) AS locked"),
+        {"telefone": telefone},
+    )
+    return bool(result.scalar())
+
+
+def conversation_unlock(conn, telefone: str) -> None:
+    conn.execute(
+        text("SELECT pg_advisory_unlock(hashtext('lia_conversation'), hashtext(:telefone))"),
+        {"telefone": telefone},
+    )
+
+
+def apply_saipos_menu_diff(
+    db,
+    client_id: str,
+    inserts: List[Dict[str, Any]],
+    updates: List[Dict[str, Any]],
+    delete_ids: List[int],
+) -> int:
+    """Aplica inserts/updates/deletes e incrementa a versão do cardápio numa única transação."""
+    cols = ", ".join(_SAIPOS_MENU_COLUMNS)
+    values = ", ".join(f":{c}" for c in _SAIPOS_MENU_COLUMNS)
+    assignments = ", ".join(f"{c} = :{c}" for c in _SAIPOS_MENU_COLUMNS if c != "client_id")
+    try:
+        if delete_ids:
+            db.execute(
+                text("DELETE FROM public.saipos_menu_raw WHERE id = ANY(:ids)"),
+                {"ids": list(delete_ids)},
+            )
+        if updates:
+            db.execute(
+                text(f"UPDATE public.saipos_menu_raw SET {assignments}, updated_at = now() WHERE id = :id"),
+                updates,
+            )
+        if inserts:
+            db.execute(text(f"INSERT INTO public.saipos_menu_raw ({cols}) VALUES ({values})"), inserts)
+        result = db.execute(
+            text(
+                """
+                INSERT INTO public.menu_version AS v (client_id, version, inserted, updated, deleted, updated_at)
+                VALUES (CAST(:client_id AS uuid), 1, :inserted, :updated, :deleted, now())
+                ON CONFLICT (client_id) DO UPDATE
+                SET version = v.version + 1,
+                    inserted = EXCLUDED.inserted,
+                    updated = EXCLUDED.updated,
+                    deleted = EXCLUDED.deleted,
+                    updated_at = now()
+                RETURNING version
+                """
+            ),
+            {
+                "client_id": client_id,
+                "inserted": len(inserts),
+                "updated": len(updates),
+                "deleted": len(delete_ids),
+            },
+        )
+        version = int(result.scalar_one())
+        _commit(db)
+        return version
+    except Exception:
+        db.rollback()
+        raise
+
+
+def create_saipos_menu_stage(db) -> None:
+    db.execute(
+        text(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS saipos_menu_stage (
+              seq BIGSERIAL,
+              client_id UUID,
+              tipo TEXT,
+              categoria TEXT,
+              tamanho TEXT,
+              id_store_item BIGINT,
+              item TEXT,
+              id_store_choice BIGINT,
+              complemento TEXT,
+              complemento_item TEXT,
+              price NUMERIC,
+              codigo_saipos TEXT,
+              store_item_enabled TEXT,
+              store_choice_enabled TEXT,
+              store_choice_item_enabled TEXT,
+              item_type TEXT,
+              pdv_code TEXT,
+              parent_pdv_code TEXT,
+              row_hash TEXT
+            ) ON COMMIT DROP
+            """
+        )
+    )
+
+
+def copy_saipos_menu_stage(db, rows: List[Dict[str, Any]]) -> None:
+    """Carrega um chunk de linhas na tabela de staging (COPY quando o driver suporta)."""
+    if not rows:
+        return
+    cols = ", ".join(_SAIPOS_MENU_COLUMNS)
+    raw = getattr(db.connection().connection, "driver_connection", None)
+    cursor = raw.cursor() if raw is not None else None
+    if cursor is not None and hasattr(cursor, "copy"):
+        with cursor:
+            with cursor.copy(f"COPY saipos_menu_stage ({cols}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(tuple(row.get(c) for c in _SAIPOS_MENU_COLUMNS))
+        return
+    values = ", ".join(f":{c}" for c in _SAIPOS_MENU_COLUMNS)
+    db.execute(text(f"INSERT INTO saipos_menu_stage ({cols}) VALUES ({values})"), rows)
+
+
+def apply_saipos_menu_stage(db, client_id: str, catalog_hash: Optional[str] = None) -> Dict[str, int]:
+    """Aplica o diff staging -> saipos_menu_raw (e o bump de versão) numa única transação."""
+    cols = ", ".join(_SAIPOS_MENU_COLUMNS)
+    stage_cols = ", ".join(f"s.{c}" for c in _SAIPOS_MENU_COLUMNS)
+    assignments = ", ".join(f"{c} = s.{c}" for c in _SAIPOS_MENU_COLUMNS if c != "client_id")
     sql = text(
+        f"""
+        WITH cur AS (
+          SELECT id, row_hash,
+                 COALESCE(codigo_saipos, '') AS k1,
+                 COALESCE(id_store_choice, -1) AS k2,
+                 row_number() OVER (
+                   PARTITION BY COALESCE(codigo_saipos, ''), COALESCE(id_store_choice, -1) ORDER BY id
+                 ) AS n
+          FROM public.saipos_menu_raw
+          WHERE client_id = CAST(:client_id AS uuid)
+        ),
+        stg AS (
+          SELECT seq, row_hash,
+                 COALESCE(codigo_saipos, '') AS k1,
+                 COALESCE(id_store_choice, -1) AS k2,
+                 row_number() OVER (
+                   PARTITION BY COALESCE(codigo_saipos, ''), COALESCE(id_store_choice, -1) ORDER BY seq
+                 ) AS n
+          FROM saipos_menu_stage
+        ),
+        pairs AS (
+          SELECT c.id AS cur_id, c.row_hash AS cur_hash, s.seq, s.row_hash AS stg_hash
+          FROM stg s
+          FULL JOIN cur c ON c.k1 = s.k1 AND c.k2 = s.k2 AND c.n = s.n
+        ),
+        del AS (
+          DELETE FROM public.saipos_menu_raw r
+          USING pairs p
+          WHERE p.seq IS NULL AND r.id = p.cur_id
+          RETURNING r.id
+        ),
+        upd AS (
+          UPDATE public.saipos_menu_raw r
+          SET {assignments}, updated_at = now()
+          FROM pairs p
+          JOIN saipos_menu_stage s ON s.seq = p.seq
+          WHERE p.cur_id IS NOT NULL AND r.id = p.cur_id AND p.cur_hash IS DISTINCT FROM p.stg_hash
+          RETURNING r.id
+        ),
+        ins AS (
+          INSERT INTO public.saipos_menu_raw ({cols})
+          SELECT {stage_cols}
+          FROM saipos_menu_stage s
+          JOIN pairs p ON p.seq = s.seq
+          WHERE p.cur_id IS NULL
+          ORDER BY s.seq
+          RETURNING id
+        )
+        SELECT (SELECT count(*) FROM ins) AS inserted,
+               (SELECT count(*) FROM upd) AS updated,
+               (SELECT count(*) FROM del) AS deleted,
+               (SELECT count(*) FROM saipos_menu_stage) AS total
         """
-        DELETE FROM public.saipos_menu_raw WHERE client_id = :client_id::uuid
+    )
+    try:
+        counts = dict(db.execute(sql, {"client_id": client_id}).mappings().first() or {})
+        counts = {k: int(counts.get(k) or 0) for k in ("inserted", "updated", "deleted", "total")}
+        version_sql = text(
+            """
+            INSERT INTO public.menu_version AS v
+              (client_id, version, inserted, updated, deleted, catalog_hash, catalog_checked_at, updated_at)
+            VALUES (CAST(:client_id AS uuid), :bump, :inserted, :updated, :deleted, :catalog_hash, now(), now())
+            ON CONFLICT (client_id) DO UPDATE
+            SET version = v.version + :bump,
+                inserted = EXCLUDED.inserted,
+                updated = EXCLUDED.updated,
+                deleted = EXCLUDED.deleted,
+                catalog_hash = COALESCE(EXCLUDED.catalog_hash, v.catalog_hash),
+                catalog_checked_at = now(),
+                updated_at = CASE WHEN :bump > 0 THEN now() ELSE v.updated_at END
+            RETURNING version
+            """
+        )
+        changed = counts["inserted"] + counts["updated"] + counts["deleted"]
+        result = db.execute(
+            version_sql,
+            {
+                "client_id": client_id,
+                "bump": 1 if changed else 0,
+                "inserted": counts["inserted"],
+                "updated": counts["updated"],
+                "deleted": counts["deleted"],
+                "catalog_hash": catalog_hash,
+            },
+        )
+        counts["version"] = int(result.scalar_one())
+        _commit(db)
+        return counts
+    except Exception:
+        db.rollback()
+        raise
+
+
+def fetch_menu_catalog(db) -> List[Dict[str, Any]]:
+    sql = text(
+        """
+        SELECT item_id::text AS item_id, pdv, display_name, category, price::numeric AS price
+        FROM v_menu_catalog
+        WHERE active = true
+        ORDER BY category, display_name
         """
     )
-    db.execute(sql, {"client_id": client_id})
-    db.commit()
+    return db.execute(sql).mappings().all()
 
 
-def insert_saipos_menu_raw(db, rows: List[Dict[str, Any]]) -> None:
+def fetch_menu_embedding_hashes(db) -> Dict[str, str]:
+    sql = text(
+        """
+        SELECT pdv, content_hash
+        FROM public.menu_embeddings
+        WHERE pdv IS NOT NULL
+        """
+    )
+    rows = db.execute(sql).mappings().all()
+    return {str(r.get("pdv")): r.get("content_hash") or "" for r in rows}
+
+
+def upsert_menu_embeddings(db, rows: List[Dict[str, Any]]) -> None:
     if not rows:
         return
     sql = text(
         """
-        INSERT INTO public.saipos_menu_raw
-        (client_id, tipo, categoria, tamanho, id_store_item, item, id_store_choice, complemento, complemento_item,
-         price, codigo_saipos, store_item_enabled, store_choice_enabled, store_choice_item_enabled, item_type,
-         pdv_code, parent_pdv_code)
+        INSERT INTO public.menu_embeddings
+          (pdv, display_name, category, price, embedding, content_hash, updated_at)
         VALUES
-        (:client_id, :tipo, :categoria, :tamanho, :id_store_item, :item, :id_store_choice, :complemento, :complemento_item,
-         :price, :codigo_saipos, :store_item_enabled, :store_choice_enabled, :store_choice_item_enabled, :item_type,
-         :pdv_code, :parent_pdv_code)
+          (:pdv, :display_name, :category, :price, CAST(:embedding AS vector), :content_hash, now())
+        ON CONFLICT (pdv) DO UPDATE
+        SET display_name = EXCLUDED.display_name,
+            category = EXCLUDED.category,
+            price = EXCLUDED.price,
+            embedding = EXCLUDED.embedding,
+            content_hash = EXCLUDED.content_hash,
+            updated_at = now()
         """
     )
     db.execute(sql, rows)
-    db.commit()
+    _commit(db)
 
 
-def fetch_followup_candidates(db) -> List[Dict[str, Any]]:
+def fetch_menu_embeddings(db) -> List[Dict[str, Any]]:
     sql = text(
         """
-        SELECT id, session_id, last_message, last_message_type, updated_at, followup_count
-        FROM public.active_sessions
-        WHERE status = 'active'
-          AND last_message_type IN ('ai','human')
-          AND updated_at < now() - interval '10 minutes'
-          AND COALESCE(followup_count,0) < 2
-          AND followup_sent_at IS NULL
-        ORDER BY updated_at ASC
-        LIMIT 200
+        SELECT pdv, display_name, embedding::text AS embedding
+        FROM public.menu_embeddings
+        WHERE pdv IS NOT NULL AND embedding IS NOT NULL
         """
     )
     return db.execute(sql).mappings().all()
 
 
+@timed(DB_CALL_SECONDS, fn="search_menu_embeddings")
+def search_menu_embeddings(db, embedding: str, limit: int = 3) -> List[Dict[str, Any]]:
+    sql = text(
+        """
+        SELECT pdv, display_name, 1 - (embedding <=> CAST(:embedding AS vector)) AS similarity
+        FROM public.menu_embeddings
+        WHERE embedding IS NOT NULL
+        ORDER BY embedding <=> CAST(:embedding AS vector)
+        LIMIT :limit
+        """
+    )
+    return db.execute(sql, {"embedding": embedding, "limit": limit}).mappings().all()
+
+
+def claim_followup_candidates(
+    db,
+    limit: int = 200,
+    lease_seconds: int = 600,
+    after: Optional[Tuple[datetime, int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Reserva atomicamente os candidatos a follow-up (FOR UPDATE SKIP LOCKED + followup_claimed_at):
+    dois runners nunca recebem a mesma sessão. Um claim não liberado expira após `lease_seconds`.
+
+    O predicado é o do índice parcial idx_active_sessions_followup_candidates; `after` é o cursor
+    (updated_at, id) da última linha da página anterior (keyset, sem OFFSET).
+    """
+    keyset = "AND (updated_at, id) > (CAST(:after_ts AS timestamptz), CAST(:after_id AS bigint))" if after else ""
+    sql = text(
+        f"""
+        WITH cand AS (
+          SELECT id
+          FROM public.active_sessions
+          WHERE status = 'active'
+            AND last_message_type IN ('ai','human')
+            AND COALESCE(followup_count,0) < 2
+            AND followup_sent_at IS NULL
+            AND updated_at < now() - interval '10 minutes'
+            AND (followup_claimed_at IS NULL
+                 OR followup_claimed_at < now() - make_interval(secs => CAST(:lease AS int)))
+            {keyset}
+          ORDER BY updated_at ASC, id ASC
+          LIMIT :limit
+          FOR UPDATE SKIP LOCKED
+        )
+        , claimed AS (
+          UPDATE public.active_sessions s
+          SET followup_claimed_at = now()
+          FROM cand
+          WHERE s.id = cand.id
+          RETURNING s.id, s.session_id, s.last_message, s.last_message_type, s.updated_at, s.followup_count, s.cart_json
+        )
+        SELECT * FROM claimed ORDER BY updated_at ASC, id ASC
+        """
+    )
+    params: Dict[str, Any] = {"limit": int(limit), "lease": int(lease_seconds)}
+    if after:
+        params["after_ts"], params["after_id"] = after
+    rows = db.execute(sql, params).mappings().all()
+    _commit(db)
+    return rows
+
+
+def archive_finished_sessions(db, older_than_days: int, batch_size: int = 5000) -> int:
+    """
+    Move um lote de sessões encerradas há mais de `older_than_days` para active_sessions_archive.
+    Um id já arquivado (arquivo restaurado, id reaproveitado) é sobrescrito pela linha apagada agora:
+    com DO NOTHING a linha sairia de active_sessions sem chegar ao arquivo.
+    """
+    sql = text(
+        """
+        WITH old AS (
+          SELECT id
+          FROM public.active_sessions
+          WHERE status <> 'active'
+            AND updated_at < now() - make_interval(days => CAST(:days AS int))
+          ORDER BY updated_at ASC
+          LIMIT :batch
+          FOR UPDATE SKIP LOCKED
+        )
+        , moved AS (
+          DELETE FROM public.active_sessions s
+          USING old
+          WHERE s.id = old.id
+          RETURNING s.*
+        )
+        INSERT INTO public.active_sessions_archive (id, session_id, status, updated_at, data)
+        SELECT m.id, m.session_id, m.status, m.updated_at, to_jsonb(m)
+        FROM moved m
+        ON CONFLICT (id) DO UPDATE
+        SET session_id = EXCLUDED.session_id,
+            status = EXCLUDED.status,
+            updated_at = EXCLUDED.updated_at,
+            archived_at = now(),
+            data = EXCLUDED.data
+        """
+    )
+    result = db.execute(sql, {"days": int(older_than_days), "batch": int(batch_size)})
+    _commit(db)
+    return result.rowcount or 0
+
+
+def release_followup_claim(db, session_id: str) -> None:
+    sql = text("UPDATE public.active_sessions SET followup_claimed_at = NULL WHERE session_id = :session_id")
+    db.execute(sql, {"session_id": session_id})
+    _commit(db)
+
+
 def mark_followup_sent(db, session_id: str, message: str) -> None:
     sql = text(
         """
@@ -814,14 +1217,16 @@ def mark_followup_sent(db, session_id: str, message: str) -> None:
           last_message_type = 'ai',
           updated_at = NOW(),
           followup_sent_at = NOW(),
+          followup_claimed_at = NULL,
           followup_count = COALESCE(followup_count, 0) + 1
         WHERE session_id = :session_id AND status = 'active'
         """
     )
     db.execute(sql, {"session_id": session_id, "message": message})
-    db.commit()
+    _commit(db)
 
 
+@timed(DB_CALL_SECONDS, fn="insert_chat_history")
 def insert_chat_history(db, session_id: str, role: str, content: str) -> None:
     message = {
         "type": role,
@@ -836,83 +1241,49 @@ def insert_chat_history(db, session_id: str, role: str, content: str) -> None:
         VALUES (:session_id, CAST(:message AS jsonb))
         """
     )
-    try:
+    with savepoint(db):
         db.execute(sql, {"session_id": session_id, "message": json.dumps(message)})
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
+    _commit(db)
 
 
+@timed(DB_CALL_SECONDS, fn="insert_order_audit")
 def insert_order_audit(
     db,
     session_id: str,
     telefone: str,
     trace_id: Optional[str],
-    status: str,
     agent_order_json: Dict[str, Any],
-    saipos_payload_json: Dict[str, Any],
+    status: str,
+    saipos_payload_json: Dict[str, Any] | None = None,
     error: Optional[str] = None,
-) -> None:
-    sql = text(
-        """
-        INSERT INTO public.order_audit
-          (session_id, telefone, trace_id, status, agent_order_json, saipos_payload_json, error)
-        VALUES
-          (:session_id, :telefone, :trace_id, :status, CAST(:agent_order_json AS jsonb), CAST(:saipos_payload_json AS jsonb), :error)
-        """
-    )
-    try:
-        db.execute(
-            sql,
-            {
-                "session_id": session_id,
-                "telefone": telefone,
-                "trace_id": trace_id,
-                "status": status,
-                "agent_order_json": json.dumps(agent_order_json),
-                "saipos_payload_json": json.dumps(saipos_payload_json),
-                "error": error,
-            },
-        )
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
-
-
-def insert_order_audit_raw(
-    db,
-    session_id: str,
-    telefone: str,
-    trace_id: Optional[str],
-    agent_order_json: Dict[str, Any],
 ) -> Optional[int]:
+    """Auditoria do pedido já com o status final da montagem (prepared/failed) e o payload Saipos."""
     sql = text(
         """
         INSERT INTO public.order_audit
-          (session_id, telefone, trace_id, status, agent_order_json)
+          (session_id, telefone, trace_id, status, agent_order_json, saipos_payload_json, error)
         VALUES
-          (:session_id, :telefone, :trace_id, 'raw', CAST(:agent_order_json AS jsonb))
+          (:session_id, :telefone, :trace_id, :status, CAST(:agent_order_json AS jsonb),
+           CAST(:saipos_payload_json AS jsonb), :error)
         RETURNING id
         """
     )
-    try:
+    with savepoint(db):
         result = db.execute(
             sql,
             {
                 "session_id": session_id,
                 "telefone": telefone,
                 "trace_id": trace_id,
+                "status": status,
                 "agent_order_json": json.dumps(agent_order_json),
+                "saipos_payload_json": None if saipos_payload_json is None else json.dumps(saipos_payload_json),
+                "error": error,
             },
         )
         audit_id = result.scalar_one_or_none()
-        db.commit()
-        return audit_id
-    except Exception:
-        db.rollback()
-        raise
+    _commit(db)
+    return audit_id
 
 
 def insert_order_audit_quote(
@@ -932,7 +1303,7 @@ def insert_order_audit_quote(
         RETURNING id
         """
     )
-    try:
+    with savepoint(db):
         result = db.execute(
             sql,
             {
@@ -944,11 +1315,8 @@ def insert_order_audit_quote(
             },
         )
         audit_id = result.scalar_one_or_none()
-        db.commit()
-        return audit_id
-    except Exception:
-        db.rollback()
-        raise
+    _commit(db)
+    return audit_id
 
 
 def update_order_audit_saipos(
@@ -967,7 +1335,7 @@ def update_order_audit_saipos(
         WHERE id = :id
         """
     )
-    try:
+    with savepoint(db):
         db.execute(
             sql,
             {
@@ -977,12 +1345,410 @@ def update_order_audit_saipos(
                 "error": error,
             },
         )
-        db.commit()
-    except Exception:
-        db.rollback()
-        raise
+    _commit(db)
+
+
+@timed(DB_CALL_SECONDS, fn="enqueue_order_outbox")
+def enqueue_order_outbox(
+    db,
+    idempotency_key: str,
+    order_id: str,
+    payload: Dict[str, Any],
+    audit_id: Optional[int] = None,
+    session_id: str = "",
+    telefone: str = "",
+    dedupe_seconds: int = 600,
+) -> Dict[str, Any]:
+    """
+    Enfileira o pedido para envio à Saipos. Se o mesmo pedido (mesma chave de idempotência) ainda está
+    na fila (pending/sending) e foi enfileirado na janela `dedupe_seconds`, devolve o existente com
+    created=false. Um pedido igual depois de enviado (ou falho) é um pedido novo.
+    """
+    sql = text(
+        """
+        WITH prev AS (
+          SELECT id, order_id, status
+          FROM public.order_outbox
+          WHERE idempotency_key = :key
+            AND created_at > now() - make_interval(secs => CAST(:window AS int))
+            AND status IN ('pending','sending')
+          ORDER BY created_at DESC
+          LIMIT 1
+        )
+        , ins AS (
+          INSERT INTO public.order_outbox (idempotency_key, order_id, audit_id, session_id, telefone, payload)
+          SELECT :key, :order_id, :audit_id, :session_id, :telefone, CAST(:payload AS jsonb)
+          WHERE NOT EXISTS (SELECT 1 FROM prev)
+          RETURNING id, order_id, status
+        )
+        SELECT id, order_id, status, true AS created FROM ins
+        UNION ALL
+        SELECT id, order_id, status, false AS created FROM prev
+        """
+    )
+    row = db.execute(
+        sql,
+        {
+            "key": idempotency_key,
+            "window": int(dedupe_seconds),
+            "order_id": order_id,
+            "audit_id": audit_id,
+            "session_id": session_id,
+            "telefone": telefone,
+            "payload": json.dumps(payload),
+        },
+    ).mappings().first()
+    _commit(db)
+    return dict(row) if row else {}
+
+
+@timed(DB_CALL_SECONDS, fn="claim_order_outbox")
+def claim_order_outbox(db, limit: int = 10, lease_seconds: int = 120, outbox_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Reserva pedidos vencidos (ou com lease expirado) para envio; incrementa `attempts`."""
+    only = "AND id = CAST(:outbox_id AS bigint)" if outbox_id is not None else ""
+    sql = text(
+        f"""
+        WITH due AS (
+          SELECT id
+          FROM public.order_outbox
+          WHERE ((status = 'pending' AND next_attempt_at <= now())
+                 OR (status = 'sending' AND locked_until < now()))
+            {only}
+          ORDER BY next_attempt_at ASC, id ASC
+          LIMIT :limit
+          FOR UPDATE SKIP LOCKED
+        )
+        UPDATE public.order_outbox o
+        SET status = 'sending',
+            attempts = o.attempts + 1,
+            locked_until = now() + make_interval(secs => CAST(:lease AS int)),
+            updated_at = now()
+        FROM due
+        WHERE o.id = due.id
+        RETURNING o.id, o.order_id, o.audit_id, o.session_id, o.telefone, o.payload, o.attempts, o.created_at
+        """
+    )
+    params: Dict[str, Any] = {"limit": int(limit), "lease": int(lease_seconds)}
+    if outbox_id is not None:
+        params["outbox_id"] = outbox_id
+    rows = db.execute(sql, params).mappings().all()
+    _commit(db)
+    return rows
+
+
+@timed(DB_CALL_SECONDS, fn="complete_order_outbox")
+def complete_order_outbox(
+    db,
+    outbox_id: int,
+    status: str,
+    response: Dict[str, Any] | None = None,
+    error: Optional[str] = None,
+    retry_in_seconds: Optional[float] = None,
+) -> Optional[float]:
+    """Grava o resultado do envio. Retorna a latência (s) entre o enfileiramento e o envio."""
+    sql = text(
+        """
+        UPDATE public.order_outbox
+        SET status = :status,
+            response = CAST(:response AS jsonb),
+            last_error = :error,
+            locked_until = NULL,
+            next_attempt_at = now() + make_interval(secs => CAST(:retry_in AS double precision)),
+            dispatched_at = CASE WHEN CAST(:status AS text) = 'sent' THEN now() ELSE dispatched_at END,
+            updated_at = now()
+        WHERE id = :id
+        RETURNING EXTRACT(EPOCH FROM (now() - created_at)) AS latency_seconds
+        """
+    )
+    result = db.execute(
+        sql,
+        {
+            "id": outbox_id,
+            "status": status,
+            "response": json.dumps(response) if response is not None else None,
+            "error": error,
+            "retry_in": float(retry_in_seconds or 0),
+        },
+    ).scalar_one_or_none()
+    _commit(db)
+    return float(result) if result is not None else None
+
+
+def record_order_status_event(
+    db,
+    order_id: str,
+    event: str,
+    rank: int,
+    telefone: str = "",
+    nome: str = "",
+    payload: Dict[str, Any] | None = None,
+    delay_seconds: float = 0,
+) -> Dict[str, Any]:
+    """
+    Grava o evento de status da Saipos (um por `(order_id, event)`; reentregas não criam linha).
+
+    O aviso fica para daqui a `delay_seconds`; eventos pendentes do mesmo pedido com rank menor ou igual
+    são marcados `superseded` (só o mais recente é avisado), e um evento que chega depois de um de rank
+    maior já nasce `superseded`. Só eventos conhecidos (rank > 0) entram nessa coalescência: os demais
+    ficam sempre `pending`, para o worker aplicar o status no pedido. Retorna {id, status, superseded};
+    id None = evento repetido.
+    """
+    sql = text(
+        """
+        WITH ins AS (
+          INSERT INTO public.order_status_events
+            (order_id, event, rank, telefone, nome, payload, status, next_attempt_at)
+          SELECT CAST(:order_id AS text), CAST(:event AS text), CAST(:rank AS int), :telefone, :nome,
+                 CAST(:payload AS jsonb),
+                 CASE WHEN CAST(:rank AS int) > 0 AND EXISTS (
+                   SELECT 1 FROM public.order_status_events
+                   WHERE order_id = CAST(:order_id AS text)
+                     AND rank > CAST(:rank AS int)
+                     AND status IN ('pending','sending','sent')
+                 ) THEN 'superseded' ELSE 'pending' END,
+                 now() + make_interval(secs => CAST(:delay AS double precision))
+          ON CONFLICT (order_id, event) DO NOTHING
+          RETURNING id, status, rank
+        ),
+        sup AS (
+          UPDATE public.order_status_events e
+          SET status = 'superseded', processed_at = now()
+          FROM ins
+          WHERE ins.status = 'pending'
+            AND ins.rank > 0
+            AND e.order_id = CAST(:order_id AS text)
+            AND e.id <> ins.id
+            AND e.status = 'pending'
+            AND e.rank > 0
+            AND e.rank <= ins.rank
+          RETURNING e.id
+        )
+        SELECT (SELECT id FROM ins) AS id,
+               (SELECT status FROM ins) AS status,
+               (SELECT count(*) FROM sup) AS superseded
+        """
+    )
+    row = db.execute(
+        sql,
+        {
+            "order_id": order_id,
+            "event": event,
+            "rank": int(rank),
+            "telefone": telefone or "",
+            "nome": nome or "",
+            "payload": json.dumps(payload) if payload is not None else None,
+            "delay": float(delay_seconds or 0),
+        },
+    ).mappings().first()
+    _commit(db)
+    row = dict(row or {})
+    return {"id": row.get("id"), "status": row.get("status"), "superseded": int(row.get("superseded") or 0)}
+
+
+@timed(DB_CALL_SECONDS, fn="claim_order_status_events")
+def claim_order_status_events(db, limit: int = 20, lease_seconds: int = 60) -> List[Dict[str, Any]]:
+    """Reserva eventos de status vencidos (ou com lease expirado) para aviso; incrementa `attempts`."""
+    sql = text(
+        """
+        WITH due AS (
+          SELECT id
+          FROM public.order_status_events
+          WHERE (status = 'pending' AND next_attempt_at <= now())
+             OR (status = 'sending' AND locked_until < now())
+          ORDER BY next_attempt_at ASC, id ASC
+          LIMIT :limit
+          FOR UPDATE SKIP LOCKED
+        )
+        UPDATE public.order_status_events e
+        SET status = 'sending',
+            attempts = e.attempts + 1,
+            locked_until = now() + make_interval(secs => CAST(:lease AS int))
+        FROM due
+        WHERE e.id = due.id
+        RETURNING e.id, e.order_id, e.event, e.telefone, e.nome, e.payload, e.attempts, e.received_at
+        """
+    )
+    rows = db.execute(sql, {"limit": int(limit), "lease": int(lease_seconds)}).mappings().all()
+    _commit(db)
+    return rows
+
+
+@timed(DB_CALL_SECONDS, fn="complete_order_status_event")
+def complete_order_status_event(
+    db,
+    event_id: int,
+    status: str,
+    error: Optional[str] = None,
+    retry_in_seconds: Optional[float] = None,
+) -> Optional[float]:
+    """Grava o resultado do aviso. Retorna a latência (s) entre o recebimento e o aviso."""
+    sql = text(
+        """
+        UPDATE public.order_status_events
+        SET status = :status,
+            last_error = :error,
+            locked_until = NULL,
+            next_attempt_at = now() + make_interval(secs => CAST(:retry_in AS double precision)),
+            processed_at = CASE WHEN CAST(:status AS text) = 'pending' THEN processed_at ELSE now() END
+        WHERE id = :id
+        RETURNING EXTRACT(EPOCH FROM (now() - received_at)) AS latency_seconds
+        """
+    )
+    result = db.execute(
+        sql,
+        {"id": event_id, "status": status, "error": error, "retry_in": float(retry_in_seconds or 0)},
+    ).scalar_one_or_none()
+    _commit(db)
+    return float(result) if result is not None else None
+
+
+@timed(DB_CALL_SECONDS, fn="enqueue_outbound_messages")
+def enqueue_outbound_messages(
+    db,
+    telefone: str,
+    parts: List[str],
+    instance: str = "",
+    base_url: str = "",
+    source: str = "",
+    trace_id: str = "",
+) -> List[int]:
+    """Enfileira as partes de uma resposta (na ordem) num único INSERT; retorna os ids."""
+    parts = [p for p in parts if p and p.strip()]
+    if not parts:
+        return []
+    sql = text(
+        """
+        INSERT INTO public.outbound_messages (telefone, instance, base_url, text, source, trace_id)
+        SELECT CAST(:telefone AS text), :instance, :base_url, p.part, :source, NULLIF(CAST(:trace_id AS text), '')
+        FROM unnest(CAST(:parts AS text[])) WITH ORDINALITY AS p(part, pos)
+        ORDER BY p.pos
+        RETURNING id
+        """
+    )
+    params = {
+        "telefone": telefone,
+        "instance": instance or "",
+        "base_url": base_url or "",
+        "parts": parts,
+        "source": source or "",
+        "trace_id": trace_id or "",
+    }
+    ids = [int(r) for r in db.execute(sql, params).scalars().all()]
+    _commit(db)
+    return sorted(ids)
+
+
+@timed(DB_CALL_SECONDS, fn="claim_outbound_messages")
+def claim_outbound_messages(
+    db, limit: int = 10, lease_seconds: int = 60, telefone: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Reserva a mensagem mais antiga ainda não enviada de cada telefone, se já venceu: a próxima
+    do mesmo telefone só fica disponível depois desta sair (ordem por telefone).
+    """
+    only = "AND telefone = CAST(:telefone AS text)" if telefone else ""
+    sql = text(
+        f"""
+        WITH heads AS (
+          SELECT DISTINCT ON (telefone) id, status, next_attempt_at, locked_until
+          FROM public.outbound_messages
+          WHERE status IN ('pending','sending') {only}
+          ORDER BY telefone, id
+        ),
+        due AS (
+          SELECT m.id
+          FROM public.outbound_messages m
+          JOIN heads h ON h.id = m.id
+          WHERE (h.status = 'pending' AND h.next_attempt_at <= now())
+             OR (h.status = 'sending' AND h.locked_until < now())
+          ORDER BY m.next_attempt_at ASC, m.id ASC
+          LIMIT :limit
+          FOR UPDATE OF m SKIP LOCKED
+        )
+        UPDATE public.outbound_messages m
+        SET status = 'sending',
+            attempts = m.attempts + 1,
+            locked_until = now() + make_interval(secs => CAST(:lease AS int))
+        FROM due
+        WHERE m.id = due.id
+        RETURNING m.id, m.telefone, m.instance, m.base_url, m.text, m.source, m.trace_id, m.attempts, m.created_at
+        """
+    )
+    params: Dict[str, Any] = {"limit": int(limit), "lease": int(lease_seconds)}
+    if telefone:
+        params["telefone"] = telefone
+    rows = db.execute(sql, params).mappings().all()
+    _commit(db)
+    return rows
+
+
+@timed(DB_CALL_SECONDS, fn="complete_outbound_message")
+def complete_outbound_message(
+    db,
+    message_id: int,
+    status: str,
+    error: Optional[str] = None,
+    retry_in_seconds: Optional[float] = None,
+    pace_seconds: float = 0,
+) -> Optional[float]:
+    """
+    Resultado do envio: `sent` empurra a próxima mensagem do telefone para daqui a `pace_seconds`,
+    `pending` agenda nova tentativa e `dead` move a mensagem para outbound_messages_dead.
+    Retorna a latência (s) entre o enfileiramento e o envio.
+    """
+    if status == "sent":
+        sql = text(
+            """
+            WITH done AS (
+              UPDATE public.outbound_messages
+              SET status = 'sent', sent_at = now(), locked_until = NULL, last_error = NULL
+              WHERE id = :id
+              RETURNING telefone, EXTRACT(EPOCH FROM (now() - created_at)) AS latency_seconds
+            ),
+            paced AS (
+              UPDATE public.outbound_messages m
+              SET next_attempt_at = GREATEST(m.next_attempt_at, now() + make_interval(secs => CAST(:pace AS double precision)))
+              FROM done
+              WHERE m.telefone = done.telefone AND m.status = 'pending'
+              RETURNING m.id
+            )
+            SELECT latency_seconds FROM done
+            """
+        )
+        params: Dict[str, Any] = {"id": message_id, "pace": float(pace_seconds or 0)}
+    elif status == "dead":
+        sql = text(
+            """
+            WITH moved AS (
+              DELETE FROM public.outbound_messages WHERE id = :id
+              RETURNING id, telefone, instance, base_url, text, source, attempts, created_at
+            )
+            INSERT INTO public.outbound_messages_dead
+              (id, telefone, instance, base_url, text, source, attempts, last_error, created_at)
+            SELECT id, telefone, instance, base_url, text, source, attempts, :error, created_at FROM moved
+            RETURNING NULL::double precision AS latency_seconds
+            """
+        )
+        params = {"id": message_id, "error": error}
+    else:
+        sql = text(
+            """
+            UPDATE public.outbound_messages
+            SET status = 'pending',
+                last_error = :error,
+                locked_until = NULL,
+                next_attempt_at = now() + make_interval(secs => CAST(:retry_in AS double precision))
+            WHERE id = :id
+            RETURNING NULL::double precision AS latency_seconds
+            """
+        )
+        params = {"id": message_id, "error": error, "retry_in": float(retry_in_seconds or 0)}
+    result = db.execute(sql, params).scalar_one_or_none()
+    _commit(db)
+    return float(result) if result is not None else None
 
 
+@timed(DB_CALL_SECONDS, fn="fetch_chat_history")
 def fetch_chat_history(db, session_id: str, limit: int = 20) -> List[Dict[str, Any]]:
     sql = text(
         """
@@ -0,0 +1,21 @@
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS public.menu_embeddings (
+  id BIGSERIAL PRIMARY KEY,
+  pdv TEXT,
+  display_name TEXT,
+  category TEXT,
+  price NUMERIC,
+  embedding VECTOR(1536)
+);
+
+ALTER TABLE public.menu_embeddings
+  ADD COLUMN IF NOT EXISTS content_hash TEXT,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now();
+
+-- Remove duplicates left by previous non-idempotent runs before enforcing uniqueness
+DELETE FROM public.menu_embeddings a
+USING public.menu_embeddings b
+WHERE a.pdv = b.pdv AND a.id < b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS menu_embeddings_pdv_uidx ON public.menu_embeddings (pdv);
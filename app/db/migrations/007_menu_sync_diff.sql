@@ -0,0 +1,14 @@
+ALTER TABLE public.saipos_menu_raw
+  ADD COLUMN IF NOT EXISTS row_hash TEXT,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS idx_saipos_menu_client_codigo ON public.saipos_menu_raw (client_id, codigo_saipos, id_store_choice);
+
+CREATE TABLE IF NOT EXISTS public.menu_version (
+  client_id UUID PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  inserted INTEGER DEFAULT 0,
+  updated INTEGER DEFAULT 0,
+  deleted INTEGER DEFAULT 0,
+  updated_at TIMESTAMPTZ DEFAULT now()
+);
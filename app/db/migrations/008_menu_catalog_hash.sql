@@ -0,0 +1,3 @@
+ALTER TABLE public.menu_version
+  ADD COLUMN IF NOT EXISTS catalog_hash TEXT,
+  ADD COLUMN IF NOT EXISTS catalog_checked_at TIMESTAMPTZ;
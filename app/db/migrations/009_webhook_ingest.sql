@@ -0,0 +1,6 @@
+-- Duplicate deliveries left before the unique index existed
+DELETE FROM public.n8n_fila_mensagens a
+USING public.n8n_fila_mensagens b
+WHERE a.telefone = b.telefone AND a.id_mensagem = b.id_mensagem AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_n8n_fila_tel_msg ON public.n8n_fila_mensagens (telefone, id_mensagem);
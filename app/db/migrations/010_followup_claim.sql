@@ -0,0 +1,3 @@
+-- Claim of follow-up candidates so concurrent runners (threads or pods) never pick the same session
+ALTER TABLE public.active_sessions
+  ADD COLUMN IF NOT EXISTS followup_claimed_at TIMESTAMPTZ;
@@ -0,0 +1,19 @@
+-- Partial index with the exact follow-up candidate predicate; (updated_at, id) backs the keyset paging
+CREATE INDEX IF NOT EXISTS idx_active_sessions_followup_candidates
+  ON public.active_sessions (updated_at, id)
+  WHERE status = 'active'
+    AND last_message_type IN ('ai','human')
+    AND COALESCE(followup_count,0) < 2
+    AND followup_sent_at IS NULL;
+
+-- Finished sessions are moved out of the hot table after SESSION_ARCHIVE_AFTER_DAYS
+CREATE TABLE IF NOT EXISTS public.active_sessions_archive (
+  id BIGINT PRIMARY KEY,
+  session_id TEXT NOT NULL,
+  status TEXT,
+  updated_at TIMESTAMPTZ,
+  archived_at TIMESTAMPTZ DEFAULT now(),
+  data JSONB NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_active_sessions_archive_session ON public.active_sessions_archive (session_id, updated_at);
@@ -0,0 +1,7 @@
+-- Saipos auth token shared between replicas (SAIPOS_TOKEN_SHARED)
+CREATE TABLE IF NOT EXISTS public.saipos_token (
+  cache_key TEXT PRIMARY KEY,
+  token TEXT NOT NULL,
+  expires_at TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ DEFAULT now()
+);
@@ -0,0 +1,23 @@
+-- Orders waiting to be submitted to Saipos by the background dispatcher
+CREATE TABLE IF NOT EXISTS public.order_outbox (
+  id BIGSERIAL PRIMARY KEY,
+  idempotency_key TEXT NOT NULL,
+  order_id TEXT NOT NULL UNIQUE,
+  audit_id BIGINT,
+  session_id TEXT,
+  telefone TEXT,
+  payload JSONB NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error TEXT,
+  response JSONB,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  dispatched_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_outbox_key ON public.order_outbox (idempotency_key, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_order_outbox_due ON public.order_outbox (next_attempt_at, id)
+  WHERE status IN ('pending','sending');
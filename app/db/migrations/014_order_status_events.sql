@@ -0,0 +1,21 @@
+-- Saipos status events: stored on receipt, customer notified by a background worker
+CREATE TABLE IF NOT EXISTS public.order_status_events (
+  id BIGSERIAL PRIMARY KEY,
+  order_id TEXT NOT NULL,
+  event TEXT NOT NULL,
+  rank INTEGER NOT NULL DEFAULT 0,
+  telefone TEXT,
+  nome TEXT,
+  payload JSONB,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error TEXT,
+  received_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  processed_at TIMESTAMPTZ,
+  UNIQUE (order_id, event)
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_status_events_due ON public.order_status_events (next_attempt_at, id)
+  WHERE status IN ('pending','sending');
@@ -0,0 +1,34 @@
+-- Outbound WhatsApp messages, sent by a background worker in order per phone
+CREATE TABLE IF NOT EXISTS public.outbound_messages (
+  id BIGSERIAL PRIMARY KEY,
+  telefone TEXT NOT NULL,
+  instance TEXT,
+  base_url TEXT,
+  text TEXT NOT NULL,
+  source TEXT,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  locked_until TIMESTAMPTZ,
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  sent_at TIMESTAMPTZ
+);
+
+-- per-phone queue: the head is the lowest unsent id
+CREATE INDEX IF NOT EXISTS idx_outbound_messages_queue ON public.outbound_messages (telefone, id)
+  WHERE status IN ('pending','sending');
+
+-- Dead letters: messages that exhausted their attempts
+CREATE TABLE IF NOT EXISTS public.outbound_messages_dead (
+  id BIGINT PRIMARY KEY,
+  telefone TEXT NOT NULL,
+  instance TEXT,
+  base_url TEXT,
+  text TEXT NOT NULL,
+  source TEXT,
+  attempts INTEGER NOT NULL,
+  last_error TEXT,
+  created_at TIMESTAMPTZ NOT NULL,
+  failed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,2 @@
+-- Trace of the turn that produced each outbound message, so the send joins the same trace
+ALTER TABLE public.outbound_messages ADD COLUMN IF NOT EXISTS trace_id TEXT;
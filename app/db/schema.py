@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Tabelas cujo formato varia entre instalações (schema antigo/novo de orders, migrações opcionais).
+PROBED_TABLES: Tuple[str, ...] = (
+    "public.orders",
+    "public.order_items",
+    "public.order_audit",
+    "public.active_sessions",
+    "public.addresses",
+    "archive.clients",
+)
+
+
+class SchemaCapabilities:
+    """
+    O que o banco conectado oferece (colunas por tabela, índices únicos, extensões), sondado uma vez.
+    `crud` monta o SQL dinâmico a partir daqui, sem consultar information_schema no caminho quente.
+    """
+
+    def __init__(
+        self,
+        columns: Dict[str, Iterable[str]],
+        unique: Dict[str, Iterable[Tuple[str, ...]]] | None = None,
+        extensions: Iterable[str] = (),
+    ) -> None:
+        self._columns: Dict[str, FrozenSet[str]] = {t: frozenset(cols) for t, cols in columns.items()}
+        self._unique: Dict[str, FrozenSet[Tuple[str, ...]]] = {
+            t: frozenset(tuple(k) for k in keys) for t, keys in (unique or {}).items()
+        }
+        self.extensions: FrozenSet[str] = frozenset(extensions)
+
+    def columns(self, table: str) -> FrozenSet[str]:
+        return self._columns.get(table, frozenset())
+
+    def has_table(self, table: str) -> bool:
+        return bool(self._columns.get(table))
+
+    def has_columns(self, table: str, *names: str) -> bool:
+        cols = self.columns(table)
+        return all(name in cols for name in names)
+
+    def has_unique(self, table: str, *names: str) -> bool:
+        """Há índice/constraint único exatamente nessas colunas (alvo válido para ON CONFLICT)."""
+        return tuple(sorted(names)) in self._unique.get(table, frozenset())
+
+    def has_extension(self, name: str) -> bool:
+        return name in self.extensions
+
+    @property
+    def orders_new_schema(self) -> bool:
+        return "payload_snapshot" in self.columns("public.orders")
+
+    @property
+    def session_tokens(self) -> bool:
+        return self.has_columns("public.active_sessions", "total_tokens", "tokens_updated_at")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "tables": {t: sorted(cols) for t, cols in sorted(self._columns.items()) if cols},
+            "missing_tables": sorted(t for t, cols in self._columns.items() if not cols),
+            "unique": {t: sorted(list(k) for k in keys) for t, keys in sorted(self._unique.items()) if keys},
+            "extensions": sorted(self.extensions),
+            "orders_new_schema": self.orders_new_schema,
+            "session_tokens": self.session_tokens,
+        }
+
+
+def probe_schema(db, tables: Iterable[str] = PROBED_TABLES) -> SchemaCapabilities:
+    """Três leituras de catálogo: colunas, índices únicos e extensões instaladas."""
+    tables = list(tables)
+    columns: Dict[str, set] = {t: set() for t in tables}
+    rows = db.execute(
+        text(
+            """
+            SELECT table_schema || '.' || table_name AS tbl, column_name
+            FROM information_schema.columns
+            WHERE table_schema || '.' || table_name = ANY(CAST(:tables AS text[]))
+            """
+        ),
+        {"tables": tables},
+    ).mappings().all()
+    for row in rows:
+        columns.setdefault(row["tbl"], set()).add(row["column_name"])
+
+    unique: Dict[str, set] = {t: set() for t in tables}
+    rows = db.execute(
+        text(
+            """
+            SELECT n.nspname || '.' || c.relname AS tbl, array_agg(a.attname::text ORDER BY a.attname) AS cols
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indisunique
+              AND i.indpred IS NULL
+              AND n.nspname || '.' || c.relname = ANY(CAST(:tables AS text[]))
+            GROUP BY i.indexrelid, n.nspname, c.relname
+            """
+        ),
+        {"tables": tables},
+    ).mappings().all()
+    for row in rows:
+        unique.setdefault(row["tbl"], set()).add(tuple(row["cols"] or ()))
+
+    extensions = [r["extname"] for r in db.execute(text("SELECT extname FROM pg_extension")).mappings().all()]
+    return SchemaCapabilities(columns, unique, extensions)
+
+
+_capabilities: Optional[SchemaCapabilities] = None
+_capabilities_lock = threading.Lock()
+
+
+def _probe_and_store(db) -> SchemaCapabilities:
+    global _capabilities
+    _capabilities = probe_schema(db)
+    logger.info("schema_capabilities", extra={"result": _capabilities.as_dict()})
+    return _capabilities
+
+
+def init_schema_capabilities(db) -> SchemaCapabilities:
+    """Sonda o schema (no startup) e registra o resultado no log."""
+    with _capabilities_lock:
+        return _probe_and_store(db)
+
+
+def get_schema_capabilities(db) -> SchemaCapabilities:
+    """Registro do processo; scripts que não passam pelo startup sondam na primeira chamada."""
+    caps = _capabilities
+    if caps is None:
+        with _capabilities_lock:
+            caps = _capabilities or _probe_and_store(db)
+    return caps
+
+
+def set_schema_capabilities(capabilities: Optional[SchemaCapabilities]) -> None:
+    """Substitui o registro (testes, ou depois de rodar migrações no mesmo processo)."""
+    global _capabilities
+    with _capabilities_lock:
+        _capabilities = capabilities
+
+
+def schema_metrics() -> Dict[str, Any]:
+    caps = _capabilities
+    return {"probed": True, **caps.as_dict()} if caps is not None else {"probed": False}
@@ -1,17 +1,146 @@
 from __future__ import annotations
 
+import logging
+import threading
+import time
 from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.settings import settings
+from app.utils.metrics import REGISTRY
 
 _engine = None
+_lock_engine = None
 _async_engine = None
 _SessionLocal = None
 
+logger = logging.getLogger(__name__)
+
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "lia_db_pool_wait_seconds",
+    "Espera por uma conexão livre no checkout do pool",
+    ("result",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+
+
+class PoolStats:
+    """Contadores de checkout do pool (tempo de espera, timeouts) para diagnóstico de saturação."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.slow_checkouts = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+
+    def record(self, wait_ms: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            slow = wait_ms >= settings.db_slow_checkout_ms
+            if slow:
+                self.slow_checkouts += 1
+        DB_POOL_WAIT_SECONDS.observe(wait_ms / 1000, result="timeout" if timed_out else "ok")
+        if slow:
+            logger.warning("db_pool_slow_checkout", extra={"duration_ms": int(wait_ms)})
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            attempts = self.checkouts + self.timeouts
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "wait_ms_avg": round(self.wait_ms_total / attempts, 3) if attempts else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+UOW_KEY = "unit_of_work"
+
+
+class DbStats:
+    """Statements/commits/rollbacks executados dentro de um escopo (ex.: uma mensagem do webhook)."""
+
+    __slots__ = ("statements", "commits", "rollbacks")
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.commits = 0
+        self.rollbacks = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {"statements": self.statements, "commits": self.commits, "rollbacks": self.rollbacks}
+
+
+_db_stats: ContextVar[Optional[DbStats]] = ContextVar("db_stats", default=None)
+
+
+@contextmanager
+def track_db_stats():
+    stats = DbStats()
+    token = _db_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _db_stats.reset(token)
+
+
+def _on_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _db_stats.get()
+    if stats is not None:
+        stats.statements += 1
+
+
+def _on_commit(conn) -> None:
+    stats = _db_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+
+def _on_rollback(conn) -> None:
+    stats = _db_stats.get()
+    if stats is not None:
+        stats.rollbacks += 1
+
+
+def instrument_engine(engine) -> None:
+    event.listen(engine, "before_cursor_execute", _on_statement)
+    event.listen(engine, "commit", _on_commit)
+    event.listen(engine, "rollback", _on_rollback)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool que mede quanto tempo cada checkout esperou por uma conexão livre."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_stats.record((time.perf_counter() - started) * 1000)
+        return conn
+
 
 def _normalize_db_url(url: str) -> str:
     if not url:
@@ -28,13 +157,66 @@ def _normalize_db_url(url: str) -> str:
     return url
 
 
+def _pool_kwargs() -> Dict[str, Any]:
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout_seconds,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_use_lifo": settings.db_pool_use_lifo,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def _connect_args() -> Dict[str, Any]:
+    # Sem pre-ping: conexões mortas são detectadas por TCP keepalive e pelo recycle,
+    # e o statement_timeout impede que uma query lenta segure a conexão indefinidamente.
+    args: Dict[str, Any] = {
+        "connect_timeout": settings.db_connect_timeout_seconds,
+        "keepalives": 1,
+        "keepalives_idle": settings.db_keepalives_idle_seconds,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
+    if settings.db_statement_timeout_ms > 0:
+        args["options"] = f"-c statement_timeout={int(settings.db_statement_timeout_ms)}"
+    return args
+
+
 def get_engine():
     global _engine
     if _engine is None:
-        _engine = create_engine(_normalize_db_url(settings.database_url), pool_pre_ping=True)
+        _engine = create_engine(
+            _normalize_db_url(settings.database_url),
+            poolclass=TimedQueuePool,
+            connect_args=_connect_args(),
+            **_pool_kwargs(),
+        )
+        instrument_engine(_engine)
     return _engine
 
 
+def get_lock_engine():
+    """
+    Engine só para os advisory locks de conversa. O lock de sessão segura uma conexão durante o turno
+    inteiro (inclusive as chamadas ao LLM); num pool próprio ele não disputa com as conexões de trabalho,
+    e quem espera pelo lock não segura nenhuma conexão do pool principal.
+    """
+    global _lock_engine
+    if _lock_engine is None:
+        _lock_engine = create_engine(
+            _normalize_db_url(settings.database_url),
+            poolclass=QueuePool,
+            connect_args=_connect_args(),
+            pool_size=settings.conversation_lock_pool_size,
+            max_overflow=0,
+            pool_timeout=settings.conversation_lock_timeout_seconds,
+            pool_recycle=settings.db_pool_recycle_seconds,
+            pool_use_lifo=True,
+        )
+    return _lock_engine
+
+
 def get_async_engine():
     global _async_engine
     if _async_engine is None:
@@ -42,6 +224,25 @@ def get_async_engine():
     return _async_engine
 
 
+def pool_metrics() -> Dict[str, Any]:
+    """Estado atual do pool síncrono + contadores de espera no checkout."""
+    metrics: Dict[str, Any] = {"pool_size": settings.db_pool_size, "max_overflow": settings.db_max_overflow}
+    if _engine is not None:
+        pool = _engine.pool
+        metrics.update(
+            {
+                "pool_size": pool.size(),
+                "in_use": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            }
+        )
+    if _lock_engine is not None:
+        metrics["lock_pool_in_use"] = _lock_engine.pool.checkedout()
+    metrics.update(pool_stats.snapshot())
+    return metrics
+
+
 def get_sessionmaker():
     global _SessionLocal
     if _SessionLocal is None:
@@ -56,3 +257,47 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def in_unit_of_work(db) -> bool:
+    info = getattr(db, "info", None)
+    return bool(isinstance(info, dict) and info.get(UOW_KEY))
+
+
+@contextmanager
+def unit_of_work(db=None):
+    """
+    Transação de responsabilidade de quem chama: as funções de crud só executam e
+    o commit acontece uma única vez na saída (rollback se houver exceção).
+    Aceita uma sessão existente; escopos aninhados reaproveitam a transação externa.
+    """
+    owns_session = db is None
+    session = get_sessionmaker()() if owns_session else db
+    outer = in_unit_of_work(session)
+    session.info[UOW_KEY] = True
+    try:
+        yield session
+        if not outer:
+            session.commit()
+    except Exception:
+        if not outer:
+            session.rollback()
+        raise
+    finally:
+        session.info[UOW_KEY] = outer
+        if owns_session:
+            session.close()
+
+
+@contextmanager
+def savepoint(db):
+    """Isola um passo que pode falhar sem abortar o unit of work inteiro."""
+    if in_unit_of_work(db):
+        with db.begin_nested():
+            yield
+        return
+    try:
+        yield
+    except Exception:
+        db.rollback()
+        raise
@@ -5,6 +5,8 @@ import logging
 import sys
 from typing import Any
 
+from app.utils.tracing import TraceContextFilter
+
 
 def _json_default(obj: Any) -> str:
     try:
@@ -22,7 +24,22 @@ class JsonFormatter(logging.Formatter):
         }
         if record.exc_info:
             payload["exc_info"] = self.formatException(record.exc_info)
-        for key in ("trace_id", "message_id", "telefone", "order_id", "status_code", "body", "model", "request_id"):
+        for key in (
+            "trace_id",
+            "span_id",
+            "message_id",
+            "telefone",
+            "order_id",
+            "status_code",
+            "body",
+            "model",
+            "request_id",
+            "result",
+            "duration_ms",
+            "payload_bytes",
+            "skipped",
+            "skip_rate",
+        ):
             if hasattr(record, key):
                 payload[key] = getattr(record, key)
         return json.dumps(payload, default=_json_default)
@@ -34,5 +51,7 @@ def init_logging(level: str = "INFO") -> None:
 
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(JsonFormatter())
+    # trace_id/span_id do turno atual em todo log, inclusive de bibliotecas
+    handler.addFilter(TraceContextFilter())
 
     root.handlers = [handler]
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI
 
 from app.api.routes_health import router as health_router
 from app.api.routes_webhooks import router as webhooks_router
+from app.api.routes_webhooks import validate_config
+from app.db.schema import init_schema_capabilities
 from app.db.session import get_db
 from app.logging_config import init_logging
 from app.services.evolution_client import EvolutionClient
@@ -11,9 +14,14 @@ from app.services.followup_service import FollowupService
 from app.services.geocode_service import GeocodeService
 from app.services.llm_agent import LLMAgent
 from app.services.menu_service import MenuService
+from app.services.menu_sync_service import MenuSyncService
+from app.services.order_dispatcher import OrderDispatcher
 from app.services.order_service import OrderService
+from app.services.outbound_queue import OutboundSender
 from app.services.saipos_client import SaiposClient
+from app.services.status_notifier import StatusNotifier
 from app.settings import settings
+from app.utils.tracing import SpanExporter, build_sink
 
 app = FastAPI(title=settings.app_name)
 app.include_router(health_router)
@@ -23,6 +31,13 @@ app.include_router(webhooks_router)
 @app.on_event("startup")
 def startup() -> None:
     init_logging(settings.log_level)
+    validate_config()
+    sink = build_sink()
+    if sink is not None:
+        SpanExporter(sink).start()
+    with get_db() as db:
+        # uma sondagem do schema por processo; crud monta o SQL dinâmico a partir dela
+        init_schema_capabilities(db)
 
     def llm_factory(db):
         saipos = SaiposClient(settings.saipos_base_url, settings.saipos_partner_id, settings.saipos_partner_secret, settings.saipos_token_ttl_seconds)
@@ -33,6 +48,18 @@ def startup() -> None:
         followup_prompt = open("prompts/followup.md", "r", encoding="utf-8").read()
         return LLMAgent(db, orders, menu, geocode, atendente_prompt, followup_prompt)
 
+    def saipos_factory():
+        return SaiposClient(settings.saipos_base_url, settings.saipos_partner_id, settings.saipos_partner_secret, settings.saipos_token_ttl_seconds)
+
+    scheduler = BackgroundScheduler()
     evolution = EvolutionClient(settings.evolution_base_url, settings.evolution_api_key)
-    followup = FollowupService(get_db, llm_factory, evolution)
+    if settings.outbound_queue_enabled:
+        OutboundSender(get_db, lambda: evolution).start()
+    followup = FollowupService(get_db, llm_factory, evolution, scheduler=scheduler)
     followup.start()
+    menu_sync = MenuSyncService(get_db, saipos_factory, scheduler=scheduler)
+    menu_sync.start()
+    if settings.order_outbox_enabled:
+        OrderDispatcher(get_db, saipos_factory, lambda: evolution).start()
+    if settings.status_events_async:
+        StatusNotifier(get_db, lambda: evolution).start()
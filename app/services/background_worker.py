@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import abc
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWorker(abc.ABC):
+    """
+    Base dos workers de fila (outbound, outbox de pedidos, avisos de status): uma thread que acorda a cada
+    `poll_seconds` (ou com `notify`) e chama `run_once` enquanto houver linhas reservadas.
+
+    A instância iniciada fica registrada na própria classe (`current()`), para as funções do módulo
+    (métricas, "acordar o worker") a acharem. `stats` traz os contadores da subclasse mais a latência
+    dos envios com sucesso; `metrics` devolve a média.
+    """
+
+    thread_name = "background-worker"
+    loop_error_event = "background_worker_loop_failed"
+    _current: Optional["BackgroundWorker"] = None
+
+    def __init__(self, poll_seconds: float, stats: Dict[str, Any]) -> None:
+        self.poll_seconds = float(poll_seconds)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {**stats, "latency_ms_total": 0, "latency_ms_max": 0}
+
+    @classmethod
+    def current(cls) -> Optional["BackgroundWorker"]:
+        """Instância iniciada neste processo (None antes do `start`)."""
+        return cls._current
+
+    @classmethod
+    def current_metrics(cls) -> Dict[str, Any]:
+        worker = cls.current()
+        if worker is None:
+            return {"running": False}
+        return worker.metrics()
+
+    def start(self) -> None:
+        type(self)._current = self
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(timeout=self.poll_seconds)
+            self._wakeup.clear()
+            try:
+                while not self._stop.is_set() and self.run_once()["claimed"]:
+                    pass
+            except Exception:
+                logger.exception(self.loop_error_event)
+
+    @abc.abstractmethod
+    def run_once(self) -> Dict[str, Any]:
+        """Reserva e processa um lote; `claimed` = 0 faz o loop voltar a dormir."""
+
+    def _record(self, key: str, latency: float | None = None) -> None:
+        """Conta o resultado; `latency` (segundos desde a criação da linha) só para os enviados."""
+        with self._lock:
+            self.stats[key] += 1
+            if latency is not None:
+                latency_ms = int(latency * 1000)
+                self.stats["latency_ms_total"] += latency_ms
+                self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], latency_ms)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["latency_ms_avg"] = round(stats.pop("latency_ms_total") / stats["sent"], 1) if stats["sent"] else 0.0
+        stats["running"] = self.running()
+        return stats
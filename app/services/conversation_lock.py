@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from sqlalchemy import exc
+
+from app.db import crud
+from app.db.session import get_lock_engine
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationBusy(TimeoutError):
+    """Outro worker (thread ou réplica) segurou a conversa além do timeout."""
+
+
+class KeyedLocks:
+    """Um lock por chave, criado sob demanda e descartado quando ninguém mais o usa."""
+
+    def __init__(self) -> None:
+        self._guard = threading.Lock()
+        self._locks: Dict[str, List[Any]] = {}
+
+    @contextmanager
+    def hold(self, key: str, timeout: float | None = None) -> Iterator[bool]:
+        """Segura o lock da chave; o valor do `with` indica se houve espera (contenção)."""
+        with self._guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        lock = entry[0]
+        try:
+            contended = not lock.acquire(blocking=False)
+            if contended and not lock.acquire(timeout=-1 if timeout is None else timeout):
+                raise ConversationBusy(key)
+            try:
+                yield contended
+            finally:
+                lock.release()
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+    def __len__(self) -> int:
+        with self._guard:
+            return len(self._locks)
+
+
+_local_locks = KeyedLocks()
+lock_stats: Dict[str, Any] = {"acquired": 0, "contended": 0, "timeouts": 0, "wait_ms_max": 0}
+_stats_lock = threading.Lock()
+
+
+def _record(wait_ms: float, contended: bool) -> None:
+    with _stats_lock:
+        lock_stats["acquired"] += 1
+        if contended:
+            lock_stats["contended"] += 1
+        lock_stats["wait_ms_max"] = max(lock_stats["wait_ms_max"], int(wait_ms))
+
+
+def _acquire_pg(conn, telefone: str, deadline: float) -> bool:
+    delay = 0.05
+    while True:
+        if crud.try_conversation_lock(conn, telefone):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, 0.5)
+
+
+@contextmanager
+def conversation_lock(telefone: str, timeout: float | None = None, engine=None) -> Iterator[None]:
+    """
+    Serializa o processamento de uma mesma conversa: lock em memória (threads deste processo)
+    + advisory lock no Postgres (outras réplicas). Conversas diferentes seguem em paralelo.
+    """
+    timeout = settings.conversation_lock_timeout_seconds if timeout is None else timeout
+    started = time.monotonic()
+    deadline = started + timeout
+    try:
+        with _local_locks.hold(telefone, timeout=timeout) as contended:
+            if not settings.conversation_pg_lock:
+                _record((time.monotonic() - started) * 1000, contended)
+                yield
+                return
+            try:
+                conn_cm = (engine or get_lock_engine()).connect()
+            except exc.TimeoutError:
+                # pool de locks esgotado: conversas demais em andamento neste processo
+                raise ConversationBusy(telefone)
+            with conn_cm as conn:
+                # autocommit: o advisory lock é de sessão; sem isso a conexão fica "idle in transaction"
+                # o turno inteiro (LLM incluso) e o idle_in_transaction_session_timeout derruba o lock
+                conn.execution_options(isolation_level="AUTOCOMMIT")
+                if not crud.try_conversation_lock(conn, telefone):
+                    contended = True
+                    if not _acquire_pg(conn, telefone, deadline):
+                        raise ConversationBusy(telefone)
+                _record((time.monotonic() - started) * 1000, contended)
+                try:
+                    yield
+                finally:
+                    crud.conversation_unlock(conn, telefone)
+    except ConversationBusy:
+        with _stats_lock:
+            lock_stats["timeouts"] += 1
+        raise
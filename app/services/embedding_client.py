@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import logging
+from typing import List, Sequence
+
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from app.utils.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+OPENAI_EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+class EmbeddingClient:
+    """Cliente de embeddings da OpenAI com suporte a lotes (vários inputs por request)."""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        client: httpx.Client | None = None,
+        max_retries: int = 5,
+        timeout: int = 60,
+    ) -> None:
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max(int(max_retries), 1)
+        self.timeout = timeout
+        self._client = client
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _post(self, client: httpx.Client, texts: Sequence[str]) -> dict:
+        resp = client.post(
+            OPENAI_EMBEDDINGS_URL,
+            headers=self._headers(),
+            json={"model": self.model, "input": list(texts)},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+    def embed_batch(self, texts: Sequence[str], client: httpx.Client | None = None) -> List[List[float]]:
+        """Gera embeddings para um lote, preservando a ordem dos textos de entrada."""
+        if not texts:
+            return []
+        if not self.api_key:
+            return [[] for _ in texts]
+
+        post = retry(
+            retry=retry_if_exception(_is_retryable),
+            wait=wait_random_exponential(multiplier=0.5, max=20),
+            stop=stop_after_attempt(self.max_retries),
+            reraise=True,
+        )(self._post)
+
+        http = client or self._client
+        if http is not None:
+            data = post(http, texts)
+        else:
+            with http_client("openai", timeout=self.timeout) as owned:
+                data = post(owned, texts)
+
+        vectors: List[List[float]] = [[] for _ in texts]
+        for entry in data.get("data") or []:
+            idx = entry.get("index")
+            if isinstance(idx, int) and 0 <= idx < len(vectors):
+                vectors[idx] = entry.get("embedding") or []
+        return vectors
+
+    def embed(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0]
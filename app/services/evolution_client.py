@@ -5,6 +5,8 @@ import re
 
 import httpx
 
+from app.utils.http_client import http_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,7 +32,7 @@ class EvolutionClient:
     def _post(self, url: str, payload: dict, timeout: int) -> httpx.Response:
         if self._client is not None:
             return self._client.post(url, headers=self._headers(), json=payload)
-        with httpx.Client(timeout=timeout) as client:
+        with http_client("evolution", timeout=timeout) as client:
             return client.post(url, headers=self._headers(), json=payload)
 
     def send_text(self, instance: str, number: str, text: str, delay: int = 4000, base_url: str | None = None) -> dict:
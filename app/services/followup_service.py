@@ -1,45 +1,241 @@
 from __future__ import annotations
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from app.db import crud
+from app.services.conversation_lock import ConversationBusy, conversation_lock
+from app.services.followup_templates import render_followup
+from app.services.outbound_queue import send_messages
 from app.settings import settings
+from app.utils.rate_limit import TokenBucket
 from app.utils.time import format_horario
+from app.utils.tracing import bind_context, start_trace
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "followup"
+ARCHIVE_JOB_ID = "session_archive"
+
+_instance: Optional["FollowupService"] = None
 
 
 class FollowupService:
-    def __init__(self, db_factory, llm_factory, evolution_client) -> None:
+    """
+    Follow-up de conversas paradas: cada ciclo reserva um lote de candidatos no banco e processa
+    em paralelo (sessão de banco por candidato), com envio à Evolution limitado por taxa.
+    """
+
+    def __init__(
+        self,
+        db_factory,
+        llm_factory,
+        evolution_client,
+        scheduler: BackgroundScheduler | None = None,
+        max_workers: int | None = None,
+        send_rate: float | None = None,
+    ) -> None:
         self.db_factory = db_factory
         self.llm_factory = llm_factory
         self.evolution_client = evolution_client
-        self.scheduler = BackgroundScheduler()
+        self.scheduler = scheduler or BackgroundScheduler()
+        self.max_workers = max(int(max_workers or settings.followup_concurrency), 1)
+        rate = settings.followup_send_rate_per_second if send_rate is None else send_rate
+        self.send_limiter = TokenBucket(rate, burst=self.max_workers)
+        self._running = threading.Lock()
+        self._cursor: Optional[Tuple[datetime, int]] = None
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "cycles": 0,
+            "overlaps_skipped": 0,
+            "sent_total": 0,
+            "failed_total": 0,
+            "skipped_busy_total": 0,
+            "template_renders": 0,
+            "llm_calls": 0,
+            "last_claimed": 0,
+            "last_pages": 0,
+            "archived_total": 0,
+            "last_sent": 0,
+            "last_cycle_ms": 0,
+            "max_cycle_ms": 0,
+            "last_run_at": None,
+        }
 
     def start(self) -> None:
+        global _instance
+        _instance = self
         if not settings.followup_enabled:
             return
-        self.scheduler.add_job(self.run_once, "interval", minutes=settings.followup_interval_minutes)
-        self.scheduler.start()
-
-    def run_once(self) -> None:
-        with self.db_factory() as db:
-            agent = self.llm_factory(db)
-            rows = crud.fetch_followup_candidates(db)
-            for row in rows:
-                telefone = row.get("session_id")
-                last_message = row.get("last_message") or ""
-                last_type = row.get("last_message_type") or ""
-                updated_at = row.get("updated_at")
-                if isinstance(updated_at, datetime):
-                    horario = format_horario(updated_at, settings.timezone)
-                else:
-                    horario = ""
-                reply = agent.run_followup(last_message, telefone, horario, last_type)
-                if reply:
-                    try:
-                        self.evolution_client.send_text(settings.evolution_instance, telefone, reply)
-                        crud.mark_followup_sent(db, telefone, reply)
-                    except Exception:
-                        logging.getLogger(__name__).exception("followup_send_failed")
+        self.scheduler.add_job(
+            self.run_once,
+            "interval",
+            id=JOB_ID,
+            minutes=settings.followup_interval_minutes,
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True,
+        )
+        if settings.session_archive_after_days > 0:
+            self.scheduler.add_job(
+                self.archive_once,
+                "interval",
+                id=ARCHIVE_JOB_ID,
+                hours=settings.session_archive_interval_hours,
+                max_instances=1,
+                coalesce=True,
+                replace_existing=True,
+            )
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def run_once(self) -> Dict[str, Any]:
+        if not self._running.acquire(blocking=False):
+            with self._stats_lock:
+                self.stats["overlaps_skipped"] += 1
+            return {"status": "already_running"}
+        started = time.monotonic()
+        try:
+            results = {"sent": 0, "failed": 0, "busy": 0, "empty": 0}
+            # um trace por ciclo: os envios de cada candidato (threads do pool) entram como filhos
+            with start_trace("followup.cycle"):
+                claimed = pages = 0
+                while pages < settings.followup_max_pages:
+                    with self.db_factory() as db:
+                        rows = crud.claim_followup_candidates(
+                            db,
+                            limit=settings.followup_batch_size,
+                            lease_seconds=settings.followup_claim_lease_seconds,
+                            after=self._cursor,
+                        )
+                    pages += 1
+                    claimed += len(rows)
+                    if rows:
+                        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(rows)), thread_name_prefix="followup") as pool:
+                            for outcome in pool.map(bind_context(self._process_candidate), rows):
+                                results[outcome] += 1
+                    if len(rows) < settings.followup_batch_size:
+                        # fim da fila: o próximo ciclo recomeça do mais antigo (inclui claims liberados)
+                        self._cursor = None
+                        break
+                    self._cursor = (rows[-1]["updated_at"], rows[-1]["id"])
+                    if time.monotonic() - started > settings.followup_cycle_budget_seconds:
+                        break
+            cycle_ms = int((time.monotonic() - started) * 1000)
+            with self._stats_lock:
+                self.stats["cycles"] += 1
+                self.stats["sent_total"] += results["sent"]
+                self.stats["failed_total"] += results["failed"]
+                self.stats["skipped_busy_total"] += results["busy"]
+                self.stats["last_claimed"] = claimed
+                self.stats["last_pages"] = pages
+                self.stats["last_sent"] = results["sent"]
+                self.stats["last_cycle_ms"] = cycle_ms
+                self.stats["max_cycle_ms"] = max(self.stats["max_cycle_ms"], cycle_ms)
+                self.stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+            logger.info("followup_cycle", extra={"claimed": claimed, "pages": pages, **results, "duration_ms": cycle_ms})
+            return {"status": "ok", "claimed": claimed, "pages": pages, **results, "duration_ms": cycle_ms}
+        finally:
+            self._running.release()
+
+    def archive_once(self) -> Dict[str, Any]:
+        """Move sessões encerradas antigas para active_sessions_archive, em lotes."""
+        days = settings.session_archive_after_days
+        if days <= 0:
+            return {"status": "disabled"}
+        archived = 0
+        try:
+            with self.db_factory() as db:
+                while True:
+                    moved = crud.archive_finished_sessions(db, days, settings.session_archive_batch_size)
+                    archived += moved
+                    if moved < settings.session_archive_batch_size:
+                        break
+        except Exception:
+            logger.exception("session_archive_failed")
+            return {"status": "error", "archived": archived}
+        with self._stats_lock:
+            self.stats["archived_total"] += archived
+        logger.info("session_archive", extra={"archived": archived})
+        return {"status": "ok", "archived": archived}
+
+    def _process_candidate(self, row: Dict[str, Any]) -> str:
+        telefone = row.get("session_id")
+        sent = False
+        try:
+            # conversa em atendimento agora não precisa de follow-up: não espera o lock
+            with conversation_lock(telefone, timeout=0):
+                with self.db_factory() as db:
+                    sent = self._followup(db, row)
+            return "sent" if sent else "empty"
+        except ConversationBusy:
+            return "busy"
+        except Exception:
+            logger.exception("followup_send_failed")
+            return "failed"
+        finally:
+            if not sent:
+                self._release(telefone)
+
+    def _compose(self, db, row: Dict[str, Any]) -> str:
+        if settings.followup_templates_enabled:
+            state, reply = render_followup(row, settings.restaurant_name)
+            if reply:
+                with self._stats_lock:
+                    self.stats["template_renders"] += 1
+                logger.debug("followup_template", extra={"state": state})
+                return reply
+        updated_at = row.get("updated_at")
+        if isinstance(updated_at, datetime):
+            horario = format_horario(updated_at, settings.timezone)
+        else:
+            horario = ""
+        with self._stats_lock:
+            self.stats["llm_calls"] += 1
+        agent = self.llm_factory(db)
+        return agent.run_followup(
+            row.get("last_message") or "",
+            row.get("session_id"),
+            horario,
+            row.get("last_message_type") or "",
+        )
+
+    def _followup(self, db, row: Dict[str, Any]) -> bool:
+        telefone = row.get("session_id")
+        reply = self._compose(db, row)
+        if not reply:
+            return False
+        self.send_limiter.acquire()
+        send_messages(db, self.evolution_client, telefone, [reply], source="followup")
+        try:
+            crud.mark_followup_sent(db, telefone, reply)
+        except Exception:
+            # já foi enviado: mantém o claim (expira pelo lease) em vez de liberar para reenvio imediato
+            logger.exception("followup_mark_failed")
+        return True
+
+    def _release(self, telefone: str) -> None:
+        try:
+            with self.db_factory() as db:
+                crud.release_followup_claim(db, telefone)
+        except Exception:
+            logger.exception("followup_release_failed")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        composed = stats["template_renders"] + stats["llm_calls"]
+        stats["llm_ratio"] = round(stats["llm_calls"] / composed, 4) if composed else 0.0
+        return stats
+
+
+def followup_metrics() -> Dict[str, Any]:
+    if _instance is None:
+        return {"enabled": False}
+    return _instance.metrics()
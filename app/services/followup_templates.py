@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import json
+import re
+from string import Template
+from typing import Any, Dict, Optional, Tuple
+
+# Compilados uma vez no import e reutilizados para todos os candidatos do lote.
+TEMPLATES: Dict[str, Template] = {
+    "cart_empty": Template(
+        "Oi! Ainda tá por aí? 😊 Se quiser, já te ajudo a montar seu pedido aqui no $restaurante."
+    ),
+    "items_pending": Template(
+        "Oi! Vi que você separou $itens. Quer incluir mais alguma coisa ou posso seguir com o pedido?"
+    ),
+    "delivery_type_missing": Template(
+        "Oi! Seu pedido com $itens tá quase pronto. Vai ser pra entrega ou retirada?"
+    ),
+    "address_missing": Template(
+        "Oi! Pra gente mandar $itens, só falta o endereço de entrega. Me passa rua, número e bairro?"
+    ),
+    "payment_missing": Template(
+        "Oi! Falta só a forma de pagamento pra fechar seu pedido ($itens). Vai ser PIX, cartão ou dinheiro?"
+    ),
+    "awaiting_payment": Template(
+        "Oi! Conseguiu finalizar o pagamento? Assim que eu receber o comprovante, já coloco seu pedido pra sair!"
+    ),
+    "confirm_order": Template(
+        "Oi! Vi que nossa conversa ficou parada por aqui 😅. Posso confirmar seu pedido com $itens?"
+    ),
+}
+
+_PAYMENT_HINT = re.compile(r"chave\s+pix|comprovante|qr\s*code", re.I)
+
+
+def _cart(row: Dict[str, Any]) -> Dict[str, Any]:
+    cart = row.get("cart_json")
+    if isinstance(cart, str):
+        try:
+            cart = json.loads(cart)
+        except ValueError:
+            return {}
+    return cart if isinstance(cart, dict) else {}
+
+
+def _item_names(itens: list) -> str:
+    nomes = []
+    for item in itens:
+        if not isinstance(item, dict):
+            continue
+        nome = item.get("nome") or item.get("item") or item.get("descricao")
+        if nome:
+            nomes.append(str(nome))
+    if not nomes:
+        return "seus itens"
+    if len(nomes) > 2:
+        return f"{nomes[0]}, {nomes[1]} e mais {len(nomes) - 2}"
+    return " e ".join(nomes)
+
+
+def classify_followup(row: Dict[str, Any]) -> Optional[str]:
+    """
+    Estado da sessão que decide o template. None quando o caso é ambíguo e deve ir ao LLM
+    (itens pendentes de correção, ou conversa parada numa pergunta livre do agente).
+    """
+    cart = _cart(row)
+    last_message = (row.get("last_message") or "").strip()
+    last_type = row.get("last_message_type") or ""
+    if cart.get("pendencias"):
+        return None
+    if last_type == "ai" and _PAYMENT_HINT.search(last_message):
+        return "awaiting_payment"
+    itens = cart.get("itens") if isinstance(cart.get("itens"), list) else []
+    if not itens:
+        # sem carrinho, uma pergunta do agente precisa ser reformulada com contexto
+        return None if last_type == "ai" and last_message.endswith("?") else "cart_empty"
+    tipo_entrega = (cart.get("tipo_entrega") or "").lower()
+    if not tipo_entrega:
+        return "delivery_type_missing" if last_type == "ai" else "items_pending"
+    if tipo_entrega.startswith("entrega") and not cart.get("endereco"):
+        return "address_missing"
+    if not cart.get("pagamento"):
+        return "payment_missing"
+    return "confirm_order"
+
+
+def render_followup(row: Dict[str, Any], restaurante: str = "") -> Tuple[Optional[str], Optional[str]]:
+    """Retorna (estado, mensagem) pelo template; (None, None) quando o caso fica com o LLM."""
+    state = classify_followup(row)
+    if state is None:
+        return None, None
+    itens = _cart(row).get("itens") or []
+    text = TEMPLATES[state].safe_substitute(itens=_item_names(itens), restaurante=restaurante or "nosso cardápio")
+    return state, text
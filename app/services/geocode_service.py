@@ -3,7 +3,7 @@ from __future__ import annotations
 import logging
 import unicodedata
 
-import httpx
+from app.utils.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -98,7 +98,7 @@ class GeocodeService:
             params["components"] = components
 
         try:
-            with httpx.Client(timeout=30) as client:
+            with http_client("google_maps", timeout=30) as client:
                 resp = client.get(url, params=params)
                 resp.raise_for_status()
                 data = resp.json()
@@ -3,6 +3,7 @@ from __future__ import annotations
 import json
 import re
 import logging
+import time
 import unicodedata
 from datetime import date, datetime
 from decimal import Decimal
@@ -10,18 +11,35 @@ from typing import Any, Dict, List, Optional
 
 from collections.abc import Mapping
 
-import httpx
-
 from app.settings import settings
 from app.db import crud
 from app.services.geocode_service import GeocodeService
 from app.services.menu_service import MenuService
+from app.services.menu_sync_service import request_menu_refresh
 from app.services.order_service import OrderService
 from app.services.order_interpreter import OrderInterpreterService
 from app.services.pix_validator import validate_pix_receipt
+from app.services.transcription_service import openai_transcribe
+from app.utils.http_client import http_client
+from app.utils import tracing
+from app.utils.metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
+MAX_AGENT_ITERATIONS = 6
+AGENT_ITERATIONS = REGISTRY.histogram(
+    "lia_agent_iterations",
+    "Iterações do loop de tools por execução do agente",
+    ("result",),
+    buckets=tuple(range(1, MAX_AGENT_ITERATIONS + 1)),
+)
+AGENT_LLM_SECONDS = REGISTRY.histogram(
+    "lia_agent_llm_seconds", "Duração de cada chamada ao modelo por posição no loop do agente", ("iteration",)
+)
+AGENT_TOOL_SECONDS = REGISTRY.histogram(
+    "lia_agent_tool_seconds", "Duração de cada tool executada pelo agente", ("tool", "result")
+)
+
 def _strip_markdown_json(text: str) -> str:
     cleaned = text.replace("```json", "").replace("```", "").strip()
     first_brace = cleaned.find("{")
@@ -206,7 +224,7 @@ def _openai_chat(messages: List[Dict[str, Any]], tools: Optional[List[Dict]] = N
     if tools:
         payload["tools"] = tools
         payload["tool_choice"] = tool_choice
-    with httpx.Client(timeout=90) as client:
+    with http_client("openai", timeout=90) as client:
         resp = client.post(url, headers=headers, json=payload)
         if resp.status_code >= 400:
             body = ""
@@ -230,17 +248,7 @@ def _openai_chat(messages: List[Dict[str, Any]], tools: Optional[List[Dict]] = N
 
 
 def _openai_transcribe(audio_bytes: bytes) -> str:
-    url = "https://api.openai.com/v1/audio/transcriptions"
-    headers = {"Authorization": f"Bearer {settings.openai_api_key}"}
-    files = {
-        "file": ("audio.mp3", audio_bytes, "audio/mpeg"),
-        "model": (None, settings.openai_model_transcribe),
-    }
-    with httpx.Client(timeout=120) as client:
-        resp = client.post(url, headers=headers, files=files)
-        resp.raise_for_status()
-        data = resp.json()
-    return data.get("text") or ""
+    return openai_transcribe(audio_bytes, "audio.mp4", "audio/mp4")
 
 
 class LLMAgent:
@@ -254,6 +262,7 @@ class LLMAgent:
         self.order_interpreter = OrderInterpreterService(db)
         self._current_session_id: str | None = None
         self._merge_interpret: bool = False
+        self._pending_usage = [0, 0, 0]
 
     def _is_simple_confirmation(self, text: str) -> bool:
         if not text:
@@ -342,13 +351,23 @@ class LLMAgent:
         total_tokens = usage.get("total_tokens") or 0
         if not any((prompt_tokens, completion_tokens, total_tokens)):
             return
+        # acumula durante o loop de tools e grava uma única vez no fim do run (flush_usage)
+        self._pending_usage[0] += int(prompt_tokens)
+        self._pending_usage[1] += int(completion_tokens)
+        self._pending_usage[2] += int(total_tokens)
+
+    def flush_usage(self) -> None:
+        prompt_tokens, completion_tokens, total_tokens = self._pending_usage
+        self._pending_usage = [0, 0, 0]
+        if not self._current_session_id or not any((prompt_tokens, completion_tokens, total_tokens)):
+            return
         try:
             crud.increment_session_tokens(
                 self.db,
                 self._current_session_id,
-                int(prompt_tokens),
-                int(completion_tokens),
-                int(total_tokens),
+                prompt_tokens,
+                completion_tokens,
+                total_tokens,
             )
         except Exception:
             logger.warning("token_track_failed", exc_info=True)
@@ -445,10 +464,11 @@ class LLMAgent:
                 "type": "function",
                 "function": {
                     "name": "validar_comprovante_pix",
-                    "description": "Valida comprovante PIX (imagem ou texto). Retorna se é válido.",
+                    "description": "Valida comprovante PIX (imagem ou texto). Com imagem, passe a legenda do cliente em `texto`. Retorna se é válido; com status inconclusive, peça o comprovante de novo.",
                     "parameters": {
                         "type": "object",
                         "properties": {
+                            "media_id": {"type": "string"},
                             "media_base64": {"type": "string"},
                             "mime_type": {"type": "string"},
                             "texto": {"type": "string"},
@@ -476,7 +496,7 @@ class LLMAgent:
                 "type": "function",
                 "function": {
                     "name": "atualizar_cardapio",
-                    "description": "Sincroniza o cardápio com Saipos.",
+                    "description": "Solicita uma atualização do cardápio com a Saipos (roda em segundo plano e retorna imediatamente).",
                     "parameters": {"type": "object", "properties": {}},
                 },
             },
@@ -562,10 +582,12 @@ class LLMAgent:
             return self.order_service.process_order(payload)
         if name == "validar_comprovante_pix":
             result = validate_pix_receipt(
+                media_id=args.get("media_id"),
                 media_base64=args.get("media_base64"),
                 mime_type=args.get("mime_type"),
                 texto=args.get("texto"),
                 return_usage=True,
+                session_id=self._current_session_id,
             )
             usage = result.pop("_usage", None) if isinstance(result, dict) else None
             if usage:
@@ -576,7 +598,7 @@ class LLMAgent:
         if name == "validar_endereco":
             return self.geocode.geocode(args.get("texto") or "")
         if name == "atualizar_cardapio":
-            return self.menu_service.sync_menu()
+            return request_menu_refresh()
         if name == "interpretar_pedido":
             result = self.order_interpreter.interpret_to_dict(args.get("texto_pedido") or "")
             if self._current_session_id and isinstance(result, dict):
@@ -622,9 +644,24 @@ class LLMAgent:
             return result
         return {"error": f"tool_not_found: {name}"}
 
+    def _timed_tool(self, label: str, name: str, args: Dict[str, Any]) -> Any:
+        # label fica restrito às tools declaradas: nomes inventados pelo modelo viram "unknown"
+        started = time.perf_counter()
+        result = "error"
+        with tracing.span(f"tool.{label}") as span:
+            try:
+                value = self._execute_tool(name, args)
+                result = "error" if isinstance(value, dict) and value.get("error") else "ok"
+                return value
+            finally:
+                AGENT_TOOL_SECONDS.observe(time.perf_counter() - started, tool=label, result=result)
+                if span is not None and result == "error":
+                    span.status = "error"
+
     def run(self, message: str, telefone: str, horario: str, historico: Dict[str, Any]) -> str:
         self._current_session_id = telefone
         self._merge_interpret = False
+        iteration, outcome = 0, "error"
         try:
             # Se houver pendências e o cliente responder apenas confirmando,
             # transforma em texto de correções para interpretação e merge no carrinho.
@@ -660,9 +697,11 @@ class LLMAgent:
 
             messages.append({"role": "user", "content": message})
             tools = self._tools()
+            tool_names = {t["function"]["name"] for t in tools}
 
-            for _ in range(6):
-                data = _openai_chat(messages, tools=tools, tool_choice="auto")
+            for iteration in range(1, MAX_AGENT_ITERATIONS + 1):
+                with AGENT_LLM_SECONDS.time(iteration=iteration), tracing.span("llm.chat", iteration=iteration):
+                    data = _openai_chat(messages, tools=tools, tool_choice="auto")
                 self._track_usage(data.get("usage"))
                 msg = data["choices"][0]["message"]
                 tool_calls = msg.get("tool_calls")
@@ -675,7 +714,7 @@ class LLMAgent:
                             args = json.loads(args_str)
                         except Exception:
                             args = {}
-                        result = self._execute_tool(name, args)
+                        result = self._timed_tool(name if name in tool_names else "unknown", name, args)
                         messages.append(
                             {
                                 "role": "tool",
@@ -684,9 +723,15 @@ class LLMAgent:
                             }
                         )
                     continue
+                outcome = "reply"
                 return msg.get("content") or ""
+            outcome = "exhausted"
             return ""
         finally:
+            if iteration:
+                AGENT_ITERATIONS.observe(iteration, result=outcome)
+                tracing.set_attributes(agent_iterations=iteration, agent_result=outcome)
+            self.flush_usage()
             self._current_session_id = None
             self._merge_interpret = False
 
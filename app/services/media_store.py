@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from app.settings import settings
+from app.utils.base64_stream import iter_base64_chunks
+
+_PURGE_INTERVAL_SECONDS = 3600
+# `.upload-*` mais velho que isso é sobra de um processo que morreu no meio da escrita
+_ORPHAN_UPLOAD_SECONDS = 3600
+
+
+class MediaNotFound(KeyError):
+    pass
+
+
+class MediaStore:
+    """
+    Spool em disco de mídias recebidas (imagens, comprovantes), endereçado pelo sha256 do conteúdo.
+    A mensagem enviada ao LLM e gravada no histórico carrega só o `media_id`, lido em turnos seguintes.
+
+    Com mais de uma réplica o diretório precisa ser um volume montado em todas (`MEDIA_STORE_SHARED=true`
+    exige `MEDIA_STORE_DIR`); as escritas já são atômicas (`os.replace`) e o nome é o hash, então réplicas
+    gravando a mesma mídia não conflitam. Sem isso, só uma réplica.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path, None] = None,
+        ttl_seconds: int | None = None,
+        shared: bool | None = None,
+    ) -> None:
+        shared = settings.media_store_shared if shared is None else shared
+        if shared and not (root or settings.media_store_dir):
+            raise ValueError("MEDIA_STORE_SHARED=true exige MEDIA_STORE_DIR apontando para o volume compartilhado")
+        self.root = Path(root or settings.media_store_dir or Path(tempfile.gettempdir()) / "lia-media")
+        self.ttl_seconds = int(ttl_seconds if ttl_seconds is not None else settings.media_store_ttl_hours * 3600)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, media_id: str) -> Path:
+        if not media_id or not all(c in "0123456789abcdef" for c in media_id):
+            raise MediaNotFound(media_id)
+        return self.root / media_id[:2] / media_id
+
+    def _commit(self, tmp_path: str, media_id: str, mime_type: str, size: int) -> str:
+        path = self._path(media_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+        path.with_suffix(".json").write_text(json.dumps({"mime_type": mime_type, "size": size}))
+        self._maybe_purge()
+        return media_id
+
+    def put(self, data: Union[bytes, memoryview], mime_type: str = "application/octet-stream") -> str:
+        view = memoryview(data)
+        media_id = hashlib.sha256(view).hexdigest()
+        if self._path(media_id).exists():
+            return media_id
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(view)
+        return self._commit(tmp_path, media_id, mime_type, len(view))
+
+    def put_base64(self, data: str, mime_type: str = "application/octet-stream") -> str:
+        """Decodifica o base64 em fatias direto para o disco (sem materializar os bytes inteiros)."""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                for chunk in iter_base64_chunks(data):
+                    hasher.update(chunk)
+                    fh.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        media_id = hasher.hexdigest()
+        if self._path(media_id).exists():
+            os.unlink(tmp_path)
+            return media_id
+        return self._commit(tmp_path, media_id, mime_type, size)
+
+    def meta(self, media_id: str) -> Dict[str, Any]:
+        path = self._path(media_id)
+        try:
+            return json.loads(path.with_suffix(".json").read_text())
+        except FileNotFoundError:
+            raise MediaNotFound(media_id) from None
+
+    def get_bytes(self, media_id: str) -> bytes:
+        try:
+            return self._path(media_id).read_bytes()
+        except FileNotFoundError:
+            raise MediaNotFound(media_id) from None
+
+    def data_url(self, media_id: str, mime_type: Optional[str] = None) -> str:
+        mime = mime_type or self.meta(media_id).get("mime_type") or "application/octet-stream"
+        return f"data:{mime};base64,{base64.b64encode(self.get_bytes(media_id)).decode('ascii')}"
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+                return
+            self._last_purge = now
+        self.purge(older_than_seconds=self.ttl_seconds, now=now)
+
+    def purge(self, older_than_seconds: int, now: float | None = None) -> int:
+        now = now or time.time()
+        cutoff = now - older_than_seconds
+        for path in self.root.glob(".upload-*"):
+            try:
+                if path.stat().st_mtime < now - _ORPHAN_UPLOAD_SECONDS:
+                    path.unlink()
+            except FileNotFoundError:
+                continue
+        removed = 0
+        for path in self.root.glob("*/*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += path.suffix != ".json"
+            except FileNotFoundError:
+                continue
+        return removed
+
+
+_store: Optional[MediaStore] = None
+_store_lock = threading.Lock()
+
+
+def get_media_store() -> MediaStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore()
+    return _store
@@ -1,16 +1,53 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 import httpx
-from sqlalchemy import text
 
 from app.db import crud
+from app.services.embedding_client import EmbeddingClient
+from app.services.order_interpreter.vector_index import reset_vector_index
 from app.settings import settings
+from app.utils.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_content_hash(display_name: str | None, category: str | None, model: str) -> str:
+    # o modelo entra no hash: trocar o modelo do embedder regera todos os vetores
+    basis = "|".join([(display_name or "").strip(), (category or "").strip(), model])
+    return hashlib.sha256(basis.encode("utf-8")).hexdigest()
+
+
+def menu_row_key(row: Dict[str, Any]) -> Tuple[str, str]:
+    codigo = row.get("codigo_saipos")
+    choice = row.get("id_store_choice")
+    return ("" if codigo is None else str(codigo), "" if choice is None else str(choice))
+
+
+def menu_row_hash(row: Dict[str, Any]) -> str:
+    basis = json.dumps({k: row.get(k) for k in sorted(row) if k != "row_hash"}, sort_keys=True, default=str)
+    return hashlib.sha256(basis.encode("utf-8")).hexdigest()
+
+
+def _vector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(str(x) for x in embedding) + "]"
 
 
 class MenuService:
-    def __init__(self, db, saipos_client) -> None:
+    def __init__(self, db, saipos_client, embedder: EmbeddingClient | None = None) -> None:
         self.db = db
         self.saipos_client = saipos_client
+        self.embedder = embedder or EmbeddingClient(
+            settings.openai_api_key,
+            settings.openai_model_embed,
+            max_retries=settings.embed_max_retries,
+        )
 
     def _extract_items(self, data):
         if isinstance(data, list):
@@ -22,95 +59,237 @@ class MenuService:
                     return val
         return []
 
-    def sync_menu(self) -> dict:
-        data = self.saipos_client.fetch_catalog()
+    def _map_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        codigo = row.get("codigo_saipos") or row.get("codigo") or row.get("pdv")
+        pdv_code = codigo
+        parent_pdv_code = None
+        if codigo and isinstance(codigo, str) and "." in codigo:
+            parent_pdv_code = codigo.split(".")[0]
+
+        mapped = {
+            "client_id": settings.client_id,
+            "tipo": row.get("tipo"),
+            "categoria": row.get("categoria"),
+            "tamanho": row.get("tamanho"),
+            "id_store_item": row.get("id_store_item"),
+            "item": row.get("item"),
+            "id_store_choice": row.get("id_store_choice"),
+            "complemento": row.get("complemento"),
+            "complemento_item": row.get("complemento_item"),
+            "price": row.get("price"),
+            "codigo_saipos": codigo,
+            "store_item_enabled": row.get("store_item_enabled"),
+            "store_choice_enabled": row.get("store_choice_enabled"),
+            "store_choice_item_enabled": row.get("store_choice_item_enabled"),
+            "item_type": row.get("item_type"),
+            "pdv_code": pdv_code,
+            "parent_pdv_code": parent_pdv_code,
+        }
+        mapped["row_hash"] = menu_row_hash(mapped)
+        return mapped
+
+    def diff_menu(
+        self, rows: List[Dict[str, Any]], existing: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[int]]:
+        """Compara as linhas novas com as atuais (por codigo_saipos/id_store_choice) e devolve o diff."""
+        current: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+        occurrences: Dict[Tuple[str, str], int] = {}
+        for row in existing:
+            base = menu_row_key(row)
+            n = occurrences.get(base, 0)
+            occurrences[base] = n + 1
+            current[(base[0], base[1], n)] = row
+
+        inserts: List[Dict[str, Any]] = []
+        updates: List[Dict[str, Any]] = []
+        seen: set[Tuple[str, str, int]] = set()
+        occurrences = {}
+        for row in rows:
+            base = menu_row_key(row)
+            n = occurrences.get(base, 0)
+            occurrences[base] = n + 1
+            key = (base[0], base[1], n)
+            seen.add(key)
+            old = current.get(key)
+            if old is None:
+                inserts.append(row)
+            elif old.get("row_hash") != row.get("row_hash"):
+                updates.append({**row, "id": old.get("id")})
+
+        delete_ids = [int(row.get("id")) for key, row in current.items() if key not in seen]
+        return inserts, updates, delete_ids
+
+    def sync_menu(self, data: Any = None) -> dict:
+        if data is None:
+            data = self.saipos_client.fetch_catalog()
         items = self._extract_items(data)
+        rows = [self._map_row(row) for row in items if isinstance(row, dict)]
 
-        rows = []
-        for row in items:
-            codigo = row.get("codigo_saipos") or row.get("codigo") or row.get("pdv")
-            pdv_code = codigo
-            parent_pdv_code = None
-            if codigo and isinstance(codigo, str) and "." in codigo:
-                parent_pdv_code = codigo.split(".")[0]
-
-            rows.append(
-                {
-                    "client_id": settings.client_id,
-                    "tipo": row.get("tipo"),
-                    "categoria": row.get("categoria"),
-                    "tamanho": row.get("tamanho"),
-                    "id_store_item": row.get("id_store_item"),
-                    "item": row.get("item"),
-                    "id_store_choice": row.get("id_store_choice"),
-                    "complemento": row.get("complemento"),
-                    "complemento_item": row.get("complemento_item"),
-                    "price": row.get("price"),
-                    "codigo_saipos": codigo,
-                    "store_item_enabled": row.get("store_item_enabled"),
-                    "store_choice_enabled": row.get("store_choice_enabled"),
-                    "store_choice_item_enabled": row.get("store_choice_item_enabled"),
-                    "item_type": row.get("item_type"),
-                    "pdv_code": pdv_code,
-                    "parent_pdv_code": parent_pdv_code,
-                }
-            )
-
-        crud.delete_saipos_menu_raw(self.db, settings.client_id)
-        crud.insert_saipos_menu_raw(self.db, rows)
-        return {"inserted": len(rows)}
-
-    def generate_embeddings(self) -> dict:
-        # Fetch catalog from view
-        result = self.db.execute(
-            text(
-                """
-            SELECT item_id::text, pdv, display_name, category, price::numeric
-            FROM v_menu_catalog
-            WHERE active = true
-            ORDER BY category, display_name
-            """
-            )
-        )
-        items = result.mappings().all()
+        existing = crud.fetch_saipos_menu_hashes(self.db, settings.client_id)
+        inserts, updates, delete_ids = self.diff_menu(rows, existing)
+        changed = bool(inserts or updates or delete_ids)
+        if changed:
+            version = crud.apply_saipos_menu_diff(self.db, settings.client_id, inserts, updates, delete_ids)
+            reset_vector_index()
+        else:
+            version = crud.fetch_menu_version(self.db, settings.client_id)
+        result = {
+            "total": len(rows),
+            "inserted": len(inserts),
+            "updated": len(updates),
+            "deleted": len(delete_ids),
+            "unchanged": len(rows) - len(inserts) - len(updates),
+            "changed": changed,
+            "menu_version": version,
+        }
+        logger.info("menu_sync_applied", extra={"result": result})
+        return result
 
-        inserted = 0
-        for item in items:
-            embedding = self._embed_text(item.get("display_name") or "")
-            if not embedding:
-                continue
-            embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-            self.db.execute(
-                text(
-                    """
-                INSERT INTO menu_embeddings
-                (pdv, display_name, category, price, embedding)
-                VALUES (:pdv, :display_name, :category, :price, :embedding::vector)
-                """
-                ),
-                {
-                    "pdv": item.get("pdv"),
-                    "display_name": item.get("display_name"),
-                    "category": item.get("category"),
-                    "price": item.get("price"),
-                    "embedding": embedding_str,
-                },
-            )
-            inserted += 1
-        self.db.commit()
-        return {"inserted": inserted}
-
-    def _embed_text(self, text: str):
-        if not settings.openai_api_key:
-            return []
-        url = "https://api.openai.com/v1/embeddings"
-        headers = {"Authorization": f"Bearer {settings.openai_api_key}"}
-        payload = {"model": settings.openai_model_embed, "input": text}
-        with httpx.Client(timeout=60) as client:
-            resp = client.post(url, headers=headers, json=payload)
-            resp.raise_for_status()
-            data = resp.json()
+    def sync_menu_if_changed(self, etag: str | None = None) -> dict:
+        """Baixa o catálogo e só toca no banco se o hash do corpo mudou desde a última sincronização."""
+        status, content, new_etag = self.saipos_client.fetch_catalog_raw(etag=etag)
+        if status == 304:
+            return {"skipped": True, "reason": "not_modified", "payload_bytes": 0, "etag": new_etag}
+        catalog_hash = hashlib.sha256(content).hexdigest()
+        if catalog_hash == crud.fetch_menu_catalog_hash(self.db, settings.client_id):
+            return {"skipped": True, "reason": "same_hash", "payload_bytes": len(content), "etag": new_etag}
+        result = self.sync_menu(json.loads(content))
+        crud.set_menu_catalog_hash(self.db, settings.client_id, catalog_hash)
+        return {**result, "skipped": False, "payload_bytes": len(content), "etag": new_etag}
+
+    def sync_menu_streaming(self, chunk_size: int | None = None, etag: str | None = None) -> dict:
+        """
+        Variante para catálogos grandes: lê o catálogo em streaming, grava em chunks numa tabela
+        temporária (COPY) e aplica o diff no próprio Postgres, sem manter a lista inteira em memória.
+        Como `sync_menu_if_changed`, manda o ETag anterior e não toca no banco com 304 ou hash igual.
+        """
+        chunk_size = max(int(chunk_size or settings.menu_sync_chunk_size), 1)
+        hasher = hashlib.sha256()
+        meta: Dict[str, Any] = {}
+        total = 0
+        chunk: List[Dict[str, Any]] = []
         try:
-            return data["data"][0]["embedding"]
+            crud.create_saipos_menu_stage(self.db)
+            for item in self.saipos_client.stream_catalog(hasher=hasher, etag=etag, meta=meta):
+                chunk.append(self._map_row(item))
+                if len(chunk) >= chunk_size:
+                    crud.copy_saipos_menu_stage(self.db, chunk)
+                    total += len(chunk)
+                    chunk = []
+            crud.copy_saipos_menu_stage(self.db, chunk)
+            total += len(chunk)
         except Exception:
-            return []
+            self.db.rollback()
+            raise
+
+        new_etag = meta.get("etag")
+        payload_bytes = meta.get("payload_bytes") or 0
+        if meta.get("status") == 304:
+            self.db.rollback()
+            return {"skipped": True, "reason": "not_modified", "total": 0, "payload_bytes": 0, "etag": new_etag}
+        catalog_hash = hasher.hexdigest()
+        if catalog_hash == crud.fetch_menu_catalog_hash(self.db, settings.client_id):
+            self.db.rollback()
+            return {
+                "skipped": True,
+                "reason": "same_hash",
+                "total": total,
+                "catalog_hash": catalog_hash,
+                "payload_bytes": payload_bytes,
+                "etag": new_etag,
+            }
+
+        counts = crud.apply_saipos_menu_stage(self.db, settings.client_id, catalog_hash=catalog_hash)
+        changed = bool(counts["inserted"] or counts["updated"] or counts["deleted"])
+        if changed:
+            reset_vector_index()
+        result = {
+            "total": total,
+            "inserted": counts["inserted"],
+            "updated": counts["updated"],
+            "deleted": counts["deleted"],
+            "unchanged": total - counts["inserted"] - counts["updated"],
+            "changed": changed,
+            "menu_version": counts["version"],
+        }
+        logger.info("menu_sync_applied", extra={"result": result})
+        return {**result, "skipped": False, "catalog_hash": catalog_hash, "payload_bytes": payload_bytes, "etag": new_etag}
+
+    def generate_embeddings(
+        self,
+        batch_size: int | None = None,
+        concurrency: int | None = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> dict:
+        """Gera embeddings apenas dos itens novos/alterados, em lotes paralelos, e grava via upsert."""
+        started = time.monotonic()
+        batch_size = max(int(batch_size or settings.embed_batch_size), 1)
+        concurrency = max(int(concurrency or settings.embed_concurrency), 1)
+
+        items = crud.fetch_menu_catalog(self.db)
+        existing = crud.fetch_menu_embedding_hashes(self.db)
+
+        pending: List[Dict[str, Any]] = []
+        seen: set[str] = set()
+        for item in items:
+            pdv = str(item.get("pdv") or "")
+            if not pdv or pdv in seen:
+                continue
+            seen.add(pdv)
+            content_hash = embedding_content_hash(item.get("display_name"), item.get("category"), self.embedder.model)
+            if existing.get(pdv) == content_hash:
+                continue
+            pending.append({**item, "pdv": pdv, "content_hash": content_hash})
+
+        batches = [pending[i : i + batch_size] for i in range(0, len(pending), batch_size)]
+        rows: List[Dict[str, Any]] = []
+        failed = 0
+        done = 0
+
+        if batches:
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            with http_client("openai", timeout=self.embedder.timeout, limits=limits) as client:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    futures = {
+                        pool.submit(
+                            self.embedder.embed_batch,
+                            [b.get("display_name") or "" for b in batch],
+                            client,
+                        ): batch
+                        for batch in batches
+                    }
+                    for future in as_completed(futures):
+                        batch = futures[future]
+                        try:
+                            vectors = future.result()
+                        except Exception:
+                            logger.warning("embedding_batch_failed", exc_info=True)
+                            failed += len(batch)
+                            vectors = []
+                        for item, vector in zip(batch, vectors):
+                            if not vector:
+                                failed += 1
+                                continue
+                            rows.append(
+                                {
+                                    "pdv": item.get("pdv"),
+                                    "display_name": item.get("display_name"),
+                                    "category": item.get("category"),
+                                    "price": item.get("price"),
+                                    "embedding": _vector_literal(vector),
+                                    "content_hash": item.get("content_hash"),
+                                }
+                            )
+                        done += len(batch)
+                        if progress:
+                            progress(done, len(pending))
+
+        crud.upsert_menu_embeddings(self.db, rows)
+        return {
+            "total": len(seen),
+            "skipped": len(seen) - len(pending),
+            "upserted": len(rows),
+            "failed": failed,
+            "batches": len(batches),
+            "elapsed_seconds": round(time.monotonic() - started, 3),
+        }
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from app.db import crud
+from app.db.session import get_engine
+from app.services.menu_service import MenuService
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_ID = "menu_sync"
+LOCK_NAME = "lia_menu_sync"
+
+_instance: Optional["MenuSyncService"] = None
+
+
+class MenuSyncService:
+    """Sincronização periódica do cardápio Saipos (um único runner entre pods via advisory lock)."""
+
+    def __init__(self, db_factory, saipos_factory, scheduler: BackgroundScheduler | None = None, engine=None) -> None:
+        self.db_factory = db_factory
+        self.saipos_factory = saipos_factory
+        self.scheduler = scheduler or BackgroundScheduler()
+        self.engine = engine
+        self._running = threading.Lock()
+        self._etag: str | None = None
+        self.stats: Dict[str, Any] = {
+            "runs": 0,
+            "skipped": 0,
+            "changed": 0,
+            "lock_busy": 0,
+            "errors": 0,
+            "last_duration_ms": 0,
+            "last_payload_bytes": 0,
+            "last_run_at": None,
+        }
+
+    def start(self) -> None:
+        global _instance
+        _instance = self
+        if not settings.menu_sync_enabled:
+            return
+        self.scheduler.add_job(
+            self.run_once,
+            "interval",
+            id=JOB_ID,
+            minutes=settings.menu_sync_interval_minutes,
+            jitter=settings.menu_sync_jitter_seconds,
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True,
+        )
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def skip_rate(self) -> float:
+        runs = self.stats["runs"]
+        return self.stats["skipped"] / runs if runs else 0.0
+
+    def request_refresh(self) -> Dict[str, Any]:
+        """Agenda uma sincronização imediata sem bloquear quem chamou."""
+        if self._running.locked():
+            return {"status": "already_running"}
+        job = self.scheduler.get_job(JOB_ID) if self.scheduler.running else None
+        if job is not None:
+            job.modify(next_run_time=datetime.now(timezone.utc))
+        else:
+            threading.Thread(target=self.run_once, name="menu-sync-refresh", daemon=True).start()
+        return {"status": "refresh_requested"}
+
+    def run_once(self) -> Dict[str, Any]:
+        if not self._running.acquire(blocking=False):
+            return {"status": "already_running"}
+        try:
+            engine = self.engine or get_engine()
+            with engine.connect() as lock_conn:
+                if not crud.try_advisory_lock(lock_conn, LOCK_NAME):
+                    self.stats["lock_busy"] += 1
+                    return {"status": "locked_elsewhere"}
+                try:
+                    return self._sync()
+                finally:
+                    crud.advisory_unlock(lock_conn, LOCK_NAME)
+                    lock_conn.commit()
+        except Exception:
+            self.stats["errors"] += 1
+            logger.exception("menu_sync_failed")
+            return {"status": "error"}
+        finally:
+            self._running.release()
+
+    def _sync(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        with self.db_factory() as db:
+            service = MenuService(db, self.saipos_factory())
+            if settings.menu_sync_streaming:
+                result = service.sync_menu_streaming(etag=self._etag)
+            else:
+                result = service.sync_menu_if_changed(etag=self._etag)
+        duration_ms = int((time.monotonic() - started) * 1000)
+        self._etag = result.get("etag") or self._etag
+
+        self.stats["runs"] += 1
+        self.stats["last_duration_ms"] = duration_ms
+        self.stats["last_payload_bytes"] = result.get("payload_bytes") or 0
+        self.stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+        if result.get("skipped"):
+            self.stats["skipped"] += 1
+        elif result.get("changed"):
+            self.stats["changed"] += 1
+
+        logger.info(
+            "menu_sync_job",
+            extra={
+                "duration_ms": duration_ms,
+                "payload_bytes": self.stats["last_payload_bytes"],
+                "skipped": bool(result.get("skipped")),
+                "skip_rate": round(self.skip_rate(), 3),
+            },
+        )
+        return {"status": "ok", **result, "duration_ms": duration_ms}
+
+
+def request_menu_refresh() -> Dict[str, Any]:
+    """Pedido barato de atualização do cardápio (usado pela tool `atualizar_cardapio`)."""
+    if _instance is None:
+        return {"status": "unavailable", "reason": "menu_sync_not_started"}
+    return _instance.request_refresh()
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict
+
+import httpx
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+from app.db import crud
+from app.db.session import savepoint, unit_of_work
+from app.services.background_worker import BackgroundWorker
+from app.services.outbound_queue import send_messages
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# timeout do POST /order no SaiposClient e teto do backoff entre tentativas (lease mínimo por pedido)
+SEND_TIMEOUT_SECONDS = 60
+MAX_BACKOFF_SECONDS = 8
+ORDER_FAILED_MESSAGE = (
+    "Não consegui enviar seu pedido para a cozinha por um problema no sistema do restaurante. "
+    "Já avisei a equipe; se preferir, responda aqui que um atendente confirma com você."
+)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Falhas de rede/timeout, 429 e 5xx são transitórias; demais 4xx não adianta repetir."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        code = exc.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(exc, (httpx.TransportError, TimeoutError))
+
+
+def _is_duplicate(exc: BaseException) -> bool:
+    # o order_id é fixo no payload: um 409 numa nova tentativa significa que a Saipos já recebeu o pedido
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 409
+
+
+class OrderDispatcher(BackgroundWorker):
+    """
+    Envia à Saipos os pedidos da outbox (order_outbox) fora do turno do cliente.
+
+    Cada pedido tem até `attempts_per_dispatch` tentativas imediatas (backoff exponencial com jitter,
+    via tenacity); se ainda falhar por erro transitório, volta para a fila com espera crescente até
+    `max_dispatches` rodadas. O resultado alimenta order_audit e orders.
+    """
+
+    thread_name = "order-dispatcher"
+    loop_error_event = "order_dispatch_loop_failed"
+
+    def __init__(
+        self,
+        db_factory,
+        saipos_factory,
+        evolution_factory=None,
+        attempts_per_dispatch: int | None = None,
+        max_dispatches: int | None = None,
+        poll_seconds: float | None = None,
+        wait=None,
+    ) -> None:
+        super().__init__(
+            poll_seconds or settings.order_dispatch_poll_seconds,
+            {"sent": 0, "failed": 0, "requeued": 0, "retries": 0, "customers_notified": 0},
+        )
+        self.db_factory = db_factory
+        self.saipos_factory = saipos_factory
+        self.attempts_per_dispatch = max(int(attempts_per_dispatch or settings.order_dispatch_attempts), 1)
+        self.max_dispatches = max(int(max_dispatches or settings.order_dispatch_max_rounds), 1)
+        self.evolution_factory = evolution_factory
+        self.wait = wait or wait_random_exponential(multiplier=0.5, max=MAX_BACKOFF_SECONDS)
+        # o lease precisa cobrir todas as tentativas de um envio; senão outra réplica reserva o mesmo pedido
+        self.lease_seconds = max(
+            settings.order_dispatch_lease_seconds,
+            self.attempts_per_dispatch * (SEND_TIMEOUT_SECONDS + MAX_BACKOFF_SECONDS) + 30,
+        )
+
+    def run_once(self, limit: int = 10) -> Dict[str, Any]:
+        # um pedido por reserva: o lease de cada um começa quando ele vai ser enviado, não quando o lote saiu
+        outcomes = []
+        with self.db_factory() as db:
+            for _ in range(limit):
+                rows = crud.claim_order_outbox(db, limit=1, lease_seconds=self.lease_seconds)
+                if not rows:
+                    break
+                outcomes.append(self.dispatch(db, self.saipos_factory(), rows[0]))
+        return {"claimed": len(outcomes), "outcomes": outcomes}
+
+    def _send(self, saipos_client, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if settings.saipos_dry_run:
+            return {"status": "dry_run", "message": "Saipos envio desativado em testes."}
+        attempts = {"n": 0}
+
+        def _attempt() -> Dict[str, Any]:
+            attempts["n"] += 1
+            return saipos_client.send_order(payload)
+
+        try:
+            return Retrying(
+                stop=stop_after_attempt(self.attempts_per_dispatch),
+                wait=self.wait,
+                retry=retry_if_exception(is_retryable),
+                reraise=True,
+            )(_attempt)
+        finally:
+            with self._lock:
+                self.stats["retries"] += max(attempts["n"] - 1, 0)
+
+    def dispatch(self, db, saipos_client, row: Dict[str, Any]) -> str:
+        payload = row["payload"]
+        order_id = row["order_id"]
+        try:
+            response = self._send(saipos_client, payload)
+            outcome, error = "sent", None
+        except Exception as exc:
+            if _is_duplicate(exc):
+                response, outcome, error = {"status": "duplicate", "order_id": order_id}, "sent", None
+            elif is_retryable(exc) and row["attempts"] < self.max_dispatches:
+                response, outcome, error = None, "pending", str(exc)
+            else:
+                response, outcome, error = None, "failed", str(exc)
+
+        retry_in = settings.order_dispatch_requeue_seconds * (2 ** (row["attempts"] - 1)) if outcome == "pending" else 0
+        with unit_of_work(db):
+            latency = crud.complete_order_outbox(
+                db, row["id"], outcome, response=response, error=error, retry_in_seconds=retry_in
+            )
+            if outcome != "pending":
+                if row.get("audit_id"):
+                    try:
+                        with savepoint(db):
+                            crud.update_order_audit_saipos(
+                                db,
+                                audit_id=row["audit_id"],
+                                status=outcome,
+                                saipos_payload_json=payload,
+                                error=error,
+                            )
+                    except Exception:
+                        logger.warning("order_audit_update_failed", exc_info=True)
+                crud.update_order_status(db, order_id, "created" if outcome == "sent" else "failed", response=response)
+
+        if outcome == "failed":
+            self._notify_failure(db, row)
+
+        self._record("requeued" if outcome == "pending" else outcome, latency if outcome == "sent" else None)
+        log = logger.info if outcome == "sent" else logger.error
+        log("order_dispatch", extra={"order_id": order_id, "outcome": outcome, "attempts": row["attempts"], "error": error})
+        return outcome
+
+    def _notify_failure(self, db, row: Dict[str, Any]) -> None:
+        """O cliente ouviu "sendo enviado para a cozinha": avisa que não foi e registra no histórico da conversa."""
+        telefone = row.get("telefone") or row.get("session_id")
+        if not telefone or self.evolution_factory is None:
+            return
+        try:
+            send_messages(db, self.evolution_factory(), telefone, [ORDER_FAILED_MESSAGE], source="order_failed")
+            with unit_of_work(db):
+                crud.insert_chat_history(db, row.get("session_id") or telefone, "ai", ORDER_FAILED_MESSAGE)
+            self._record("customers_notified")
+        except Exception:
+            logger.exception("order_failure_notify_failed", extra={"order_id": row.get("order_id")})
+
+
+def notify_order_dispatcher() -> bool:
+    """Acorda o dispatcher deste processo; False se ele não foi iniciado (ex.: scripts)."""
+    dispatcher = OrderDispatcher.current()
+    if dispatcher is None or not dispatcher.running():
+        return False
+    dispatcher.notify()
+    return True
+
+
+def order_dispatch_metrics() -> Dict[str, Any]:
+    return OrderDispatcher.current_metrics()
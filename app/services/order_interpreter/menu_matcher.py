@@ -9,6 +9,7 @@ from typing import Any, Dict, List, Optional, Tuple
 from rapidfuzz import fuzz, process
 
 from app.services.order_interpreter.models import MatchedProduct
+from app.settings import settings
 
 logger = logging.getLogger(__name__)
 
@@ -33,14 +34,16 @@ def _generate_fingerprint(text: str) -> str:
 class MenuMatcher:
     """Matcher de produtos contra o cardápio usando fuzzy matching."""
 
-    def __init__(self, db):
+    def __init__(self, db, vector_index=None):
         """
         Inicializa o matcher.
 
         Args:
             db: Conexão com banco de dados
+            vector_index: Índice vetorial opcional (camada 4), com método search(texto, k)
         """
         self.db = db
+        self.vector_index = vector_index
         self._menu_cache: Optional[List[Dict[str, Any]]] = None
         self._products_cache: Optional[List[Dict[str, Any]]] = None
 
@@ -146,6 +149,34 @@ class MenuMatcher:
 
         return None, best_score, sugestoes[:MAX_SUGGESTIONS]
 
+    def _vector_match(
+        self, texto: str, products: List[Dict[str, Any]]
+    ) -> Tuple[Optional[Dict[str, Any]], float, List[str]]:
+        """
+        Tenta match por similaridade vetorial (top-k vizinhos em menu_embeddings).
+
+        Returns:
+            tuple: (produto_match, score 0-100, lista_sugestoes)
+        """
+        if self.vector_index is None:
+            return None, 0, []
+        try:
+            hits = self.vector_index.search(texto, settings.menu_vector_top_k)
+        except Exception:
+            logger.warning("menu_vector_search_failed", exc_info=True)
+            return None, 0, []
+
+        by_pdv = {str(p.get("pdv") or ""): p for p in products}
+        candidatos = [(by_pdv[pdv], sim) for pdv, sim in hits if pdv in by_pdv]
+        if not candidatos:
+            return None, 0, []
+
+        best, best_sim = candidatos[0]
+        sugestoes = [p.get("nome_original") or "" for p, _ in candidatos[1:MAX_SUGGESTIONS + 1]]
+        if best_sim >= settings.menu_vector_threshold:
+            return best, round(best_sim * 100, 1), sugestoes
+        return None, round(best_sim * 100, 1), [best.get("nome_original") or ""] + sugestoes
+
     def match(self, texto_produto: str) -> Tuple[Optional[MatchedProduct], List[str]]:
         """
         Encontra o produto do cardápio mais próximo do texto.
@@ -222,8 +253,31 @@ class MenuMatcher:
                 ],
             ), sugestoes
 
+        # Camada 4: Similaridade vetorial (opcional)
+        vector_match, score, vector_sugestoes = self._vector_match(texto_produto, products)
+        if vector_match:
+            additionals = self._get_additionals_for_product(vector_match.get("pdv") or "")
+            return MatchedProduct(
+                pdv=vector_match.get("pdv") or "",
+                nome=vector_match.get("nome_original") or "",
+                preco=float(vector_match.get("price") or 0),
+                score=score,
+                adicionais_disponiveis=[
+                    {
+                        "pdv": a.get("pdv"),
+                        "nome": a.get("nome_original"),
+                        "fingerprint": a.get("fingerprint"),
+                        "preco": float(a.get("price") or 0)
+                    }
+                    for a in additionals
+                ],
+            ), vector_sugestoes
+        for nome in vector_sugestoes:
+            if nome and nome not in sugestoes:
+                sugestoes.append(nome)
+
         # Não encontrou - retorna sugestões
-        return None, sugestoes
+        return None, sugestoes[:MAX_SUGGESTIONS]
 
     def clear_cache(self) -> None:
         """Limpa o cache do cardápio."""
@@ -17,6 +17,7 @@ from app.services.order_interpreter.models import (
     ValidItem,
 )
 from app.services.order_interpreter.parser import OrderParser
+from app.services.order_interpreter.vector_index import build_vector_index
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +29,7 @@ class OrderInterpreterService:
     Orquestra o fluxo completo:
     1. Parser: extrai itens do texto livre
     2. GiriaResolver: aplica regras de gírias
-    3. MenuMatcher: encontra produtos no cardápio
+    3. MenuMatcher: encontra produtos no cardápio (exato, substring, fuzzy e, opcionalmente, vetorial)
     4. AdditionalMatcher: valida adicionais
     5. Monta resposta estruturada para o agente
     """
@@ -43,7 +44,7 @@ class OrderInterpreterService:
         self.db = db
         self.parser = OrderParser()
         self.giria_resolver = GiriaResolver(db)
-        self.menu_matcher = MenuMatcher(db)
+        self.menu_matcher = MenuMatcher(db, vector_index=build_vector_index(db))
         self.additional_matcher = AdditionalMatcher(db)
 
     def _build_valid_item(
@@ -0,0 +1,197 @@
+"""Busca por similaridade vetorial sobre `menu_embeddings` (camada 4 do MenuMatcher)."""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Tuple
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+try:  # numpy é opcional (extra "vector")
+    import numpy as np
+except ImportError:  # pragma: no cover - depende do ambiente
+    np = None
+
+
+class Embedder(Protocol):
+    def embed(self, text: str) -> List[float]:
+        ...
+
+
+def _normalize_query(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+
+def _parse_vector(value: Any) -> List[float]:
+    """Converte o valor vindo do banco (texto '[...]' do pgvector ou lista) em lista de floats."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except Exception:
+            return []
+    try:
+        return [float(x) for x in value]
+    except Exception:
+        return []
+
+
+class QueryEmbeddingCache:
+    """Cache LRU (thread-safe) de embeddings de consulta, indexado pelo texto normalizado."""
+
+    def __init__(self, embedder: Embedder, max_size: int = 2048) -> None:
+        self.embedder = embedder
+        self.max_size = max(int(max_size), 1)
+        self._data: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> List[float]:
+        key = _normalize_query(text)
+        if not key:
+            return []
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return cached
+        vector = self.embedder.embed(key) or []
+        with self._lock:
+            self.misses += 1
+            if vector:
+                self._data[key] = vector
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+        return vector
+
+
+class NumpyVectorIndex:
+    """Matriz em memória (linhas normalizadas) com busca top-k por similaridade de cosseno."""
+
+    def __init__(self, pdvs: Sequence[str], vectors: Sequence[Sequence[float]], query_cache: QueryEmbeddingCache) -> None:
+        if np is None:
+            raise RuntimeError("numpy não instalado (pip install .[vector])")
+        self.query_cache = query_cache
+        pairs = [(str(p), v) for p, v in zip(pdvs, vectors) if p and v]
+        self.pdvs: List[str] = [p for p, _ in pairs]
+        if pairs:
+            matrix = np.asarray([v for _, v in pairs], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Dict[str, Any]], query_cache: QueryEmbeddingCache) -> "NumpyVectorIndex":
+        pdvs: List[str] = []
+        vectors: List[List[float]] = []
+        for row in rows:
+            vector = _parse_vector(row.get("embedding"))
+            if not vector:
+                continue
+            pdvs.append(str(row.get("pdv") or ""))
+            vectors.append(vector)
+        return cls(pdvs, vectors, query_cache)
+
+    def __len__(self) -> int:
+        return len(self.pdvs)
+
+    def search(self, texto: str, k: int = 3) -> List[Tuple[str, float]]:
+        if not self.pdvs:
+            return []
+        query = self.query_cache.get(texto)
+        if not query or len(query) != self.matrix.shape[1]:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        if norm == 0:
+            return []
+        scores = self.matrix @ (q / norm)
+        k = min(max(int(k), 1), len(self.pdvs))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.pdvs[i], float(scores[i])) for i in top]
+
+
+class PgVectorIndex:
+    """Busca top-k delegada ao Postgres (operador de distância de cosseno do pgvector)."""
+
+    def __init__(self, db, query_cache: QueryEmbeddingCache) -> None:
+        self.db = db
+        self.query_cache = query_cache
+
+    def search(self, texto: str, k: int = 3) -> List[Tuple[str, float]]:
+        query = self.query_cache.get(texto)
+        if not query:
+            return []
+        from app.db import crud
+
+        rows = crud.search_menu_embeddings(self.db, "[" + ",".join(str(x) for x in query) + "]", k)
+        return [(str(r.get("pdv")), float(r.get("similarity") or 0)) for r in rows]
+
+
+_QUERY_CACHE: Optional[QueryEmbeddingCache] = None
+_NUMPY_INDEX: Optional[NumpyVectorIndex] = None
+_NUMPY_INDEX_LOADED_AT: float = 0.0
+_LOCK = threading.Lock()
+
+
+def get_query_cache(embedder: Embedder | None = None) -> QueryEmbeddingCache:
+    global _QUERY_CACHE
+    with _LOCK:
+        if _QUERY_CACHE is None:
+            if embedder is None:
+                from app.services.embedding_client import EmbeddingClient
+
+                embedder = EmbeddingClient(settings.openai_api_key, settings.openai_model_embed, max_retries=2)
+            _QUERY_CACHE = QueryEmbeddingCache(embedder, settings.menu_vector_cache_size)
+        return _QUERY_CACHE
+
+
+def build_vector_index(db):
+    """Retorna o índice vetorial configurado, ou None se a camada estiver desativada/indisponível."""
+    global _NUMPY_INDEX, _NUMPY_INDEX_LOADED_AT
+    if not settings.menu_vector_enabled or not settings.openai_api_key:
+        return None
+    cache = get_query_cache()
+    backend = (settings.menu_vector_backend or "numpy").lower()
+    if backend == "pgvector":
+        return PgVectorIndex(db, cache)
+    if np is None:
+        logger.warning("menu_vector_numpy_missing")
+        return None
+    now = time.monotonic()
+    with _LOCK:
+        if _NUMPY_INDEX is not None and now - _NUMPY_INDEX_LOADED_AT < settings.menu_vector_ttl_seconds:
+            return _NUMPY_INDEX
+    from app.db import crud
+
+    try:
+        rows = crud.fetch_menu_embeddings(db)
+    except Exception:
+        logger.warning("menu_vector_load_failed", exc_info=True)
+        return None
+    index = NumpyVectorIndex.from_rows(rows, cache)
+    with _LOCK:
+        _NUMPY_INDEX = index
+        _NUMPY_INDEX_LOADED_AT = now
+    return index
+
+
+def reset_vector_index() -> None:
+    """Descarta a matriz em memória (recarregada na próxima busca)."""
+    global _NUMPY_INDEX, _NUMPY_INDEX_LOADED_AT
+    with _LOCK:
+        _NUMPY_INDEX = None
+        _NUMPY_INDEX_LOADED_AT = 0.0
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
 import random
 import time
@@ -7,9 +9,12 @@ from datetime import datetime
 from typing import Any, Dict, Tuple
 
 from app.db import crud
+from app.db.session import savepoint, unit_of_work
+from app.services.order_dispatcher import OrderDispatcher, notify_order_dispatcher
 from app.settings import settings
 from app.utils.fingerprints import calcular_total_pedido, mapear_itens
 from app.utils.phone import normalize_phone
+from app.utils.tracing import current_trace_id
 
 logger = logging.getLogger(__name__)
 
@@ -135,6 +140,12 @@ def build_payload_saipos(pedido_original: Dict, indice_banco: list) -> Tuple[Dic
     return payload, erros
 
 
+def order_idempotency_key(payload_saipos: Dict[str, Any]) -> str:
+    """Chave do pedido pelo conteúdo (sessão, itens, entrega, pagamento), sem o order_id gerado por tempo."""
+    canonical = json.dumps(payload_saipos, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
 def formatar_json_saipos(data: Dict[str, Any]) -> Dict[str, Any]:
     order_id = f"{int(time.time() * 1000)}{random.randint(0, 999)}"
     display_id = settings.saipos_display_id or "5457"
@@ -250,6 +261,12 @@ def formatar_json_saipos(data: Dict[str, Any]) -> Dict[str, Any]:
     return json_saipos
 
 
+class _AlreadyQueued(Exception):
+    def __init__(self, order_id: str | None) -> None:
+        super().__init__(order_id)
+        self.order_id = order_id
+
+
 class OrderService:
     def __init__(self, db, saipos_client) -> None:
         self.db = db
@@ -323,7 +340,7 @@ class OrderService:
             normalized["session_id"] = session_id
 
         telefone = (data.get("dados_cliente") or {}).get("telefone") or data.get("telefone") or session_id or ""
-        trace_id = payload.get("trace_id") if isinstance(payload, dict) else None
+        trace_id = (payload.get("trace_id") if isinstance(payload, dict) else None) or current_trace_id() or None
         try:
             crud.insert_order_audit_quote(
                 self.db,
@@ -357,81 +374,127 @@ class OrderService:
         if not data.get("itens"):
             return {"error": "cart_empty"}
 
-        trace_id = payload.get("trace_id") if isinstance(payload, dict) else None
-        audit_id = None
-        try:
-            audit_id = crud.insert_order_audit_raw(
-                self.db,
-                session_id=raw_session_id,
-                telefone=raw_telefone,
-                trace_id=trace_id,
-                agent_order_json=data,
-            )
-        except Exception:
-            logger.warning("order_audit_raw_insert_failed", exc_info=True)
-
+        trace_id = (payload.get("trace_id") if isinstance(payload, dict) else None) or current_trace_id() or None
+        audit = {
+            "session_id": raw_session_id,
+            "telefone": raw_telefone,
+            "trace_id": trace_id,
+            "agent_order_json": data,
+        }
         try:
-            indice = crud.fetch_menu_search_index(self.db)
+            # o índice do cardápio só é necessário quando os itens ainda não têm PDV
+            indice = [] if _items_have_pdv(data.get("itens")) else crud.fetch_menu_search_index(self.db)
             payload_saipos, erros = build_payload_saipos(data, indice)
             json_saipos = formatar_json_saipos(payload_saipos)
-
-            if audit_id:
-                try:
-                    crud.update_order_audit_saipos(
-                        self.db,
-                        audit_id=audit_id,
-                        status="prepared",
-                        saipos_payload_json=json_saipos,
-                        error=None,
-                    )
-                except Exception:
-                    logger.warning("order_audit_update_failed", exc_info=True)
         except Exception as exc:
-            if audit_id:
+            try:
+                crud.insert_order_audit(self.db, **audit, status="failed", error=str(exc))
+            except Exception:
+                logger.warning("order_audit_insert_failed", exc_info=True)
+            raise
+
+        if not settings.order_outbox_enabled:
+            # auditoria gravada antes do envio síncrono à Saipos
+            try:
+                crud.insert_order_audit(self.db, **audit, status="prepared", saipos_payload_json=json_saipos)
+            except Exception:
+                logger.warning("order_audit_insert_failed", exc_info=True)
+            if settings.saipos_dry_run:
+                response = {"status": "dry_run", "message": "Saipos envio desativado em testes."}
+            else:
+                response = self.saipos_client.send_order(json_saipos)
+            with unit_of_work(self.db):
+                self._persist_order(payload_saipos, json_saipos, response, status="created")
+            return {"payload": json_saipos, "response": response, "erros": erros or None}
+
+        # outbox: auditoria, fila, cliente/endereço, pedido, itens e sessão numa única transação;
+        # o envio à Saipos sai do turno do cliente
+        try:
+            with unit_of_work(self.db):
+                # auditoria é best-effort: uma falha nela (savepoint) não derruba o pedido
+                audit_id = None
                 try:
-                    crud.update_order_audit_saipos(
-                        self.db,
-                        audit_id=audit_id,
-                        status="failed",
-                        saipos_payload_json=None,
-                        error=str(exc),
-                    )
+                    with savepoint(self.db):
+                        audit_id = crud.insert_order_audit(
+                            self.db, **audit, status="prepared", saipos_payload_json=json_saipos
+                        )
                 except Exception:
-                    logger.warning("order_audit_update_failed", exc_info=True)
-            raise
+                    logger.warning("order_audit_insert_failed", exc_info=True)
+                queued = crud.enqueue_order_outbox(
+                    self.db,
+                    idempotency_key=order_idempotency_key(payload_saipos),
+                    order_id=json_saipos.get("order_id"),
+                    payload=json_saipos,
+                    audit_id=audit_id,
+                    session_id=payload_saipos.get("session_id") or "",
+                    telefone=payload_saipos.get("telefone") or "",
+                    dedupe_seconds=settings.order_outbox_dedupe_seconds,
+                )
+                if not queued.get("created"):
+                    # desfaz a auditoria desta tentativa: o pedido já está na fila
+                    raise _AlreadyQueued(queued.get("order_id"))
+                self._persist_order(payload_saipos, json_saipos, None, status="queued")
+        except _AlreadyQueued as dup:
+            return {
+                "payload": json_saipos,
+                "response": {"status": "already_queued", "order_id": dup.order_id},
+                "erros": erros or None,
+            }
 
-        if settings.saipos_dry_run:
-            response = {"status": "dry_run", "message": "Saipos envio desativado em testes."}
-        else:
-            response = self.saipos_client.send_order(json_saipos)
+        response: Dict[str, Any] = {
+            "status": "queued",
+            "order_id": json_saipos.get("order_id"),
+            "message": "Pedido recebido e sendo enviado para a cozinha.",
+        }
+        if not notify_order_dispatcher():
+            # sem dispatcher em background neste processo (scripts): envia aqui, com as mesmas retentativas
+            rows = crud.claim_order_outbox(self.db, limit=1, outbox_id=queued["id"])
+            if rows:
+                outcome = OrderDispatcher(None, None).dispatch(self.db, self.saipos_client, rows[0])
+                order = crud.get_order(self.db, json_saipos.get("order_id")) or {}
+                response = order.get("response") or {"status": outcome, "order_id": json_saipos.get("order_id")}
+
+        return {
+            "payload": json_saipos,
+            "response": response,
+            "erros": erros or None,
+        }
 
+    def _persist_order(
+        self,
+        payload_saipos: Dict[str, Any],
+        json_saipos: Dict[str, Any],
+        response: Dict[str, Any] | None,
+        status: str,
+    ) -> None:
+        """Grava cliente/endereço, pedido, itens e encerra a sessão (chamar dentro de um unit of work)."""
         client_id = None
         try:
-            client_id = crud.upsert_client(
-                self.db,
-                telefone=payload_saipos.get("telefone") or "",
-                nome=payload_saipos.get("nome") or None,
-                last_purchase=datetime.utcnow(),
-            )
-            endereco = {
-                "rua": payload_saipos.get("rua"),
-                "numero": payload_saipos.get("numero"),
-                "bairro": payload_saipos.get("bairro"),
-                "cidade": payload_saipos.get("cidade"),
-                "estado": payload_saipos.get("estado"),
-                "cep": payload_saipos.get("cep"),
-                "complemento": payload_saipos.get("complemento"),
-            }
-            if client_id and any(endereco.values()):
-                crud.upsert_address(self.db, client_id, endereco)
+            with savepoint(self.db):
+                client_id = crud.upsert_client_address(
+                    self.db,
+                    telefone=payload_saipos.get("telefone") or "",
+                    nome=payload_saipos.get("nome") or None,
+                    last_purchase=datetime.utcnow(),
+                    endereco={
+                        "rua": payload_saipos.get("rua"),
+                        "numero": payload_saipos.get("numero"),
+                        "bairro": payload_saipos.get("bairro"),
+                        "cidade": payload_saipos.get("cidade"),
+                        "estado": payload_saipos.get("estado"),
+                        "cep": payload_saipos.get("cep"),
+                        "complemento": payload_saipos.get("complemento"),
+                    },
+                )
         except Exception:
+            client_id = None
             logger.warning("client_update_failed", exc_info=True)
 
         order_db_id = crud.insert_order(
             self.db,
             order_id=json_saipos.get("order_id"),
             telefone=payload_saipos.get("telefone") or "",
-            status="created",
+            status=status,
             payload=json_saipos,
             response=response,
             cod_store=json_saipos.get("cod_store") or "",
@@ -439,23 +502,14 @@ class OrderService:
         )
         try:
             if order_db_id:
-                crud.insert_order_items(self.db, order_db_id, payload_saipos.get("itens") or [])
+                with savepoint(self.db):
+                    crud.insert_order_items(self.db, order_db_id, payload_saipos.get("itens") or [])
         except Exception:
             logger.warning("order_items_insert_failed", exc_info=True)
 
         session_id = payload_saipos.get("session_id") or payload_saipos.get("telefone")
         if session_id:
-            crud.update_active_session_finished(self.db, session_id)
-            try:
-                crud.clear_cart(self.db, session_id)
-            except Exception:
-                logger.warning("cart_clear_failed", exc_info=True)
-
-        return {
-            "payload": json_saipos,
-            "response": response,
-            "erros": erros or None,
-        }
+            crud.finish_active_session(self.db, session_id)
 
     def cancel_order(self, order_id: str) -> Dict[str, Any]:
         order = crud.get_order(self.db, order_id)
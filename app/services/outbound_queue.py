@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from app.db import crud
+from app.services.background_worker import BackgroundWorker
+from app.settings import settings
+from app.utils.rate_limit import TokenBucket
+from app.utils.tracing import current_trace_id, start_trace
+
+logger = logging.getLogger(__name__)
+
+
+class OutboundSender(BackgroundWorker):
+    """
+    Envia as mensagens de outbound_messages ao Evolution fora da thread que gerou a resposta.
+
+    Cada telefone tem uma fila própria: só a mensagem mais antiga ainda não enviada é reservada, e a
+    seguinte fica para `number_interval` segundos depois dela. Telefones diferentes saem em paralelo
+    (`concurrency`), limitados por instância a `instance_rate` envios/s. Falhas voltam para a fila com
+    espera crescente; depois de `max_attempts` a mensagem vai para outbound_messages_dead.
+    """
+
+    thread_name = "outbound-sender"
+    loop_error_event = "outbound_loop_failed"
+
+    def __init__(
+        self,
+        db_factory,
+        evolution_factory,
+        concurrency: int | None = None,
+        instance_rate: float | None = None,
+        number_interval: float | None = None,
+        max_attempts: int | None = None,
+        poll_seconds: float | None = None,
+        typing_delay_ms: int | None = None,
+    ) -> None:
+        super().__init__(
+            poll_seconds or settings.outbound_poll_seconds,
+            {"enqueued": 0, "sent": 0, "retried": 0, "dead": 0},
+        )
+        self.db_factory = db_factory
+        self.evolution_factory = evolution_factory
+        self.concurrency = max(int(concurrency or settings.outbound_concurrency), 1)
+        self.instance_rate = float(instance_rate if instance_rate is not None else settings.outbound_instance_rate_per_second)
+        self.number_interval = float(number_interval if number_interval is not None else settings.outbound_number_interval_seconds)
+        self.max_attempts = max(int(max_attempts or settings.outbound_max_attempts), 1)
+        self.typing_delay_ms = int(typing_delay_ms if typing_delay_ms is not None else settings.outbound_typing_delay_ms)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbound")
+        self._limiters: Dict[str, TokenBucket] = {}
+
+    def _limiter(self, instance: str) -> TokenBucket:
+        with self._lock:
+            limiter = self._limiters.get(instance)
+            if limiter is None:
+                limiter = TokenBucket(self.instance_rate, burst=max(int(self.instance_rate), 1))
+                self._limiters[instance] = limiter
+            return limiter
+
+    def run_once(self, limit: int | None = None) -> Dict[str, Any]:
+        with self.db_factory() as db:
+            rows = crud.claim_outbound_messages(
+                db, limit=limit or self.concurrency, lease_seconds=settings.outbound_lease_seconds
+            )
+        # cada linha é de um telefone diferente: podem sair em paralelo
+        outcomes = list(self._pool.map(self._deliver, rows))
+        return {"claimed": len(rows), "outcomes": outcomes}
+
+    def _deliver(self, row: Dict[str, Any]) -> str:
+        # continua o trace do turno que gerou a mensagem (logs e traceparent do envio ao Evolution)
+        trace_id = row.get("trace_id") or None
+        with start_trace("outbound.send", trace_id=trace_id, source=row.get("source") or "", attempt=row["attempts"]) as root:
+            outcome = self._send(row)
+            root.set(result=outcome)
+            if outcome == "error":
+                root.status = "error"
+            return outcome
+
+    def _send(self, row: Dict[str, Any]) -> str:
+        instance = row.get("instance") or settings.evolution_instance
+        error = None
+        try:
+            self._limiter(instance).acquire()
+            self.evolution_factory().send_text(
+                instance, row["telefone"], row["text"], delay=self.typing_delay_ms, base_url=row.get("base_url") or None
+            )
+            outcome = "sent"
+        except Exception as exc:
+            error = str(exc)
+            outcome = "pending" if row["attempts"] < self.max_attempts else "dead"
+
+        retry_in = settings.outbound_retry_seconds * (2 ** (row["attempts"] - 1)) if outcome == "pending" else 0
+        try:
+            with self.db_factory() as db:
+                latency = crud.complete_outbound_message(
+                    db, row["id"], outcome, error=error, retry_in_seconds=retry_in, pace_seconds=self.number_interval
+                )
+        except Exception:
+            # o lease expira e a mensagem volta para a fila
+            logger.exception("outbound_complete_failed")
+            return "error"
+
+        self._record("retried" if outcome == "pending" else outcome, latency if outcome == "sent" else None)
+        if error:
+            log = logger.error if outcome == "dead" else logger.warning
+            log("outbound_send_failed", extra={"telefone": row["telefone"], "result": outcome, "body": error})
+        return outcome
+
+
+def sends_are_queued() -> bool:
+    """True quando `send_messages` só enfileira (sender rodando neste processo); senão o envio é síncrono."""
+    sender = OutboundSender.current()
+    return settings.outbound_queue_enabled and sender is not None and sender.running()
+
+
+def send_messages(
+    db,
+    evolution,
+    telefone: str,
+    parts: List[str],
+    instance: str | None = None,
+    base_url: str | None = None,
+    source: str = "",
+) -> Dict[str, Any]:
+    """
+    Entrega as partes de uma resposta ao cliente. Com o sender rodando neste processo só enfileira
+    (quem chamou é liberado na hora); sem ele (scripts, `OUTBOUND_QUEUE_ENABLED=false`) envia aqui, em ordem.
+    """
+    instance = instance or settings.evolution_instance
+    sender = OutboundSender.current()
+    if not sends_are_queued():
+        extra = {"base_url": base_url} if base_url else {}
+        for part in parts:
+            evolution.send_text(instance, telefone, part, **extra)
+        return {"queued": 0, "sent": len(parts)}
+    ids = crud.enqueue_outbound_messages(
+        db, telefone, parts, instance=instance, base_url=base_url or "", source=source, trace_id=current_trace_id()
+    )
+    with sender._lock:
+        sender.stats["enqueued"] += len(ids)
+    sender.notify()
+    return {"queued": len(ids), "sent": 0}
+
+
+def outbound_metrics() -> Dict[str, Any]:
+    return OutboundSender.current_metrics()
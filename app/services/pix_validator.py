@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import base64
+import hashlib
 import json
 import re
-from typing import Any, Dict
-
-import httpx
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
 
+from app.services.media_store import MediaNotFound, get_media_store
 from app.settings import settings
+from app.utils.http_client import http_client
+from app.utils.images import downscale_for_vision, image_dimensions
 
 
 def _strip_markdown_json(text: str) -> str:
@@ -27,23 +32,136 @@ def _basic_heuristic(text: str) -> Dict[str, Any]:
     return {"valid": score >= 2, "reason": "heuristic", "score": score}
 
 
+class _VerdictCache:
+    """
+    Veredictos anteriores do modelo por (sessão, sha256 do conteúdo): só o mesmo arquivo, reenviado na
+    mesma conversa, reaproveita o veredicto. Imagens parecidas (mesmo layout de banco) sempre vão ao modelo.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(int(max_size), 1)
+        self._by_key: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            verdict = self._by_key.get((scope, content_hash))
+            if verdict is not None:
+                self._by_key.move_to_end((scope, content_hash))
+            return verdict
+
+    def put(self, scope: str, content_hash: str, verdict: Dict[str, Any]) -> None:
+        with self._lock:
+            self._by_key[(scope, content_hash)] = verdict
+            self._by_key.move_to_end((scope, content_hash))
+            while len(self._by_key) > self.max_size:
+                self._by_key.popitem(last=False)
+
+
+_verdicts = _VerdictCache(settings.pix_cache_size)
+pix_stats: Dict[str, int] = {"requests": 0, "cache_hits": 0, "prescreen_inconclusive": 0, "model_calls": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        pix_stats[key] += 1
+
+
+def prescreen_image(data: bytes, mime_type: str | None, texto: str | None = None) -> Optional[Dict[str, Any]]:
+    """
+    Separa localmente o que não dá para avaliar (figurinha, miniatura). Nunca reprova: devolve um
+    veredicto "inconclusive" (o agente pede o arquivo de novo) ou None para seguir ao modelo.
+    Legenda que já fala de pagamento (score da heurística de palavras-chave >= 2) vai direto ao modelo.
+    """
+    mime = (mime_type or "").split(";")[0].strip().lower()
+    if mime == "application/pdf":
+        return None
+    if mime == "image/webp":
+        return {"valid": None, "status": "inconclusive", "reason": "prescreen_sticker"}
+    if texto and _basic_heuristic(texto)["valid"]:
+        return None
+    dims = image_dimensions(data)
+    if dims is None:
+        return None
+    width, height = dims
+    if min(width, height) < settings.pix_min_side:
+        return {"valid": None, "status": "inconclusive", "reason": "prescreen_too_small", "width": width, "height": height}
+    return None
+
+
+def pix_metrics() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(pix_stats)
+    requests = stats["requests"]
+    avoided = stats["cache_hits"] + stats["prescreen_inconclusive"]
+    stats["model_calls_avoided_rate"] = round(avoided / requests, 4) if requests else 0.0
+    return stats
+
+
+def _load_media(media_id: str | None, media_base64: str | None) -> bytes:
+    if media_id:
+        return get_media_store().get_bytes(media_id)
+    data = media_base64 or ""
+    if data.startswith("data:"):
+        data = data[data.find(",") + 1 :]
+    return base64.b64decode(data)
+
+
 def validate_pix_receipt(
-    media_base64: str | None,
+    media_base64: str | None = None,
     mime_type: str | None = None,
     texto: str | None = None,
     return_usage: bool = False,
+    media_id: str | None = None,
+    session_id: str | None = None,
 ) -> Dict[str, Any]:
-    if texto and not media_base64:
+    if texto and not media_base64 and not media_id:
         return _basic_heuristic(texto)
-    if not media_base64:
+    if not media_base64 and not media_id:
         return {"error": "missing_media"}
+    if media_id:
+        try:
+            mime_type = mime_type or get_media_store().meta(media_id).get("mime_type")
+        except MediaNotFound:
+            return {"error": "media_not_found"}
+
+    _count("requests")
+    try:
+        media = _load_media(media_id, media_base64)
+    except Exception:
+        return {"error": "invalid_media"}
+    # media_id já é o sha256 do conteúdo (media store)
+    content_hash = media_id or hashlib.sha256(media).hexdigest()
+    if session_id:
+        cached = _verdicts.get(session_id, content_hash)
+        if cached is not None:
+            _count("cache_hits")
+            return {**cached, "cached": True}
+
+    inconclusive = prescreen_image(media, mime_type, texto)
+    if inconclusive is not None:
+        _count("prescreen_inconclusive")
+        return inconclusive
+
     if not settings.openai_api_key:
         # fallback: at least confirms receipt presence
         return {"valid": True, "reason": "no_api_key"}
 
-    mime = mime_type or "image/jpeg"
-    data_url = f"data:{mime};base64,{media_base64}"
+    # só aqui a imagem (reduzida) é convertida para data URL
+    small, mime = downscale_for_vision(media, mime_type or "image/jpeg", settings.pix_max_side)
+    del media
+    data_url = f"data:{mime};base64,{base64.b64encode(small).decode('ascii')}"
+    del small
+
+    _count("model_calls")
+    result = _ask_model(data_url, return_usage)
+    if session_id and isinstance(result.get("valid"), bool) and "error" not in result:
+        _verdicts.put(session_id, content_hash, {k: v for k, v in result.items() if k != "_usage"})
+    return result
+
 
+def _ask_model(data_url: str, return_usage: bool) -> Dict[str, Any]:
     messages = [
         {
             "role": "system",
@@ -67,7 +185,7 @@ def validate_pix_receipt(
     headers = {"Authorization": f"Bearer {settings.openai_api_key}"}
 
     try:
-        with httpx.Client(timeout=60) as client:
+        with http_client("openai", timeout=60) as client:
             resp = client.post(url, headers=headers, json=payload)
             resp.raise_for_status()
             data = resp.json()
@@ -1,32 +1,68 @@
 from __future__ import annotations
 
-import time
+from typing import Any, Dict, Iterable, Iterator
+
 import httpx
 
+from app.services.saipos_token_cache import SaiposTokenCache, get_saipos_token_cache
+from app.utils.http_client import http_client
+from app.utils.json_stream import iter_json_array_items
+
+
+def _counted(chunks: Iterable[bytes], meta: Dict[str, Any]) -> Iterator[bytes]:
+    for chunk in chunks:
+        meta["payload_bytes"] += len(chunk)
+        yield chunk
+
 
 class SaiposClient:
-    def __init__(self, base_url: str, partner_id: str, partner_secret: str, token_ttl_seconds: int = 3500) -> None:
+    def __init__(
+        self,
+        base_url: str,
+        partner_id: str,
+        partner_secret: str,
+        token_ttl_seconds: int = 3500,
+        token_cache: SaiposTokenCache | None = None,
+    ) -> None:
         self.base_url = base_url.rstrip("/")
         self.partner_id = partner_id
         self.partner_secret = partner_secret
         self.token_ttl_seconds = token_ttl_seconds
-        self._token: str | None = None
-        self._token_exp: float = 0.0
+        # cache do processo: instâncias novas por requisição reaproveitam o token
+        self.token_cache = token_cache or get_saipos_token_cache()
+        self._cache_key = SaiposTokenCache.cache_key(self.base_url, partner_id)
 
-    def _auth_headers(self) -> dict:
-        if not self._token or time.time() > self._token_exp:
-            self._token = self._fetch_token()
-            self._token_exp = time.time() + self.token_ttl_seconds
+    def _token(self) -> str:
+        return self.token_cache.get(self._cache_key, self._fetch_token, self.token_ttl_seconds)
+
+    @staticmethod
+    def _headers(token: str) -> dict:
         return {
-            "Authorization": self._token,
+            "Authorization": token,
             "accept": "application/json",
             "content-type": "application/json",
         }
 
+    def _renew_after_401(self, token: str) -> str:
+        self.token_cache.invalidate(self._cache_key, token)
+        self.token_cache.record_retry()
+        return self._token()
+
+    def _request(self, method: str, path: str, timeout: int, headers: dict | None = None, **kwargs) -> httpx.Response:
+        """Requisição autenticada; um 401 descarta o token e repete uma vez com token novo."""
+        url = f"{self.base_url}{path}"
+        token = self._token()
+        with http_client("saipos", timeout=timeout) as client:
+            resp = client.request(method, url, headers={**self._headers(token), **(headers or {})}, **kwargs)
+            if resp.status_code == 401:
+                token = self._renew_after_401(token)
+                resp = client.request(method, url, headers={**self._headers(token), **(headers or {})}, **kwargs)
+        return resp
+
     def _fetch_token(self) -> str:
         url = f"{self.base_url}/auth"
         payload = {"idPartner": self.partner_id, "secret": self.partner_secret}
-        with httpx.Client(timeout=30) as client:
+        with http_client("saipos", timeout=30) as client:
             resp = client.post(url, json=payload, headers={"content-type": "application/json", "accept": "application/json"})
             resp.raise_for_status()
             data = resp.json()
@@ -36,23 +72,57 @@ class SaiposClient:
             return data.get("token") or data.get("access_token") or data.get("authorization") or ""
 
     def send_order(self, payload: dict) -> dict:
-        url = f"{self.base_url}/order"
-        with httpx.Client(timeout=60) as client:
-            resp = client.post(url, json=payload, headers=self._auth_headers())
-            resp.raise_for_status()
-            return resp.json()
+        resp = self._request("POST", "/order", timeout=60, json=payload)
+        resp.raise_for_status()
+        return resp.json()
 
     def cancel_order(self, cod_store: str, order_id: str) -> dict:
-        url = f"{self.base_url}/cancel-order"
         payload = {"cod_store": cod_store, "order_id": order_id}
-        with httpx.Client(timeout=30) as client:
-            resp = client.post(url, json=payload, headers=self._auth_headers())
-            resp.raise_for_status()
-            return resp.json()
+        resp = self._request("POST", "/cancel-order", timeout=30, json=payload)
+        resp.raise_for_status()
+        return resp.json()
 
     def fetch_catalog(self) -> dict:
+        resp = self._request("GET", "/catalog", timeout=60)
+        resp.raise_for_status()
+        return resp.json()
+
+    def fetch_catalog_raw(self, etag: str | None = None) -> tuple[int, bytes, str | None]:
+        """Baixa o catálogo sem parsear; retorna (status, corpo, etag). 304 indica catálogo inalterado."""
+        headers = {"If-None-Match": etag} if etag else None
+        resp = self._request("GET", "/catalog", timeout=60, headers=headers)
+        if resp.status_code == 304:
+            return 304, b"", etag
+        resp.raise_for_status()
+        return resp.status_code, resp.content, resp.headers.get("etag")
+
+    def stream_catalog(
+        self, hasher: Any = None, chunk_size: int = 65536, etag: str | None = None, meta: Dict[str, Any] | None = None
+    ) -> Iterator[dict]:
+        """
+        Itera os itens do catálogo conforme chegam, sem materializar o JSON inteiro em memória.
+
+        Com `etag`, manda If-None-Match; um 304 encerra sem itens. `meta` recebe status, etag e
+        payload_bytes da resposta, como o retorno de `fetch_catalog_raw`.
+        """
         url = f"{self.base_url}/catalog"
-        with httpx.Client(timeout=60) as client:
-            resp = client.get(url, headers=self._auth_headers())
-            resp.raise_for_status()
-            return resp.json()
+        token = self._token()
+        meta = meta if meta is not None else {}
+        with http_client("saipos", timeout=60) as client:
+            for attempt in range(2):
+                headers = self._headers(token)
+                if etag:
+                    headers["If-None-Match"] = etag
+                with client.stream("GET", url, headers=headers) as resp:
+                    if resp.status_code == 401 and attempt == 0:
+                        token = self._renew_after_401(token)
+                        continue
+                    if resp.status_code == 304:
+                        meta.update(status=304, etag=etag, payload_bytes=0)
+                        return
+                    resp.raise_for_status()
+                    meta.update(status=resp.status_code, etag=resp.headers.get("etag"), payload_bytes=0)
+                    for item in iter_json_array_items(_counted(resp.iter_bytes(chunk_size), meta), hasher=hasher):
+                        if isinstance(item, dict):
+                            yield item
+                    return
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from app.db import crud
+from app.db.session import get_engine
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SaiposTokenCache:
+    """
+    Token da Saipos compartilhado pelo processo (e, com `shared`, entre réplicas via Postgres).
+
+    Renovação single-flight: só uma thread chama /auth por chave; as demais esperam o resultado.
+    Dentro de `refresh_margin` antes de expirar, o token é renovado por quem chegar primeiro
+    enquanto as outras threads seguem usando o token atual, ainda válido.
+    """
+
+    def __init__(
+        self,
+        refresh_margin: float | None = None,
+        shared: bool | None = None,
+        engine=None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.refresh_margin = float(settings.saipos_token_refresh_margin_seconds if refresh_margin is None else refresh_margin)
+        self.shared = settings.saipos_token_shared if shared is None else shared
+        self.engine = engine
+        self._clock = clock
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._auth_times: Deque[float] = deque()
+        self.stats: Dict[str, int] = {"hits": 0, "auth_calls": 0, "shared_hits": 0, "invalidations": 0, "retries_401": 0}
+
+    @staticmethod
+    def cache_key(base_url: str, partner_id: str) -> str:
+        return hashlib.sha256(f"{base_url}|{partner_id}".encode("utf-8")).hexdigest()[:32]
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key: str, fetch: Callable[[], str], ttl_seconds: float) -> str:
+        now = self._clock()
+        cached = self._tokens.get(key)
+        if cached and now < cached[1] - self.refresh_margin:
+            with self._guard:
+                self.stats["hits"] += 1
+            return cached[0]
+        lock = self._lock_for(key)
+        if cached and now < cached[1]:
+            # perto de expirar: uma thread renova, as outras usam o token atual
+            if not lock.acquire(blocking=False):
+                with self._guard:
+                    self.stats["hits"] += 1
+                return cached[0]
+        else:
+            lock.acquire()
+        try:
+            cached = self._tokens.get(key)
+            if cached and self._clock() < cached[1] - self.refresh_margin:
+                with self._guard:
+                    self.stats["hits"] += 1
+                return cached[0]
+            return self._refresh(key, fetch, ttl_seconds)
+        finally:
+            lock.release()
+
+    def _refresh(self, key: str, fetch: Callable[[], str], ttl_seconds: float) -> str:
+        if self.shared:
+            stored = self._load_shared(key)
+            if stored and self._clock() < stored[1] - self.refresh_margin:
+                self._tokens[key] = stored
+                with self._guard:
+                    self.stats["shared_hits"] += 1
+                return stored[0]
+        token = fetch()
+        expires_at = self._clock() + ttl_seconds
+        self._tokens[key] = (token, expires_at)
+        with self._guard:
+            self.stats["auth_calls"] += 1
+            self._auth_times.append(self._clock())
+        if self.shared:
+            self._save_shared(key, token, expires_at)
+        return token
+
+    def invalidate(self, key: str, token: str | None) -> None:
+        """Descarta o token recusado (401); se outra thread já trocou o token, mantém o novo."""
+        with self._guard:
+            cached = self._tokens.get(key)
+            if cached and cached[0] == token:
+                self._tokens.pop(key, None)
+                self.stats["invalidations"] += 1
+        if self.shared and token:
+            try:
+                with (self.engine or get_engine()).begin() as conn:
+                    stored = crud.fetch_saipos_token(conn, key)
+                    if stored and stored[0] == token:
+                        crud.save_saipos_token(conn, key, token, self._clock())
+            except Exception:
+                logger.exception("saipos_token_invalidate_failed")
+
+    def record_retry(self) -> None:
+        with self._guard:
+            self.stats["retries_401"] += 1
+
+    def _load_shared(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            with (self.engine or get_engine()).connect() as conn:
+                return crud.fetch_saipos_token(conn, key)
+        except Exception:
+            logger.exception("saipos_token_load_failed")
+            return None
+
+    def _save_shared(self, key: str, token: str, expires_at: float) -> None:
+        try:
+            with (self.engine or get_engine()).begin() as conn:
+                crud.save_saipos_token(conn, key, token, expires_at)
+        except Exception:
+            logger.exception("saipos_token_save_failed")
+
+    def metrics(self) -> Dict[str, Any]:
+        cutoff = self._clock() - 3600
+        with self._guard:
+            while self._auth_times and self._auth_times[0] < cutoff:
+                self._auth_times.popleft()
+            return {**self.stats, "auth_calls_last_hour": len(self._auth_times), "shared": self.shared}
+
+
+_cache: Optional[SaiposTokenCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_saipos_token_cache() -> SaiposTokenCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SaiposTokenCache()
+    return _cache
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict
+
+from app.db import crud
+from app.services.background_worker import BackgroundWorker
+from app.services.outbound_queue import sends_are_queued
+from app.services.status_service import StatusService
+from app.settings import settings
+from app.utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# tempo máximo de um aviso: sendText síncrono (timeout de 30 s do Evolution, com o delay de digitação de 4 s
+# dentro) ou só o INSERT na fila de saída quando o OutboundSender roda neste processo
+SYNC_SEND_SECONDS = 35
+QUEUED_SEND_SECONDS = 1
+_intake_lock = threading.Lock()
+_intake: Dict[str, int] = {"received": 0, "duplicates": 0, "superseded": 0}
+
+
+def record_intake(result: Dict[str, Any]) -> None:
+    """Contadores do lado do webhook (eventos gravados, reentregas, avisos substituídos)."""
+    with _intake_lock:
+        if result.get("duplicate"):
+            _intake["duplicates"] += 1
+            return
+        _intake["received"] += 1
+        _intake["superseded"] += int(result.get("superseded") or 0) + (result.get("status") == "superseded")
+
+
+class StatusNotifier(BackgroundWorker):
+    """
+    Avisa o cliente dos eventos de status gravados em order_status_events, fora do request da Saipos.
+
+    Os eventos ficam `STATUS_COALESCE_SECONDS` em espera para que transições rápidas
+    (CONFIRMED → READY → DISPATCHED) virem um único aviso; os envios passam por um limite de taxa
+    e falhas do Evolution voltam para a fila com espera crescente até `max_attempts`. O evento só vence
+    depois da janela de coalescência: o poll curto cobre esse atraso.
+    """
+
+    thread_name = "status-notifier"
+    loop_error_event = "status_notify_loop_failed"
+
+    def __init__(
+        self,
+        db_factory,
+        evolution_factory,
+        send_rate: float | None = None,
+        max_attempts: int | None = None,
+        poll_seconds: float | None = None,
+    ) -> None:
+        super().__init__(
+            poll_seconds or settings.status_notify_poll_seconds,
+            {"sent": 0, "skipped": 0, "failed": 0, "requeued": 0},
+        )
+        self.db_factory = db_factory
+        self.evolution_factory = evolution_factory
+        rate = float(send_rate if send_rate is not None else settings.status_notify_rate_per_second)
+        self.send_rate = rate
+        self.send_limiter = TokenBucket(rate, burst=max(int(rate), 1))
+        self.max_attempts = max(int(max_attempts or settings.status_notify_max_attempts), 1)
+        # o lease cobre ao menos um envio síncrono completo
+        self.lease_seconds = max(settings.status_notify_lease_seconds, SYNC_SEND_SECONDS + 15)
+
+    def batch_size(self) -> int:
+        """Quantos eventos cabem no lease entregando um a um; o resto fica para a próxima reserva."""
+        per_event = QUEUED_SEND_SECONDS if sends_are_queued() else SYNC_SEND_SECONDS
+        if self.send_rate > 0:
+            per_event += 1 / self.send_rate
+        return max(int(self.lease_seconds // per_event), 1)
+
+    def run_once(self, limit: int = 20) -> Dict[str, Any]:
+        limit = min(limit, self.batch_size())
+        with self.db_factory() as db:
+            rows = crud.claim_order_status_events(db, limit=limit, lease_seconds=self.lease_seconds)
+            service = StatusService(db, self.evolution_factory(), send_limiter=self.send_limiter)
+            outcomes = [self.deliver(db, service, row) for row in rows]
+        return {"claimed": len(rows), "outcomes": outcomes}
+
+    def deliver(self, db, service: StatusService, row: Dict[str, Any]) -> str:
+        error = None
+        try:
+            outcome = "sent" if service.deliver(row) else "skipped"
+        except Exception as exc:
+            outcome = "pending" if row["attempts"] < self.max_attempts else "failed"
+            error = str(exc)
+            try:
+                db.rollback()
+            except Exception:
+                pass
+
+        retry_in = 5 * (2 ** (row["attempts"] - 1)) if outcome == "pending" else 0
+        latency = crud.complete_order_status_event(db, row["id"], outcome, error=error, retry_in_seconds=retry_in)
+
+        self._record("requeued" if outcome == "pending" else outcome, latency if outcome == "sent" else None)
+        if error:
+            logger.warning(
+                "status_notify_failed",
+                extra={"order_id": row["order_id"], "result": outcome, "body": error},
+            )
+        return outcome
+
+
+def status_notify_metrics() -> Dict[str, Any]:
+    with _intake_lock:
+        intake = dict(_intake)
+    return {**StatusNotifier.current_metrics(), **intake}
@@ -4,6 +4,7 @@ from typing import Any, Dict, Optional
 
 from app.db import crud
 from app.services.evolution_client import EvolutionClient
+from app.services.outbound_queue import send_messages
 from app.utils.phone import normalize_phone
 from app.settings import settings
 
@@ -17,19 +18,60 @@ STATUS_MESSAGES = {
 }
 
 
+# ordem dos status no ciclo do pedido: um evento só é avisado se nenhum posterior já chegou;
+# eventos fora desta tabela (rank 0) não entram na coalescência e sempre atualizam o pedido
+STATUS_RANK = {
+    "CONFIRMED": 10,
+    "READY_TO_DELIVER": 20,
+    "DISPATCHED": 30,
+    "CONCLUDED": 40,
+    "CANCELLED": 100,
+}
+
+
+def parse_status_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Extrai event/order_id/telefone/nome do webhook da Saipos (com ou sem o envelope `body`)."""
+    body = payload.get("body") if isinstance(payload, dict) else None
+    data = body or payload
+    if not isinstance(data, dict):
+        return {"event": None, "order_id": None, "telefone": None, "nome": None}
+    customer = (body.get("customer") if isinstance(body, dict) else None) or {}
+    return {
+        "event": data.get("event"),
+        "order_id": data.get("order_id"),
+        "telefone": data.get("telefone") or customer.get("phone"),
+        "nome": data.get("nome") or customer.get("name"),
+    }
+
+
 class StatusService:
-    def __init__(self, db, evolution_client: EvolutionClient) -> None:
+    def __init__(self, db, evolution_client: EvolutionClient, send_limiter=None) -> None:
         self.db = db
         self.evolution_client = evolution_client
+        self.send_limiter = send_limiter
 
-    def process_event(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        body = payload.get("body") if isinstance(payload, dict) else None
-        event = (body or payload).get("event") if isinstance(body or payload, dict) else None
-        order_id = (body or payload).get("order_id") if isinstance(body or payload, dict) else None
-
-        nome = (body or payload).get("nome") or (body or {}).get("customer", {}).get("name")
-        telefone = (body or payload).get("telefone") or (body or {}).get("customer", {}).get("phone")
+    def record_event(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Caminho do webhook: grava o evento e responde; o aviso ao cliente sai pelo StatusNotifier.
+        Sem order_id não há como deduplicar, então o evento é tratado na hora (como antes).
+        """
+        parsed = parse_status_event(payload)
+        event, order_id = parsed["event"], parsed["order_id"]
+        if not event or not order_id:
+            return self.process_event(payload)
+        result = crud.record_order_status_event(
+            self.db,
+            order_id=str(order_id),
+            event=event,
+            rank=STATUS_RANK.get(event, 0),
+            telefone=parsed["telefone"] or "",
+            nome=parsed["nome"] or "",
+            payload=payload,
+            delay_seconds=settings.status_coalesce_seconds,
+        )
+        return {"event": event, "queued": result["status"] == "pending", "duplicate": result["id"] is None, **result}
 
+    def _resolve_customer(self, order_id: Optional[str], telefone: Optional[str], nome: Optional[str]):
         if not telefone and order_id:
             order = crud.get_order(self.db, order_id)
             if order:
@@ -37,18 +79,30 @@ class StatusService:
                 if not nome:
                     payload_order = order.get("payload") or {}
                     nome = payload_order.get("customer", {}).get("name") or payload_order.get("nome")
+        return normalize_phone(telefone), nome or "Cliente"
 
-        telefone = normalize_phone(telefone)
-        nome = nome or "Cliente"
+    def _notify(self, event: Optional[str], telefone: str, nome: str) -> bool:
+        message_template = STATUS_MESSAGES.get(event)
+        if not (message_template and telefone):
+            return False
+        if self.send_limiter is not None:
+            self.send_limiter.acquire()
+        send_messages(self.db, self.evolution_client, telefone, [message_template.format(nome=nome)], source="status")
+        return True
+
+    def deliver(self, row: Dict[str, Any]) -> bool:
+        """Caminho do worker: atualiza o pedido e avisa o cliente de um evento gravado por `record_event`."""
+        telefone, nome = self._resolve_customer(row.get("order_id"), row.get("telefone"), row.get("nome"))
+        crud.update_order_status(self.db, row.get("order_id") or "", row["event"], response=row.get("payload"))
+        return self._notify(row["event"], telefone, nome)
+
+    def process_event(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        parsed = parse_status_event(payload)
+        event, order_id = parsed["event"], parsed["order_id"]
+        telefone, nome = self._resolve_customer(order_id, parsed["telefone"], parsed["nome"])
 
         if event:
             crud.update_order_status(self.db, order_id or "", event, response=payload)
 
-        message_template = STATUS_MESSAGES.get(event)
-        sent = False
-        if message_template and telefone:
-            text = message_template.format(nome=nome)
-            self.evolution_client.send_text(settings.evolution_instance, telefone, text)
-            sent = True
-
+        sent = self._notify(event, telefone, nome)
         return {"event": event, "sent": sent}
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from typing import IO, Any, Dict, Optional, Tuple, Union
+
+from app.settings import settings
+from app.utils.base64_stream import base64_decoded_size_hint, iter_base64_chunks
+from app.utils.http_client import http_client
+from app.utils.tracing import bind_context
+
+logger = logging.getLogger(__name__)
+
+_SPOOL_MAX_BYTES = 1024 * 1024
+
+_EXTENSIONS = {
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "mp4",
+    "video/mp4": "mp4",
+    "audio/m4a": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/ogg": "ogg",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+}
+
+
+class MediaTooLarge(ValueError):
+    pass
+
+
+def audio_filename(mime_type: str | None) -> Tuple[str, str]:
+    mime = (mime_type or "").split(";")[0].strip().lower()
+    ext = _EXTENSIONS.get(mime)
+    if ext is None:
+        # a Evolution converte para mp4 (convertToMp4)
+        return "audio.mp4", "audio/mp4"
+    return f"audio.{ext}", mime
+
+
+def openai_transcribe(audio: Union[bytes, IO[bytes]], filename: str = "audio.mp3", mime_type: str = "audio/mpeg") -> str:
+    url = "https://api.openai.com/v1/audio/transcriptions"
+    headers = {"Authorization": f"Bearer {settings.openai_api_key}"}
+    files = {
+        "file": (filename, audio, mime_type),
+        "model": (None, settings.openai_model_transcribe),
+    }
+    with http_client("openai", timeout=120) as client:
+        resp = client.post(url, headers=headers, files=files)
+        resp.raise_for_status()
+        data = resp.json()
+    return data.get("text") or ""
+
+
+def decode_base64_to_spool(data: str, max_bytes: int) -> Tuple[IO[bytes], int, str]:
+    """
+    Decodifica o base64 em fatias para um arquivo temporário (em memória até 1 MB),
+    calculando o sha256 no caminho. Retorna (arquivo posicionado no início, bytes, sha256).
+    """
+    if base64_decoded_size_hint(data) > max_bytes + 3:
+        raise MediaTooLarge(f"media maior que {max_bytes} bytes")
+    spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter_base64_chunks(data):
+            size += len(chunk)
+            if size > max_bytes:
+                raise MediaTooLarge(f"media maior que {max_bytes} bytes")
+            hasher.update(chunk)
+            spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, size, hasher.hexdigest()
+
+
+class _LruCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(int(max_size), 1)
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if not key or key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key: Optional[str], value: str) -> None:
+        if not key:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+
+class TranscriptionService:
+    """
+    Transcrição de áudios do WhatsApp com pool limitado de workers, limite de tamanho e cache
+    por id da mensagem e por hash do conteúdo (reentregas do webhook não transcrevem de novo).
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        max_bytes: int | None = None,
+        cache_size: int | None = None,
+        timeout_seconds: float | None = None,
+        transcriber=None,
+    ) -> None:
+        self.max_bytes = int(max_bytes or settings.transcribe_max_bytes)
+        self.timeout_seconds = float(timeout_seconds or settings.transcribe_timeout_seconds)
+        self.transcriber = transcriber or openai_transcribe
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(int(max_workers or settings.transcribe_workers), 1),
+            thread_name_prefix="transcribe",
+        )
+        self._by_message = _LruCache(cache_size or settings.transcribe_cache_size)
+        self._by_content = _LruCache(cache_size or settings.transcribe_cache_size)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "queued": 0,
+            "in_flight": 0,
+            "completed": 0,
+            "failed": 0,
+            "cache_hits": 0,
+            "rejected_too_large": 0,
+            "timeouts": 0,
+            "latency_ms_total": 0,
+            "latency_ms_max": 0,
+        }
+
+    def _cached(self, cache: _LruCache, key: Optional[str]) -> Optional[str]:
+        with self._lock:
+            text = cache.get(key)
+            if text is not None:
+                self.stats["cache_hits"] += 1
+            return text
+
+    def transcribe_message(self, evolution, info: Dict[str, Any]) -> str:
+        message_id = info.get("id_mensagem")
+        cached = self._cached(self._by_message, message_id)
+        if cached is not None:
+            return cached
+        try:
+            media_size = int(info.get("media_size") or 0)
+        except (TypeError, ValueError):
+            media_size = 0
+        if media_size > self.max_bytes:
+            with self._lock:
+                self.stats["rejected_too_large"] += 1
+            logger.warning("audio_too_large", extra={"message_id": message_id, "payload_bytes": media_size})
+            return ""
+
+        with self._lock:
+            self.stats["queued"] += 1
+        # o worker herda o span do turno: download e transcrição aparecem no trace (e nos logs)
+        future = self._pool.submit(bind_context(self._run), evolution, info)
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except FuturesTimeout:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            logger.warning("audio_transcription_timeout", extra={"message_id": message_id})
+        except Exception:
+            logger.warning("audio_transcription_failed", extra={"message_id": message_id}, exc_info=True)
+        # sem transcrição o turno segue pelo caminho de texto (a fila da conversa) em vez de terminar em erro
+        return ""
+
+    def _run(self, evolution, info: Dict[str, Any]) -> str:
+        message_id = info.get("id_mensagem")
+        with self._lock:
+            self.stats["queued"] -= 1
+            self.stats["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            resp = evolution.get_base64_from_media(info.get("instancia"), message_id, base_url=info.get("url_evolution"))
+            data = resp.get("base64") or resp.get("data") or ""
+            # com convertToMp4 o conteúdo baixado é mp4, não o mimetype original (ogg/opus) do webhook
+            filename, mime = audio_filename(resp.get("mimetype"))
+            if not data:
+                return ""
+            try:
+                spool, size, content_hash = decode_base64_to_spool(data, self.max_bytes)
+            except MediaTooLarge:
+                with self._lock:
+                    self.stats["rejected_too_large"] += 1
+                logger.warning("audio_too_large", extra={"message_id": message_id})
+                return ""
+            del data, resp
+            with spool:
+                text = self._cached(self._by_content, content_hash)
+                if text is None:
+                    text = self.transcriber(spool, filename, mime)
+                    with self._lock:
+                        self._by_content.put(content_hash, text)
+            with self._lock:
+                self._by_message.put(message_id, text)
+                self.stats["completed"] += 1
+            return text
+        except Exception:
+            with self._lock:
+                self.stats["failed"] += 1
+            raise
+        finally:
+            elapsed_ms = int((time.monotonic() - started) * 1000)
+            with self._lock:
+                self.stats["in_flight"] -= 1
+                self.stats["latency_ms_total"] += elapsed_ms
+                self.stats["latency_ms_max"] = max(self.stats["latency_ms_max"], elapsed_ms)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        done = stats["completed"] + stats["failed"]
+        stats["queue_depth"] = stats.pop("queued")
+        stats["latency_ms_avg"] = round(stats.pop("latency_ms_total") / done, 1) if done else 0.0
+        return stats
+
+
+_service: Optional[TranscriptionService] = None
+_service_lock = threading.Lock()
+
+
+def get_transcription_service() -> TranscriptionService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TranscriptionService()
+    return _service
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import base64
+from typing import Iterator
+
+# múltiplo de 4 para que cada fatia decodifique de forma independente
+B64_CHUNK = 64 * 1024
+
+
+def base64_payload_start(data: str) -> int:
+    """Posição do conteúdo base64 (depois do prefixo `data:<mime>;base64,`, quando houver)."""
+    return data.find(",") + 1 if data.startswith("data:") else 0
+
+
+def iter_base64_chunks(data: str, chunk_size: int = B64_CHUNK) -> Iterator[bytes]:
+    """
+    Decodifica o base64 em fatias, sem materializar os bytes inteiros. Quebras de linha e espaços
+    (base64 estilo MIME) são descartados e o resto de cada fatia que não fecha múltiplo de 4 vai para a próxima.
+    """
+    pending = ""
+    for pos in range(base64_payload_start(data), len(data), chunk_size):
+        pending += "".join(data[pos : pos + chunk_size].split())
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.b64decode(pending[:usable])
+            pending = pending[usable:]
+    if pending:
+        # sobra sem padding: deixa o b64decode acusar o base64 inválido
+        yield base64.b64decode(pending)
+
+
+def base64_decoded_size_hint(data: str) -> int:
+    """Tamanho decodificado aproximado (sem contar quebras de linha), para recusar mídia grande antes de decodificar."""
+    start = base64_payload_start(data)
+    chars = len(data) - start - data.count("\n", start) - data.count("\r", start)
+    return chars * 3 // 4
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from app.settings import settings
+
+
+class LruIdFilter:
+    """Conjunto limitado dos ids mais recentes (exato: sem falso positivo)."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(int(max_size), 1)
+        self._items: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        if key in self._items:
+            self._items.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: Hashable) -> None:
+        self._items[key] = None
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class RotatingBloomFilter:
+    """
+    Bloom filter em duas gerações: quando a atual enche, a anterior é descartada.
+    Memória fixa, mas com falso positivo (taxa alvo `error_rate` por geração).
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        self.capacity = max(int(capacity), 1)
+        bits = -self.capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.num_bits = max(int(bits), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self._current = bytearray((self.num_bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+
+    def _positions(self, key: Hashable):
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @staticmethod
+    def _has(bits: bytearray, positions) -> bool:
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def __contains__(self, key: Hashable) -> bool:
+        positions = self._positions(key)
+        return self._has(self._current, positions) or self._has(self._previous, positions)
+
+    def add(self, key: Hashable) -> None:
+        if self._count >= self.capacity:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._count = 0
+        for p in self._positions(key):
+            self._current[p >> 3] |= 1 << (p & 7)
+        self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class DuplicateMessageFilter:
+    """
+    Pré-filtro em memória de entregas repetidas do webhook (telefone, id_mensagem).
+
+    Um hit descarta a entrega sem tocar no banco; misses seguem para o banco, que é a fonte
+    de verdade. Uma fração `verify_rate` dos hits também vai ao banco para medir falsos positivos.
+    """
+
+    def __init__(self, backend, verify_rate: float = 0.0, rng: Optional[random.Random] = None) -> None:
+        self.backend = backend
+        self.verify_rate = max(min(float(verify_rate), 1.0), 0.0)
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "filtered": 0,
+            "verified_hits": 0,
+            "false_positives": 0,
+            "db_duplicates": 0,
+        }
+
+    def check(self, key: Tuple[str, str]) -> Tuple[bool, bool]:
+        """Retorna (hit, verificar_no_banco)."""
+        with self._lock:
+            self.stats["requests"] += 1
+            hit = key in self.backend
+            if not hit:
+                return False, True
+            if self.verify_rate and self._rng.random() < self.verify_rate:
+                self.stats["verified_hits"] += 1
+                return True, True
+            self.stats["filtered"] += 1
+            return True, False
+
+    def record(self, key: Tuple[str, str], hit: bool, queued: bool) -> None:
+        with self._lock:
+            if queued and hit:
+                self.stats["false_positives"] += 1
+            if not queued:
+                self.stats["db_duplicates"] += 1
+            self.backend.add(key)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        requests = stats["requests"]
+        duplicates = stats["filtered"] + stats["db_duplicates"]
+        return {
+            **stats,
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend),
+            "duplicate_rate": round(duplicates / requests, 4) if requests else 0.0,
+            "false_positive_rate": (
+                round(stats["false_positives"] / stats["verified_hits"], 4) if stats["verified_hits"] else 0.0
+            ),
+        }
+
+
+_message_filter: Optional[DuplicateMessageFilter] = None
+_message_filter_lock = threading.Lock()
+
+
+def get_message_filter() -> Optional[DuplicateMessageFilter]:
+    global _message_filter
+    if not settings.webhook_dedupe_enabled:
+        return None
+    if _message_filter is None:
+        with _message_filter_lock:
+            if _message_filter is None:
+                if settings.webhook_dedupe_backend == "bloom":
+                    backend = RotatingBloomFilter(settings.webhook_dedupe_size)
+                else:
+                    backend = LruIdFilter(settings.webhook_dedupe_size)
+                _message_filter = DuplicateMessageFilter(backend, verify_rate=settings.webhook_dedupe_verify_rate)
+    return _message_filter
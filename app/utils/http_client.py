@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import time
+import urllib.request
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.utils import tracing
+from app.utils.metrics import REGISTRY
+
+HTTP_CLIENT_SECONDS = REGISTRY.histogram(
+    "lia_http_client_seconds",
+    "Duração das chamadas HTTP de saída até a resposta (headers)",
+    ("client", "method", "status"),
+)
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """
+    Transport que mede cada requisição por cliente/método/classe de status (labels de baixa cardinalidade)
+    e, dentro de um trace, abre um span de cliente e envia o cabeçalho `traceparent`.
+    """
+
+    def __init__(self, name: str, transport: httpx.BaseTransport) -> None:
+        self.name = name
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        with tracing.span(f"http.{self.name}", kind="client", method=request.method, path=request.url.path) as span:
+            if span is not None:
+                # propaga o trace do turno (W3C) para Saipos, Evolution, OpenAI...
+                request.headers["traceparent"] = span.traceparent()
+            try:
+                response = self._transport.handle_request(request)
+                status = f"{response.status_code // 100}xx"
+                if span is not None:
+                    span.set(status_code=response.status_code)
+                    if response.status_code >= 500:
+                        span.status = "error"
+                return response
+            finally:
+                HTTP_CLIENT_SECONDS.observe(time.perf_counter() - started, client=self.name, method=request.method, status=status)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+def _env_proxy_mounts(name: str, limits: httpx.Limits | None) -> Dict[str, Optional[httpx.BaseTransport]]:
+    """
+    Mounts com os proxies do ambiente (`HTTP(S)_PROXY`, `ALL_PROXY`, `NO_PROXY`), já instrumentados.
+    Passar `transport=` faz o httpx ignorar essas variáveis; aqui elas voltam pela API pública (`mounts=`).
+    """
+    proxies = urllib.request.getproxies()
+    transport_kwargs: Dict[str, Any] = {"limits": limits} if limits is not None else {}
+    mounts: Dict[str, Optional[httpx.BaseTransport]] = {}
+    for scheme in ("http", "https", "all"):
+        proxy = proxies.get(scheme)
+        if proxy:
+            if "://" not in proxy:
+                proxy = f"http://{proxy}"
+            mounts[f"{scheme}://"] = InstrumentedTransport(name, httpx.HTTPTransport(proxy=proxy, **transport_kwargs))
+    if not mounts:
+        return mounts
+    for host in (proxies.get("no") or "").split(","):
+        host = host.strip()
+        if host == "*":
+            return {}
+        if not host:
+            continue
+        # None = sem proxy: o httpx usa o `transport` padrão (direto)
+        if "://" in host:
+            mounts[host] = None
+        elif host.lower() == "localhost" or host.replace(".", "").isdigit():
+            mounts[f"all://{host}"] = None
+        elif ":" in host:
+            mounts[f"all://[{host}]"] = None
+        else:
+            mounts[f"all://*{host}"] = None
+    return mounts
+
+
+def http_client(name: str, timeout: Any = 30, limits: httpx.Limits | None = None, **kwargs: Any) -> httpx.Client:
+    """httpx.Client instrumentado; `name` identifica o serviço externo (saipos, evolution, openai...)."""
+    transport = httpx.HTTPTransport(limits=limits) if limits is not None else httpx.HTTPTransport()
+    return httpx.Client(
+        timeout=timeout,
+        transport=InstrumentedTransport(name, transport),
+        mounts=_env_proxy_mounts(name, limits),
+        **kwargs,
+    )
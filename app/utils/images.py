@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import io
+import struct
+from typing import Optional, Tuple
+
+try:  # opcional (extra `image`): redução da imagem antes do modelo de visão
+    from PIL import Image
+except ImportError:  # pragma: no cover - depende do ambiente
+    Image = None
+
+
+def image_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """Largura/altura lidas do cabeçalho (PNG, JPEG, GIF, WebP) sem decodificar a imagem."""
+    if len(data) < 24:
+        return None
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        width, height = struct.unpack(">II", data[16:24])
+        return width, height
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", data[6:10])
+        return width, height
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        chunk = data[12:16]
+        if chunk == b"VP8 " and len(data) >= 30:
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and len(data) >= 25:
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X" and len(data) >= 30:
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return width, height
+        return None
+    if data[:2] == b"\xff\xd8":
+        pos = 2
+        while pos + 9 < len(data):
+            if data[pos] != 0xFF:
+                pos += 1
+                continue
+            marker = data[pos + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                pos += 2
+                continue
+            length = struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                height, width = struct.unpack(">HH", data[pos + 5 : pos + 9])
+                return width, height
+            pos += 2 + length
+    return None
+
+
+def downscale_for_vision(data: bytes, mime_type: str, max_side: int) -> Tuple[bytes, str]:
+    """Reduz o lado maior para `max_side` e recodifica em JPEG (requer Pillow; senão devolve o original)."""
+    if Image is None:
+        return data, mime_type
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= max_side:
+                return data, mime_type
+            img.thumbnail((max_side, max_side))
+            out = io.BytesIO()
+            img.convert("RGB").save(out, format="JPEG", quality=85)
+            return out.getvalue(), "image/jpeg"
+    except Exception:
+        return data, mime_type
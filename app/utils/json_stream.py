@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import codecs
+import json
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+_WS = " \t\r\n"
+_DECODER = json.JSONDecoder()
+
+
+class _Buffer:
+    """Buffer de texto alimentado por chunks de bytes (decodificação UTF-8 incremental)."""
+
+    def __init__(self, chunks: Iterable[bytes], hasher=None) -> None:
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._hasher = hasher
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.text += self._decoder.decode(b"", final=True)
+            self.eof = True
+            return True
+        if self._hasher is not None:
+            self._hasher.update(chunk)
+        if self.pos > 65536 and self.pos > len(self.text) // 2:
+            self.text = self.text[self.pos :]
+            self.pos = 0
+        self.text += self._decoder.decode(chunk)
+        return True
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"JSON inesperado na posição {self.pos}: esperado {char!r}")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # Um número no fim do buffer pode estar truncado: só aceita se houver algo depois.
+            if end >= len(self.text) and not self.eof:
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def drain(self) -> None:
+        while self.fill():
+            pass
+
+
+def iter_json_array_items(
+    chunks: Iterable[bytes],
+    keys: Sequence[str] = ("items", "data", "results"),
+    hasher: Optional[Any] = None,
+) -> Iterator[Any]:
+    """
+    Itera os elementos de um array JSON sem carregar o documento inteiro.
+
+    Aceita um array no topo ou um objeto cujo primeiro campo em `keys` contenha o array.
+    Se `hasher` for informado (ex.: hashlib.sha256()), ele recebe todos os bytes lidos.
+    """
+    buf = _Buffer(chunks, hasher)
+    first = buf.peek()
+    if first == "{":
+        buf.pos += 1
+        found = False
+        while True:
+            char = buf.peek()
+            if char == "}" or char == "":
+                break
+            if char == ",":
+                buf.pos += 1
+                continue
+            key = buf.decode_value()
+            buf.expect(":")
+            if key in keys and buf.peek() == "[":
+                found = True
+                break
+            buf.decode_value()
+        if not found:
+            buf.drain()
+            return
+    elif first != "[":
+        buf.drain()
+        return
+
+    buf.expect("[")
+    while True:
+        char = buf.peek()
+        if char == "]":
+            buf.pos += 1
+            break
+        if char == "":
+            raise ValueError("JSON truncado: array não foi fechado")
+        if char == ",":
+            buf.pos += 1
+            continue
+        yield buf.decode_value()
+    # consome o restante para que o hasher veja o corpo completo
+    buf.drain()
@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# limite de spans guardados por trace (um turno normal tem algumas dezenas)
+MAX_SPANS_PER_TRACE = 512
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+_instance: Optional["SpanExporter"] = None
+
+
+def _otel_trace_id(app_trace_id: str) -> str:
+    # o trace_id da aplicação ("<id da mensagem>-<timestamp>") vira um id W3C de 32 hex, estável
+    return hashlib.blake2b(app_trace_id.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def should_sample(otel_trace_id: str, rate: float) -> bool:
+    """Amostragem determinística pelo id: a mesma mensagem tem a mesma decisão em qualquer processo."""
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return int(otel_trace_id[:16], 16) / 2**64 < rate
+
+
+class _Trace:
+    __slots__ = ("app_id", "trace_id", "sampled", "recording", "spans", "dropped")
+
+    def __init__(self, app_id: str, sample_rate: float, recording: bool) -> None:
+        self.app_id = app_id
+        self.trace_id = _otel_trace_id(app_id)
+        self.sampled = should_sample(self.trace_id, sample_rate)
+        self.recording = recording
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, trace: _Trace, parent_id: str = "", kind: str = "internal", **attributes: Any) -> None:
+        self.name = name
+        self.kind = kind
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.status = "ok"
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.app_id
+
+    def traceparent(self) -> str:
+        """Cabeçalho W3C `traceparent` para as chamadas HTTP feitas dentro deste span."""
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, end_ns: int | None = None) -> None:
+        self.end_ns = end_ns or time.time_ns()
+        trace = self.trace
+        if not trace.recording:
+            return
+        if len(trace.spans) >= MAX_SPANS_PER_TRACE:
+            trace.dropped += 1
+            return
+        trace.spans.append(self.to_dict())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    """trace_id da aplicação do turno atual (o mesmo gravado em inbound_messages/order_audit), ou ""."""
+    current = _current.get()
+    return current.trace.app_id if current is not None else ""
+
+
+@contextmanager
+def start_trace(name: str, trace_id: str | None = None, **attributes: Any):
+    """
+    Abre o span raiz de um trace (processamento de uma mensagem, envio do outbound...). Spans só são
+    guardados com um exportador rodando; sem ele o trace serve para correlacionar logs e headers.
+    """
+    exporter = _instance
+    recording = exporter is not None and exporter.running()
+    app_id = trace_id or secrets.token_hex(16)
+    trace = _Trace(app_id, settings.trace_sample_rate, recording)
+    root = Span(name, trace, **attributes)
+    root.attributes.setdefault("lia.trace_id", app_id)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException:
+        root.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        root.end()
+        if exporter is not None and recording:
+            exporter.finish(trace, root)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes: Any):
+    """Span filho do atual; fora de um trace não faz nada (e devolve None)."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace, parent.span_id, kind, **attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException:
+        child.status = "error"
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+def record_span(name: str, duration_seconds: float, **attributes: Any) -> None:
+    """Registra um span já terminado agora (etapas medidas por cronômetro, ex.: StageTimer)."""
+    parent = _current.get()
+    if parent is None or not parent.trace.recording:
+        return
+    child = Span(name, parent.trace, parent.span_id, **attributes)
+    end_ns = time.time_ns()
+    child.start_ns = end_ns - int(duration_seconds * 1e9)
+    child.end(end_ns)
+
+
+def bind_context(fn):
+    """
+    Para passar a um pool de threads: `fn` roda com o contexto de quem chamou (span atual, trace_id dos logs,
+    `traceparent` das chamadas HTTP). Cada chamada usa uma cópia, então o mesmo `fn` pode rodar em várias threads.
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args: Any, **kwargs: Any):
+        return ctx.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+def set_attributes(**attributes: Any) -> None:
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+class TraceContextFilter(logging.Filter):
+    """Preenche trace_id/span_id dos registros de log com o span atual (quando o log não trouxe um)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current.get()
+        if current is not None:
+            if getattr(record, "trace_id", None) is None:
+                record.trace_id = current.trace.app_id
+            record.span_id = current.span_id
+        return True
+
+
+class FileSpanSink:
+    """Um span por linha (JSON), para análise local (scripts/trace_stragglers.py)."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as fh:
+            for item in spans:
+                fh.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpSink:
+    """POST em OTLP/HTTP JSON (`/v1/traces`): collector do OpenTelemetry, Jaeger, Tempo..."""
+
+    def __init__(self, endpoint: str, service_name: str, timeout: float = 10.0) -> None:
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def payload(self, spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+        otlp_spans = []
+        for item in spans:
+            otlp = {
+                "traceId": item["trace_id"],
+                "spanId": item["span_id"],
+                "name": item["name"],
+                "kind": 3 if item["kind"] == "client" else 1,
+                "startTimeUnixNano": str(item["start_ns"]),
+                "endTimeUnixNano": str(item["end_ns"]),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in item["attributes"].items()],
+                "status": {"code": 2 if item["status"] == "error" else 1},
+            }
+            if item["parent_id"]:
+                otlp["parentSpanId"] = item["parent_id"]
+            otlp_spans.append(otlp)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+                }
+            ]
+        }
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        # cliente sem instrumentação: o próprio exportador não gera spans nem métricas de HTTP
+        with httpx.Client(timeout=self.timeout) as client:
+            client.post(self.endpoint, json=self.payload(spans)).raise_for_status()
+
+
+def build_sink(kind: str | None = None):
+    kind = (kind if kind is not None else settings.trace_exporter).strip().lower()
+    if kind == "file":
+        return FileSpanSink(settings.trace_file_path)
+    if kind == "otlp":
+        return OtlpHttpSink(settings.trace_otlp_endpoint, settings.app_name)
+    return None
+
+
+class SpanExporter:
+    """
+    Exporta os traces terminados em lote, numa thread própria (o turno só empilha numa deque).
+
+    Um trace sai se foi amostrado (`TRACE_SAMPLE_RATE`, decisão pelo id) ou se o span raiz passou de
+    `TRACE_SLOW_MS` — os turnos lentos, que são os que interessam para achar o p99, sempre aparecem.
+    """
+
+    def __init__(
+        self,
+        sink,
+        slow_ms: int | None = None,
+        interval_seconds: float | None = None,
+        queue_size: int | None = None,
+        batch_size: int = 512,
+    ) -> None:
+        self.sink = sink
+        self.slow_ms = int(slow_ms if slow_ms is not None else settings.trace_slow_ms)
+        self.interval_seconds = float(interval_seconds or settings.trace_export_interval_seconds)
+        self.batch_size = batch_size
+        self._queue: deque = deque(maxlen=int(queue_size or settings.trace_queue_size))
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            "traces": 0,
+            "sampled": 0,
+            "slow": 0,
+            "spans_exported": 0,
+            "spans_dropped": 0,
+            "export_errors": 0,
+        }
+
+    def start(self) -> None:
+        global _instance
+        _instance = self
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="span-exporter", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def finish(self, trace: _Trace, root: Span) -> None:
+        slow = self.slow_ms > 0 and (root.end_ns - root.start_ns) / 1e6 >= self.slow_ms
+        with self._lock:
+            self.stats["traces"] += 1
+            self.stats["spans_dropped"] += trace.dropped
+            if not (trace.sampled or slow):
+                return
+            self.stats["sampled" if trace.sampled else "slow"] += 1
+            overflow = max(len(self._queue) + len(trace.spans) - (self._queue.maxlen or 0), 0)
+            self.stats["spans_dropped"] += overflow
+            self._queue.extend(trace.spans)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(timeout=self.interval_seconds)
+            self._wakeup.clear()
+            try:
+                while self.run_once():
+                    pass
+            except Exception:
+                logger.exception("span_export_loop_failed")
+        self.run_once()
+
+    def run_once(self) -> int:
+        with self._lock:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        if not batch:
+            return 0
+        try:
+            self.sink.export(batch)
+        except Exception as exc:
+            with self._lock:
+                self.stats["export_errors"] += 1
+                self.stats["spans_dropped"] += len(batch)
+            logger.warning("span_export_failed", extra={"result": len(batch), "body": str(exc)})
+            return 0
+        with self._lock:
+            self.stats["spans_exported"] += len(batch)
+        return len(batch)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["queued"] = len(self._queue)
+        stats["running"] = self.running()
+        return stats
+
+
+def tracing_metrics() -> Dict[str, Any]:
+    if _instance is None:
+        return {"running": False}
+    return _instance.metrics()
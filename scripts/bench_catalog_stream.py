@@ -0,0 +1,99 @@
+"""
+Compara o pico de memória (RSS) entre json.loads + lista mapeada e o parser em streaming por chunks.
+
+Cada variante roda num processo novo: ru_maxrss é o pico da vida inteira do processo, então medir as
+duas no mesmo processo mascararia a segunda. O catálogo é gerado no processo pai e passado por um
+arquivo temporário, para o pico da geração não entrar na linha de base dos filhos.
+
+Uso: python scripts/bench_catalog_stream.py --items 200000 --chunk-size 1000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.menu_service import MenuService
+from app.utils.json_stream import iter_json_array_items
+
+
+def _catalog(n: int) -> bytes:
+    items = [
+        {
+            "codigo_saipos": f"{i // 5}.{i % 5}" if i % 5 else str(i // 5),
+            "item": f"Item {i}",
+            "categoria": f"Categoria {i % 40}",
+            "complemento": "Adicionais" if i % 5 else None,
+            "price": f"{(i % 90) + 0.9:.2f}",
+            "id_store_item": i,
+            "id_store_choice": i if i % 5 else None,
+            "item_type": "addition" if i % 5 else "product",
+        }
+        for i in range(n)
+    ]
+    return json.dumps({"items": items}).encode("utf-8")
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run(variant: str, path: str, chunk_size: int):
+    with open(path, "rb") as fh:
+        payload = fh.read()
+    service = MenuService(db=None, saipos_client=None)
+    chunks = [payload[i : i + 65536] for i in range(0, len(payload), 65536)]
+
+    def full():
+        data = json.loads(payload)
+        rows = [service._map_row(r) for r in service._extract_items(data)]
+        return len(rows)
+
+    def streaming():
+        total = 0
+        chunk = []
+        for item in iter_json_array_items(iter(chunks)):
+            chunk.append(service._map_row(item))
+            if len(chunk) >= chunk_size:
+                total += len(chunk)
+                chunk = []
+        return total + len(chunk)
+
+    baseline = _peak_rss_bytes()
+    started = time.perf_counter()
+    count = {"json.loads": full, "streaming": streaming}[variant]()
+    elapsed = time.perf_counter() - started
+    return count, baseline, _peak_rss_bytes(), elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=200000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.NamedTemporaryFile(suffix=".json") as fh:
+        payload = _catalog(args.items)
+        fh.write(payload)
+        fh.flush()
+        print(f"payload: {len(payload) / 1e6:.1f} MB, {args.items} itens")
+        del payload
+        for variant in ("json.loads", "streaming"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                count, baseline, peak, elapsed = pool.submit(_run, variant, fh.name, args.chunk_size).result()
+            print(
+                f"{variant:>10}: {count} linhas, pico RSS {peak / 1e6:.1f} MB "
+                f"(+{(peak - baseline) / 1e6:.1f} MB sobre o payload), {elapsed:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Consulta de candidatos a follow-up com 1M de linhas em active_sessions, contra um Postgres local.
+
+Semeia sessões sintéticas `bench-fu-*` (maioria encerrada, como em produção), mede a página do
+claim com e sem o índice parcial (o DROP INDEX roda numa transação desfeita) e o tempo de
+arquivamento das encerradas. Remove as linhas geradas no final.
+
+Uso: DATABASE_URL=postgresql+psycopg://... python scripts/bench_followup_query.py --rows 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app.db import crud
+from app.db.session import UOW_KEY, get_engine
+
+PREFIX = "bench-fu-"
+INDEX = "idx_active_sessions_followup_candidates"
+
+_SEED = """
+INSERT INTO public.active_sessions (session_id, last_message, last_message_type, status, followup_count, updated_at)
+SELECT
+  :prefix || g,
+  'mensagem ' || g,
+  CASE WHEN g % 3 = 0 THEN 'human' ELSE 'ai' END,
+  CASE WHEN g % 100 < :active_pct THEN 'active' ELSE 'finished' END,
+  CASE WHEN g % 7 = 0 THEN 2 ELSE 0 END,
+  now() - make_interval(mins => (g % 100000))
+FROM generate_series(1, :rows) AS g
+ON CONFLICT DO NOTHING
+"""
+
+_PAGE = """
+SELECT id, updated_at
+FROM public.active_sessions
+WHERE status = 'active'
+  AND last_message_type IN ('ai','human')
+  AND COALESCE(followup_count,0) < 2
+  AND followup_sent_at IS NULL
+  AND updated_at < now() - interval '10 minutes'
+  AND (followup_claimed_at IS NULL OR followup_claimed_at < now() - make_interval(secs => 600))
+  {keyset}
+ORDER BY updated_at ASC, id ASC
+LIMIT 200
+FOR UPDATE SKIP LOCKED
+"""
+
+
+def _time_pages(conn, pages: int) -> float:
+    cursor = None
+    started = time.perf_counter()
+    for _ in range(pages):
+        keyset = "AND (updated_at, id) > (CAST(:ts AS timestamptz), CAST(:id AS bigint))" if cursor else ""
+        params = {"ts": cursor[1], "id": cursor[0]} if cursor else {}
+        rows = conn.execute(text(_PAGE.format(keyset=keyset)), params).all()
+        if not rows:
+            break
+        cursor = rows[-1]
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--active-pct", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = get_engine()
+    try:
+        with engine.begin() as conn:
+            started = time.perf_counter()
+            conn.execute(text(_SEED), {"prefix": PREFIX, "rows": args.rows, "active_pct": args.active_pct})
+            conn.execute(text("ANALYZE public.active_sessions"))
+            print(f"seed {args.rows} linhas: {time.perf_counter() - started:.1f}s")
+
+        with engine.connect() as conn:
+            plan = conn.execute(text("EXPLAIN " + _PAGE.format(keyset=""))).scalars().all()
+            print("plano:", " | ".join(line.strip() for line in plan[:4]))
+            with_index = _time_pages(conn, args.pages)
+            conn.rollback()
+
+            conn.execute(text(f"DROP INDEX IF EXISTS public.{INDEX}"))
+            without_index = _time_pages(conn, args.pages)
+            conn.rollback()
+        print(f"{args.pages} páginas keyset: com índice parcial={with_index:.1f}ms sem={without_index:.1f}ms")
+
+        with engine.connect() as conn:
+            # marca a conexão como unit of work: o crud não commita e o rollback desfaz o arquivamento
+            conn.info[UOW_KEY] = True
+            started = time.perf_counter()
+            archived = 0
+            while True:
+                moved = crud.archive_finished_sessions(conn, 0, 5000)
+                archived += moved
+                if moved < 5000:
+                    break
+            conn.rollback()
+            conn.info.pop(UOW_KEY, None)
+            print(f"arquivamento (desfeito): {archived} sessões em {time.perf_counter() - started:.1f}s")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM public.active_sessions WHERE session_id LIKE :p"), {"p": PREFIX + "%"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Custo de um ciclo de follow-up: LLM por candidato x templates com LLM só nos casos ambíguos.
+
+Os candidatos são sintéticos, com mistura de estados de carrinho. A latência do LLM é simulada
+pelo parâmetro --llm-ms (não há chamada real).
+
+Uso: python scripts/bench_followup_templates.py --candidates 200 --llm-ms 1200
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+from app.services.followup_templates import render_followup
+
+_CARTS = [
+    None,
+    {"itens": [{"nome": "X Salada"}]},
+    {"itens": [{"nome": "X Bacon"}, {"nome": "Coca-Cola Lata"}], "tipo_entrega": "entrega"},
+    {"itens": [{"nome": "Pizza Calabresa"}], "tipo_entrega": "retirada"},
+    {"itens": [{"nome": "X Galinha"}], "tipo_entrega": "retirada", "pagamento": "pix"},
+    {"itens": [{"nome": "X Tudo"}], "pendencias": [{"nome": "X Tudão"}]},
+]
+_LAST = [
+    ("Anotado!", "ai"),
+    ("pode ser", "human"),
+    ("A chave PIX é 09103543000109, pode me enviar o comprovante?", "ai"),
+    ("Quer incluir alguma bebida junto com o lanche?", "ai"),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--llm-ms", type=float, default=1200.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = []
+    for i in range(args.candidates):
+        last_message, last_type = rng.choice(_LAST)
+        rows.append({"session_id": f"55479999{i:05d}", "last_message": last_message, "last_message_type": last_type, "cart_json": rng.choice(_CARTS)})
+
+    started = time.perf_counter()
+    llm_calls = sum(1 for row in rows if render_followup(row, "Marcio Lanches")[1] is None)
+    render_ms = (time.perf_counter() - started) * 1000
+
+    baseline_ms = args.candidates * args.llm_ms
+    hybrid_ms = render_ms + llm_calls * args.llm_ms
+    print(f"candidatos={args.candidates} chamadas_llm={llm_calls} templates={args.candidates - llm_calls}")
+    print(f"llm_ratio={llm_calls / args.candidates:.2%} render_total_ms={render_ms:.2f}")
+    print(f"tempo_llm_sequencial: antes={baseline_ms / 1000:.1f}s depois={hybrid_ms / 1000:.1f}s ({baseline_ms / max(hybrid_ms, 1):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
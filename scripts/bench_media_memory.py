@@ -0,0 +1,58 @@
+"""
+Pico de memória por mensagem de imagem: fluxo antigo (base64 dentro do texto da mensagem) x media store.
+
+Uso: python scripts/bench_media_memory.py --size-mb 4
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import os
+import tempfile
+import tracemalloc
+
+from app.services.media_store import MediaStore
+
+
+def _measure(fn) -> int:
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    args = parser.parse_args()
+
+    raw = os.urandom(int(args.size_mb * 1024 * 1024))
+    webhook_base64 = "data:image/jpeg;base64," + base64.b64encode(raw).decode()
+    del raw
+    store = MediaStore(tempfile.mkdtemp(prefix="bench-media-"))
+
+    def antigo():
+        data = webhook_base64.split(",")[-1]
+        content = json.dumps({"tipo": "media", "media_base64": data, "mime_type": "image/jpeg", "texto": ""})
+        history = json.dumps({"type": "human", "data": {"content": content, "additional_kwargs": {}}})
+        messages = json.dumps([{"role": "user", "content": content}])
+        data_url = f"data:image/jpeg;base64,{json.loads(content)['media_base64']}"
+        return len(history) + len(messages) + len(data_url)
+
+    def media_store():
+        media_id = store.put_base64(webhook_base64, "image/jpeg")
+        content = json.dumps({"tipo": "media", "media_id": media_id, "mime_type": "image/jpeg", "texto": ""})
+        history = json.dumps({"type": "human", "data": {"content": content, "additional_kwargs": {}}})
+        messages = json.dumps([{"role": "user", "content": content}])
+        data_url = store.data_url(media_id)
+        return len(history) + len(messages) + len(data_url)
+
+    print(f"imagem: {args.size_mb:.1f} MB (base64 {len(webhook_base64) / 1e6:.1f} MB)")
+    for name, fn in (("antigo", antigo), ("media store", media_store)):
+        print(f"{name:>12}: pico {_measure(fn) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
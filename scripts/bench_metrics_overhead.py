@@ -0,0 +1,67 @@
+"""
+Custo da instrumentação do /metrics: observe() de histograma, função crud embrulhada por `timed`,
+requisição pelo transport instrumentado e o render do scrape.
+
+Nada sai da máquina: o HTTP usa httpx.MockTransport e as funções são vazias. O custo por mensagem
+é estimado a partir do número de observações de um turno típico (--observations).
+
+Uso: python scripts/bench_metrics_overhead.py --iterations 200000 --observations 80
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import httpx
+
+from app.utils.http_client import InstrumentedTransport
+from app.utils.metrics import MetricsRegistry, timed
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--http-iterations", type=int, default=5000)
+    parser.add_argument("--observations", type=int, default=80, help="observações por mensagem (etapas, crud, tools, HTTP)")
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    hist = registry.histogram("bench_seconds", "bench", ("fn",))
+
+    def bare():
+        return None
+
+    wrapped = timed(hist, fn="bare")(bare)
+    bare_us = _per_call_us(bare, args.iterations)
+    wrapped_us = _per_call_us(wrapped, args.iterations)
+    observe_us = _per_call_us(lambda: hist.observe(0.012, fn="fetch_cart"), args.iterations)
+
+    mock = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+    plain = httpx.Client(transport=mock)
+    instrumented = httpx.Client(transport=InstrumentedTransport("bench", mock))
+    plain_us = _per_call_us(lambda: plain.get("http://bench.local/"), args.http_iterations)
+    instrumented_us = _per_call_us(lambda: instrumented.get("http://bench.local/"), args.http_iterations)
+
+    # scrape com cardinalidade parecida com a de produção (~60 funções crud x 14 buckets)
+    for i in range(60):
+        hist.observe(0.01, fn=f"fn_{i}")
+    started = time.perf_counter()
+    body = registry.render()
+    render_ms = (time.perf_counter() - started) * 1000
+
+    per_message_us = args.observations * (wrapped_us - bare_us)
+    print(f"observe_us={observe_us:.2f} timed_overhead_us={wrapped_us - bare_us:.2f}")
+    print(f"http_plain_us={plain_us:.1f} http_instrumented_us={instrumented_us:.1f} overhead_us={instrumented_us - plain_us:.1f}")
+    print(f"render_ms={render_ms:.2f} linhas={body.count(chr(10))}")
+    print(f"overhead_por_mensagem_us={per_message_us:.1f} ({args.observations} observações)")
+
+
+if __name__ == "__main__":
+    main()
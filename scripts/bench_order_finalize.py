@@ -0,0 +1,89 @@
+"""
+Pedidos por segundo na finalização (process_order com outbox) contra um Postgres local.
+
+Usa telefones sintéticos 5500000XXXXXX (DDD inexistente), Saipos falsa e o dispatcher desligado
+(só a parte de persistência é medida). Remove as linhas geradas no final.
+
+Uso: DATABASE_URL=postgresql+psycopg://... python scripts/bench_order_finalize.py --orders 300
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app.db.session import get_db, track_db_stats
+from app.services import order_service
+from app.settings import settings
+
+PREFIX = "5500000"
+
+
+class _FakeSaipos:
+    def send_order(self, payload):  # pragma: no cover - o dispatcher não roda no benchmark
+        return {"status": "ok"}
+
+
+def _pedido(idx: int) -> dict:
+    telefone = f"{PREFIX}{idx:06d}"
+    return {
+        "session_id": telefone,
+        "dados_cliente": {"telefone": telefone, "nome": f"Cliente {idx}"},
+        "tipo_entrega": "entrega",
+        "endereco": {"rua": "Rua Brusque", "numero": str(idx), "bairro": "Centro"},
+        "pagamento": "pix",
+        "taxa_entrega": 6,
+        "itens": [
+            {"pdv": "101", "nome": "X Salada", "quantidade": 1, "valor_unitario": 28, "adicionais": [{"pdv": "901", "nome": "Bacon", "valor_unitario": 4}]},
+            {"pdv": "202", "nome": "Coca-Cola Lata", "quantidade": 2, "valor_unitario": 7},
+        ],
+    }
+
+
+def _cleanup(db, order_ids) -> None:
+    like = {"prefix": PREFIX + "%"}
+    ids = {"ids": list(order_ids)}
+    db.execute(
+        text("DELETE FROM public.order_items WHERE order_id IN (SELECT id FROM public.orders WHERE order_id = ANY(:ids))"),
+        ids,
+    )
+    db.execute(text("DELETE FROM public.orders WHERE order_id = ANY(:ids)"), ids)
+    db.execute(text("DELETE FROM public.order_outbox WHERE telefone LIKE :prefix"), like)
+    db.execute(text("DELETE FROM public.order_audit WHERE telefone LIKE :prefix"), like)
+    db.execute(
+        text("DELETE FROM public.addresses WHERE client_id IN (SELECT id FROM archive.clients WHERE phone LIKE :prefix)"),
+        like,
+    )
+    db.execute(text("DELETE FROM archive.clients WHERE phone LIKE :prefix"), like)
+    db.execute(text("DELETE FROM public.active_sessions WHERE session_id LIKE :prefix"), like)
+    db.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=300)
+    args = parser.parse_args()
+
+    settings.order_outbox_enabled = True
+    order_service.notify_order_dispatcher = lambda: True
+
+    order_ids = []
+    with get_db() as db:
+        service = order_service.OrderService(db, _FakeSaipos())
+        try:
+            with track_db_stats() as stats:
+                started = time.perf_counter()
+                for idx in range(args.orders):
+                    result = service.process_order(_pedido(idx))
+                    order_ids.append(result["payload"].get("order_id"))
+                elapsed = time.perf_counter() - started
+            print(
+                f"{args.orders / elapsed:8.1f} pedidos/s | "
+                f"{stats.statements / args.orders:.1f} statements/pedido | "
+                f"{stats.commits / args.orders:.1f} commits/pedido"
+            )
+        finally:
+            _cleanup(db, order_ids)
+
+
+if __name__ == "__main__":
+    main()
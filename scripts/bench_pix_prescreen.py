@@ -0,0 +1,93 @@
+"""
+Chamadas ao modelo de visão evitadas pelo cache de veredictos (mesmo arquivo na mesma conversa) e pelo pré-filtro.
+
+Gera cabeçalhos sintéticos (PNG/JPEG/WebP) para os casos de scripts/eval_cases/pix_cases.json e
+troca o modelo por um fake que responde pelo gabarito do caso.
+
+Uso: python scripts/bench_pix_prescreen.py
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import struct
+import zlib
+from pathlib import Path
+
+from app.services import pix_validator
+
+CASES_PATH = Path(__file__).parent / "eval_cases" / "pix_cases.json"
+
+
+def _png(width: int, height: int, salt: bytes) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = b"IHDR" + ihdr
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", len(ihdr)) + chunk + struct.pack(">I", zlib.crc32(chunk)) + salt
+
+
+def _jpeg(width: int, height: int, salt: bytes) -> bytes:
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    sof0 = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + app0 + sof0 + salt
+
+
+def _webp(width: int, height: int, salt: bytes) -> bytes:
+    body = b"VP8X" + struct.pack("<I", 10) + b"\x00\x00\x00\x00"
+    body += (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little")
+    return b"RIFF" + struct.pack("<I", 4 + len(body)) + b"WEBP" + body + salt
+
+
+_BUILDERS = {
+    "png": (_png, "image/png"),
+    "jpeg": (_jpeg, "image/jpeg"),
+    "webp": (_webp, "image/webp"),
+}
+
+
+def _media(case: dict) -> tuple[bytes, str]:
+    salt = case["name"].encode()
+    if case["format"] == "pdf":
+        return b"%PDF-1.4\n" + salt, "application/pdf"
+    builder, mime = _BUILDERS[case["format"]]
+    return builder(case["width"], case["height"], salt), mime
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default=str(CASES_PATH))
+    args = parser.parse_args()
+    cases = json.loads(Path(args.cases).read_text())["cases"]
+
+    truth: dict[str, bool] = {}
+    calls = {"model": 0}
+
+    def fake_model(data_url: str, return_usage: bool):
+        calls["model"] += 1
+        return {"valid": truth[data_url], "reason": "fake_model"}
+
+    pix_validator.settings.openai_api_key = pix_validator.settings.openai_api_key or "bench"
+    pix_validator._ask_model = fake_model
+
+    total = 0
+    missed_receipts = []
+    for case in cases:
+        media, mime = _media(case)
+        b64 = base64.b64encode(media).decode()
+        truth[f"data:{mime};base64,{b64}"] = case["receipt"]
+        for _ in range(case.get("repeat", 1)):
+            total += 1
+            result = pix_validator.validate_pix_receipt(
+                media_base64=b64, mime_type=mime, texto=case.get("caption") or None, session_id=case["name"]
+            )
+            if case["receipt"] and result.get("valid") is False:
+                missed_receipts.append((case["name"], result.get("reason")))
+
+    stats = pix_validator.pix_metrics()
+    print(f"requisicoes={total} chamadas_modelo={calls['model']} (sem cache/pré-filtro seriam {total})")
+    print(f"cache_hits={stats['cache_hits']} prescreen_inconclusive={stats['prescreen_inconclusive']} evitadas={stats['model_calls_avoided_rate']:.0%}")
+    print(f"comprovantes_rejeitados_no_prefiltro={missed_receipts or 'nenhum'}")
+
+
+if __name__ == "__main__":
+    main()
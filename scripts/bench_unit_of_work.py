@@ -0,0 +1,83 @@
+"""
+Benchmark do caminho de escrita de uma mensagem (webhook + fases do _process_message) contra um Postgres local.
+
+Compara o modo antigo (commit por statement) com o unit of work. Usa telefones sintéticos `bench-uow-*`
+e remove as linhas geradas no final.
+
+Uso: DATABASE_URL=postgresql+psycopg://... python scripts/bench_unit_of_work.py --messages 500
+"""
+import argparse
+import time
+from contextlib import nullcontext
+
+from sqlalchemy import text
+
+from app.db import crud
+from app.db.session import get_db, track_db_stats, unit_of_work
+from app.settings import settings
+
+PREFIX = "bench-uow-"
+
+
+def _message(db, idx: int, use_uow: bool) -> None:
+    telefone = f"{PREFIX}{idx % 50}"
+    scope = unit_of_work if use_uow else (lambda db: nullcontext(db))
+    with scope(db):
+        crud.enqueue_message(
+            db,
+            {
+                "telefone": telefone,
+                "mensagem": "quero um x salada",
+                "timestamp": None,
+                "id_mensagem": f"{PREFIX}{idx}",
+                "client_id": settings.client_id,
+                "trace_id": f"{PREFIX}{idx}",
+                "message_id": f"{PREFIX}{idx}",
+                "remote_jid": "",
+                "message_type": "text",
+                "status": "pending",
+            },
+        )
+        crud.upsert_active_session(db, session_id=telefone, last_message="quero um x salada", last_message_type="human", last_message_id=f"{PREFIX}{idx}")
+    with scope(db):
+        crud.get_pending_messages(db, telefone)
+        crud.insert_chat_history(db, telefone, "human", "quero um x salada")
+    crud.increment_session_tokens(db, telefone, 100, 20, 120)
+    with scope(db):
+        crud.clear_messages(db, telefone)
+        crud.update_active_session_ai(db, telefone, "Anotado!")
+        crud.insert_chat_history(db, telefone, "ai", "Anotado!")
+
+
+def _cleanup(db) -> None:
+    like = {"prefix": PREFIX + "%"}
+    db.execute(text("DELETE FROM public.n8n_fila_mensagens WHERE telefone LIKE :prefix"), like)
+    db.execute(text("DELETE FROM public.n8n_historico_mensagens WHERE session_id LIKE :prefix"), like)
+    db.execute(text("DELETE FROM public.active_sessions WHERE session_id LIKE :prefix"), like)
+    db.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    with get_db() as db:
+        try:
+            for label, use_uow in (("commit por statement", False), ("unit of work", True)):
+                with track_db_stats() as stats:
+                    started = time.perf_counter()
+                    for idx in range(args.messages):
+                        _message(db, idx, use_uow)
+                    elapsed = time.perf_counter() - started
+                print(
+                    f"{label:>22}: {args.messages / elapsed:8.1f} msg/s | "
+                    f"{stats.commits / args.messages:.1f} commits/msg | "
+                    f"{stats.statements / args.messages:.1f} statements/msg"
+                )
+        finally:
+            _cleanup(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Avaliação offline do MenuMatcher com e sem a camada vetorial.
+
+Usa um embedder falso (determinístico, sem rede): cada token é mapeado por uma tabela
+de sinônimos do próprio caso e combinado com trigramas de caracteres via hashing.
+Mede quantos itens cairiam em `itens_nao_encontrados` (= rodada extra de esclarecimento).
+
+Uso:
+    python scripts/eval_menu_matcher.py [--cases scripts/eval_cases/menu_matcher_cases.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import unicodedata
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.services.order_interpreter.menu_matcher import MenuMatcher, _generate_fingerprint  # noqa: E402
+from app.services.order_interpreter.vector_index import NumpyVectorIndex, QueryEmbeddingCache  # noqa: E402
+
+DIMS = 256
+
+
+def _strip_accents(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text or "")
+    return "".join(ch for ch in normalized if not unicodedata.combining(ch)).lower()
+
+
+class FakeEmbedder:
+    def __init__(self, sinonimos: Dict[str, str]) -> None:
+        self.sinonimos = {_strip_accents(k): v for k, v in sinonimos.items()}
+        self.calls = 0
+
+    def _bucket(self, feature: str) -> int:
+        return int(hashlib.md5(feature.encode("utf-8")).hexdigest(), 16) % DIMS
+
+    def embed(self, text: str) -> List[float]:
+        self.calls += 1
+        vec = [0.0] * DIMS
+        tokens = [t for t in "".join(ch if ch.isalnum() else " " for ch in _strip_accents(text)).split() if t]
+        for token in tokens:
+            concept = self.sinonimos.get(token)
+            if concept:
+                vec[self._bucket("c:" + concept)] += 3.0
+            padded = f"  {token} "
+            for i in range(len(padded) - 2):
+                vec[self._bucket("g:" + padded[i : i + 3])] += 0.3
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+
+def _menu_rows(menu: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {**item, "item_type": "product", "fingerprint": _generate_fingerprint(item.get("nome_original") or "")}
+        for item in menu
+    ]
+
+
+def _evaluate(matcher: MenuMatcher, cases: List[Dict[str, Any]]) -> Dict[str, Any]:
+    acertos = 0
+    erros = 0
+    nao_encontrados = 0
+    detalhes = []
+    for case in cases:
+        match, _ = matcher.match(case["texto"])
+        pdv = match.pdv if match else None
+        if pdv is None:
+            nao_encontrados += 1
+        elif pdv == case["esperado"]:
+            acertos += 1
+        else:
+            erros += 1
+        detalhes.append({"texto": case["texto"], "esperado": case["esperado"], "obtido": pdv, "score": match.score if match else None})
+    return {"acertos": acertos, "erros": erros, "esclarecimentos": nao_encontrados, "detalhes": detalhes}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Avaliação offline do MenuMatcher (camada vetorial).")
+    parser.add_argument("--cases", default=os.path.join(os.path.dirname(__file__), "eval_cases", "menu_matcher_cases.json"))
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.cases, "r", encoding="utf-8") as handle:
+        spec = json.load(handle)
+
+    menu = _menu_rows(spec["menu"])
+    cases = spec["cases"]
+
+    baseline = MenuMatcher(db=None)
+    baseline._menu_cache = menu
+
+    embedder = FakeEmbedder(spec.get("sinonimos") or {})
+    cache = QueryEmbeddingCache(embedder)
+    index = NumpyVectorIndex(
+        [m["pdv"] for m in menu],
+        [embedder.embed(m["nome_original"]) for m in menu],
+        cache,
+    )
+    vetorial = MenuMatcher(db=None, vector_index=index)
+    vetorial._menu_cache = menu
+
+    base = _evaluate(baseline, cases)
+    vec = _evaluate(vetorial, cases)
+    # segunda passada para medir o cache de embeddings de consulta
+    _evaluate(vetorial, cases)
+
+    total = len(cases)
+    print(f"casos={total}")
+    print(f"sem vetorial: acertos={base['acertos']} erros={base['erros']} esclarecimentos={base['esclarecimentos']}")
+    print(f"com vetorial: acertos={vec['acertos']} erros={vec['erros']} esclarecimentos={vec['esclarecimentos']}")
+    print(f"rodadas de esclarecimento evitadas={base['esclarecimentos'] - vec['esclarecimentos']}")
+    print(f"cache de consulta: hits={cache.hits} misses={cache.misses}")
+    if args.verbose:
+        for b, v in zip(base["detalhes"], vec["detalhes"]):
+            print(json.dumps({"base": b, "vetorial": v}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,50 @@
+import argparse
+import sys
+import time
+
 from app.db.session import get_db
 from app.services.menu_service import MenuService
 from app.services.saipos_client import SaiposClient
 from app.settings import settings
 
 
+def _progress_printer():
+    started = time.monotonic()
+
+    def _print(done: int, total: int) -> None:
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = done / elapsed
+        sys.stdout.write(f"\r[{done}/{total}] {rate:.1f} itens/s")
+        sys.stdout.flush()
+        if done >= total:
+            sys.stdout.write("\n")
+
+    return _print
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Gera embeddings do cardápio (incremental).")
+    parser.add_argument("--batch-size", type=int, default=settings.embed_batch_size)
+    parser.add_argument("--concurrency", type=int, default=settings.embed_concurrency)
+    args = parser.parse_args()
+
     with get_db() as db:
         saipos = SaiposClient(settings.saipos_base_url, settings.saipos_partner_id, settings.saipos_partner_secret, settings.saipos_token_ttl_seconds)
         service = MenuService(db, saipos)
-        result = service.generate_embeddings()
+        result = service.generate_embeddings(
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            progress=_progress_printer(),
+        )
+        elapsed = result.get("elapsed_seconds") or 0
+        upserted = result.get("upserted") or 0
+        throughput = upserted / elapsed if elapsed else 0.0
         print(result)
+        print(
+            f"total={result.get('total')} pulados={result.get('skipped')} gravados={upserted} "
+            f"falhas={result.get('failed')} lotes={result.get('batches')} "
+            f"tempo={elapsed:.2f}s throughput={throughput:.1f} itens/s"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+Lê os spans exportados com TRACE_EXPORTER=file e mostra onde os turnos mais lentos gastam o tempo.
+
+Calcula p50/p90/p99 dos spans raiz "turn" e, para os turnos acima do percentil escolhido, soma
+o tempo por span filho (etapas, chamadas ao modelo por iteração, tools, HTTP) comparando com a
+média de todos os turnos. Como o TRACE_SLOW_MS exporta todo turno lento, os stragglers aparecem
+mesmo com amostragem baixa (as médias gerais, não).
+
+Uso: python scripts/trace_stragglers.py traces.jsonl --percentile 99 --top 15
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Any, Dict, List
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+def _span_key(span: Dict[str, Any]) -> str:
+    if span["name"] == "llm.chat":
+        return f"llm.chat#{span['attributes'].get('iteration', '?')}"
+    return span["name"]
+
+
+def _breakdown(spans: List[Dict[str, Any]]) -> Dict[str, float]:
+    totals: Dict[str, float] = defaultdict(float)
+    for span in spans:
+        if span.get("parent_id"):
+            totals[_span_key(span)] += span["duration_ms"]
+    return totals
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", default="traces.jsonl")
+    parser.add_argument("--percentile", type=float, default=99.0)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    with open(args.path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                span = json.loads(line)
+                traces[span["trace_id"]].append(span)
+
+    roots = {
+        trace_id: root
+        for trace_id, spans in traces.items()
+        for root in spans
+        if root["name"] == "turn" and not root.get("parent_id")
+    }
+    if not roots:
+        print("nenhum span 'turn' encontrado")
+        return
+
+    durations = [root["duration_ms"] for root in roots.values()]
+    threshold = _percentile(durations, args.percentile)
+    stragglers = [trace_id for trace_id, root in roots.items() if root["duration_ms"] >= threshold]
+    print(
+        f"turnos={len(roots)} p50={_percentile(durations, 50):.0f}ms p90={_percentile(durations, 90):.0f}ms "
+        f"p{args.percentile:g}={threshold:.0f}ms stragglers={len(stragglers)}"
+    )
+
+    overall: Dict[str, float] = defaultdict(float)
+    for trace_id in roots:
+        for key, value in _breakdown(traces[trace_id]).items():
+            overall[key] += value / len(roots)
+    slow: Dict[str, float] = defaultdict(float)
+    iterations: Dict[Any, int] = defaultdict(int)
+    for trace_id in stragglers:
+        for key, value in _breakdown(traces[trace_id]).items():
+            slow[key] += value / len(stragglers)
+        iterations[roots[trace_id]["attributes"].get("agent_iterations", "?")] += 1
+
+    print(f"iterações do agente nos stragglers: {dict(sorted(iterations.items(), key=lambda kv: str(kv[0])))}")
+    print(f"{'span':<32}{'média straggler ms':>20}{'média geral ms':>18}")
+    for key, value in sorted(slow.items(), key=lambda kv: kv[1], reverse=True)[: args.top]:
+        print(f"{key:<32}{value:>20.1f}{overall.get(key, 0.0):>18.1f}")
+    print("exemplos:", ", ".join(roots[t]["attributes"].get("lia.trace_id", t) for t in stragglers[:5]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import inspect
+from contextlib import contextmanager
+
+import pytest
+
+from app.db import crud
+
+
+class FakeDb:
+    """Session falsa dos workers de fila: commit/rollback contados e savepoint sem efeito."""
+
+    def __init__(self):
+        self.info = {}
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    @contextmanager
+    def begin_nested(self):
+        yield
+
+
+class FakeEvolution:
+    """Evolution falso: as `fail` primeiras chamadas falham como um 502; as demais ficam em `sent`."""
+
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.sent = []
+
+    def send_text(self, instance, number, text, delay=4000, base_url=None):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("Evolution send_text failed: 502")
+        self.sent.append((instance, number, text, delay, base_url))
+        return {"ok": True}
+
+
+@pytest.fixture
+def db():
+    return FakeDb()
+
+
+@pytest.fixture
+def db_factory():
+    @contextmanager
+    def factory():
+        yield FakeDb()
+
+    return factory
+
+
+@pytest.fixture
+def fake_evolution():
+    return FakeEvolution
+
+
+@pytest.fixture
+def record_crud(monkeypatch):
+    """
+    Troca uma função de app.db.crud por um gravador: `record_crud("update_order_status")` devolve a lista
+    de chamadas, cada uma com os argumentos nomeados (defaults aplicados, sem o db); `returns` é o retorno.
+    """
+
+    def patch(name, returns=None):
+        calls = []
+        signature = inspect.signature(getattr(crud, name))
+
+        def fake(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            calls.append({key: value for key, value in bound.arguments.items() if key != "db"})
+            return returns
+
+        monkeypatch.setattr(crud, name, fake)
+        return calls
+
+    return patch
+
+
+@pytest.fixture
+def outbox_row():
+    def row(**overrides):
+        return {"id": 7, "order_id": "1700000000000123", "audit_id": 3, "payload": {"order_id": "1700000000000123"}, "attempts": 1, **overrides}
+
+    return row
+
+
+@pytest.fixture
+def status_event_row():
+    def row(**overrides):
+        return {
+            "id": 9,
+            "order_id": "1700000000000123",
+            "event": "DISPATCHED",
+            "telefone": "5547999990001",
+            "nome": "Ana",
+            "payload": {},
+            "attempts": 1,
+            **overrides,
+        }
+
+    return row
+
+
+@pytest.fixture
+def outbound_row():
+    def row(**overrides):
+        return {"id": 5, "telefone": "5547999990001", "instance": "inst1", "base_url": "", "text": "oi", "attempts": 1, **overrides}
+
+    return row
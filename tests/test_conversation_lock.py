@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+
+import pytest
+
+from app.db import crud
+from app.services import conversation_lock as cl
+from app.settings import settings
+
+
+class _ActiveSessions:
+    """
+    active_sessions em memória atrás de um `db` fake: o crud.patch_cart de verdade faz o
+    read-modify-write (SELECT cart_json → merge → UPDATE) e a leitura demora, como numa réplica ocupada.
+    """
+
+    def __init__(self, delay=0.002):
+        self.carts = {}
+        self.delay = delay
+        self.info = {}
+
+    def execute(self, sql, params=None):
+        statement = str(sql)
+        if "SELECT cart_json" in statement:
+            cart = self.carts.get(params["session_id"])
+            time.sleep(self.delay)
+            return _Result({"cart_json": dict(cart)} if cart is not None else None)
+        if "UPDATE public.active_sessions" in statement and "cart_json" in statement:
+            self.carts[params["session_id"]] = json.loads(params["cart_json"])
+            return _Result(None)
+        raise AssertionError(statement)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _Result:
+    def __init__(self, row):
+        self.row = row
+
+    def mappings(self):
+        return self
+
+    def first(self):
+        return self.row
+
+
+def _run_turns(db, phones, turns, guard):
+    barrier = threading.Barrier(len(phones) * turns)
+
+    def _turn(telefone, n):
+        barrier.wait()
+        with guard(telefone):
+            crud.patch_cart(db, telefone, {f"item-{n}": 1})
+
+    threads = [threading.Thread(target=_turn, args=(p, n)) for p in phones for n in range(turns)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_stress_no_lost_cart_updates_per_phone(monkeypatch):
+    monkeypatch.setattr(settings, "conversation_pg_lock", False)
+    phones = [f"55479999900{i:02d}" for i in range(6)]
+
+    unguarded = _ActiveSessions()
+    _run_turns(unguarded, phones, 8, lambda telefone: threading.Lock())
+    assert any(len(unguarded.carts[p]) < 8 for p in phones)
+
+    db = _ActiveSessions()
+    _run_turns(db, phones, 8, cl.conversation_lock)
+    assert all(sorted(db.carts[p]) == sorted(f"item-{n}" for n in range(8)) for p in phones)
+    assert len(cl._local_locks) == 0
+
+
+def test_different_phones_run_in_parallel(monkeypatch):
+    monkeypatch.setattr(settings, "conversation_pg_lock", False)
+    phones = [f"55479999901{i:02d}" for i in range(4)]
+    db = _ActiveSessions()
+    started = time.monotonic()
+    _run_turns(db, phones, 3, cl.conversation_lock)
+    elapsed = time.monotonic() - started
+    # 3 turnos seriais de ~2ms por telefone; serializar tudo levaria 12 turnos
+    assert all(len(db.carts[p]) == 3 for p in phones)
+    assert elapsed < 0.5
+
+
+def test_pg_lock_waits_for_other_replica_and_unlocks(monkeypatch):
+    monkeypatch.setattr(settings, "conversation_pg_lock", True)
+    attempts = {"n": 0}
+    unlocked = []
+    isolation = []
+
+    def _try(conn, telefone):
+        attempts["n"] += 1
+        return attempts["n"] >= 3
+
+    class _Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execution_options(self, **options):
+            isolation.append(options.get("isolation_level"))
+            return self
+
+    class _Engine:
+        def connect(self):
+            return _Conn()
+
+    monkeypatch.setattr(crud, "try_conversation_lock", _try)
+    monkeypatch.setattr(crud, "conversation_unlock", lambda conn, telefone: unlocked.append(telefone))
+
+    with cl.conversation_lock("5547999990000", timeout=2, engine=_Engine()):
+        pass
+    assert attempts["n"] == 3
+    assert unlocked == ["5547999990000"]
+    assert isolation == ["AUTOCOMMIT"]
+
+    monkeypatch.setattr(crud, "try_conversation_lock", lambda conn, telefone: False)
+    with pytest.raises(cl.ConversationBusy):
+        with cl.conversation_lock("5547999990000", timeout=0.1, engine=_Engine()):
+            pass
+
+
+def test_pg_lock_uses_dedicated_pool_and_reports_exhaustion(monkeypatch):
+    from sqlalchemy import exc
+
+    monkeypatch.setattr(settings, "conversation_pg_lock", True)
+
+    class _Exhausted:
+        def connect(self):
+            raise exc.TimeoutError("lock pool exhausted")
+
+    monkeypatch.setattr(cl, "get_lock_engine", lambda: _Exhausted())
+    with pytest.raises(cl.ConversationBusy):
+        with cl.conversation_lock("5547999990009", timeout=0.1):
+            pass
+    assert len(cl._local_locks) == 0
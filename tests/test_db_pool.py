@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app.db import session
+
+
+def test_timed_pool_reports_in_use_and_timeouts(monkeypatch, tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=session.TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    monkeypatch.setattr(session, "_engine", engine)
+    session.pool_stats.reset()
+
+    conn = engine.connect()
+    metrics = session.pool_metrics()
+    assert metrics["in_use"] == 1 and metrics["checkouts"] == 1
+
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    conn.close()
+
+    metrics = session.pool_metrics()
+    assert metrics["in_use"] == 0 and metrics["idle"] == 1
+    assert metrics["timeouts"] == 1
+    assert metrics["wait_ms_max"] >= 50
+    engine.dispose()
+
+
+def test_connect_args_set_statement_timeout(monkeypatch):
+    monkeypatch.setattr(session.settings, "db_statement_timeout_ms", 2500)
+    args = session._connect_args()
+    assert args["options"] == "-c statement_timeout=2500"
+    assert args["keepalives"] == 1
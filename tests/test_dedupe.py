@@ -0,0 +1,45 @@
+import random
+
+from app.utils.dedupe import DuplicateMessageFilter, LruIdFilter, RotatingBloomFilter
+
+
+def test_lru_filter_evicts_oldest():
+    lru = LruIdFilter(max_size=2)
+    lru.add(("5547", "a"))
+    lru.add(("5547", "b"))
+    assert ("5547", "a") in lru
+    lru.add(("5547", "c"))
+    assert ("5547", "b") not in lru
+    assert ("5547", "a") in lru and ("5547", "c") in lru
+
+
+def test_rotating_bloom_keeps_recent_generation():
+    bloom = RotatingBloomFilter(capacity=100, error_rate=0.01)
+    for i in range(100):
+        bloom.add(("5547", str(i)))
+    assert all(("5547", str(i)) in bloom for i in range(100))
+    for i in range(100, 200):
+        bloom.add(("5547", str(i)))
+    assert all(("5547", str(i)) in bloom for i in range(100, 200))
+    false_positives = sum(("x", str(i)) in bloom for i in range(2000))
+    assert false_positives < 100
+
+
+def test_duplicate_filter_short_circuits_hits_and_tracks_rates():
+    dedupe = DuplicateMessageFilter(LruIdFilter(100), verify_rate=0.5, rng=random.Random(1))
+    key = ("5547999999999", "msg-1")
+    assert dedupe.check(key) == (False, True)
+    dedupe.record(key, hit=False, queued=True)
+
+    outcomes = [dedupe.check(key) for _ in range(20)]
+    assert all(hit for hit, _ in outcomes)
+    verified = sum(1 for _, verify in outcomes if verify)
+    for _ in range(verified):
+        dedupe.record(key, hit=True, queued=False)
+
+    metrics = dedupe.metrics()
+    assert metrics["requests"] == 21
+    assert metrics["filtered"] == 20 - verified
+    assert metrics["db_duplicates"] == verified
+    assert metrics["false_positive_rate"] == 0.0
+    assert metrics["duplicate_rate"] == round(20 / 21, 4)
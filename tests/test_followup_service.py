@@ -0,0 +1,148 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from app.db import crud
+from app.services import followup_service
+from app.services.conversation_lock import _local_locks
+from app.settings import settings
+from app.utils.rate_limit import TokenBucket
+
+
+@contextmanager
+def _fake_db():
+    yield object()
+
+
+class _Agent:
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def run_followup(self, last_message, telefone, horario, tipo):
+        with self.tracker["lock"]:
+            self.tracker["active"] += 1
+            self.tracker["max_active"] = max(self.tracker["max_active"], self.tracker["active"])
+        time.sleep(0.02)
+        with self.tracker["lock"]:
+            self.tracker["active"] -= 1
+        return "" if telefone.endswith("9") else f"oi {telefone}"
+
+
+class _Evolution:
+    def __init__(self):
+        self.sent = []
+
+    def send_text(self, instance, number, text):
+        self.sent.append(number)
+
+
+def _setup(monkeypatch, phones):
+    tracker = {"lock": threading.Lock(), "active": 0, "max_active": 0}
+    marked, released = [], []
+    monkeypatch.setattr(settings, "conversation_pg_lock", False)
+    monkeypatch.setattr(settings, "followup_templates_enabled", False)
+    monkeypatch.setattr(
+        crud,
+        "claim_followup_candidates",
+        lambda db, limit, lease_seconds, after=None: [{"session_id": p, "last_message": "x", "last_message_type": "ai"} for p in phones],
+    )
+    monkeypatch.setattr(crud, "mark_followup_sent", lambda db, telefone, reply: marked.append(telefone))
+    monkeypatch.setattr(crud, "release_followup_claim", lambda db, telefone: released.append(telefone))
+    evolution = _Evolution()
+    service = followup_service.FollowupService(_fake_db, lambda db: _Agent(tracker), evolution, max_workers=4, send_rate=0)
+    return service, evolution, tracker, marked, released
+
+
+def test_run_once_fans_out_and_releases_unsent_claims(monkeypatch):
+    phones = [f"55479999000{i}" for i in range(10)]
+    service, evolution, tracker, marked, released = _setup(monkeypatch, phones)
+
+    result = service.run_once()
+
+    assert result["claimed"] == 10 and result["sent"] == 9 and result["empty"] == 1
+    assert sorted(evolution.sent) == sorted(marked) == phones[:9]
+    assert released == [phones[9]]
+    assert tracker["max_active"] > 1
+    assert service.metrics()["last_sent"] == 9
+
+
+def test_run_once_skips_conversation_in_progress(monkeypatch):
+    phones = ["5547999990001", "5547999990002"]
+    service, evolution, _, _, released = _setup(monkeypatch, phones)
+
+    with _local_locks.hold(phones[0]):
+        result = service.run_once()
+
+    assert result["busy"] == 1 and evolution.sent == [phones[1]]
+    assert released == [phones[0]]
+
+
+def test_run_once_pages_with_keyset_cursor_across_cycles(monkeypatch):
+    rows = [{"id": i, "session_id": f"55479999900{i:02d}", "updated_at": i, "last_message": "x", "last_message_type": "ai"} for i in range(7)]
+    service, evolution, _, _, _ = _setup(monkeypatch, [])
+    cursors = []
+
+    def claim(db, limit, lease_seconds, after=None):
+        cursors.append(after)
+        start = 0 if after is None else after[1] + 1
+        return rows[start : start + limit]
+
+    monkeypatch.setattr(crud, "claim_followup_candidates", claim)
+    monkeypatch.setattr(settings, "followup_batch_size", 3)
+    monkeypatch.setattr(settings, "followup_max_pages", 2)
+
+    first = service.run_once()
+    second = service.run_once()
+
+    assert (first["claimed"], first["pages"]) == (6, 2)
+    assert (second["claimed"], second["pages"]) == (1, 1)
+    assert cursors == [None, (2, 2), (5, 5)]
+    assert service._cursor is None
+    assert len(evolution.sent) == 7
+
+
+def test_run_once_does_not_overlap(monkeypatch):
+    service, _, _, _, _ = _setup(monkeypatch, [])
+    service._running.acquire()
+    try:
+        assert service.run_once() == {"status": "already_running"}
+    finally:
+        service._running.release()
+    assert service.metrics()["overlaps_skipped"] == 1
+
+
+def test_templates_replace_llm_for_clear_states(monkeypatch):
+    phones = ["5547999990001", "5547999990002"]
+    service, evolution, tracker, _, _ = _setup(monkeypatch, phones)
+    monkeypatch.setattr(settings, "followup_templates_enabled", True)
+    carts = {
+        phones[0]: {"itens": [{"nome": "X Salada"}], "tipo_entrega": "entrega"},
+        phones[1]: {"itens": [{"nome": "X Bacon"}], "pendencias": [{"nome": "X Tudo"}]},
+    }
+    monkeypatch.setattr(
+        crud,
+        "claim_followup_candidates",
+        lambda db, limit, lease_seconds, after=None: [
+            {"session_id": p, "last_message": "Anotado!", "last_message_type": "ai", "cart_json": carts[p]} for p in phones
+        ],
+    )
+
+    assert service.run_once()["sent"] == 2
+    metrics = service.metrics()
+    assert metrics["template_renders"] == 1 and metrics["llm_calls"] == 1
+    assert metrics["llm_ratio"] == 0.5
+
+
+def test_token_bucket_spaces_sends():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    bucket = TokenBucket(2.0, burst=2, clock=lambda: now[0], sleep=sleep)
+    waits = [bucket.acquire() for _ in range(5)]
+
+    assert waits[:2] == [0.0, 0.0]
+    assert [round(w, 3) for w in waits[2:]] == [0.5, 0.5, 0.5]
@@ -0,0 +1,29 @@
+from app.services.followup_templates import classify_followup, render_followup
+
+
+def _row(cart=None, last_message="Anotado!", last_type="ai"):
+    return {"session_id": "5547999990001", "last_message": last_message, "last_message_type": last_type, "cart_json": cart}
+
+
+def test_classify_followup_by_cart_state():
+    itens = [{"nome": "X Salada"}]
+    assert classify_followup(_row(None, last_type="human")) == "cart_empty"
+    assert classify_followup(_row({"itens": itens})) == "delivery_type_missing"
+    assert classify_followup(_row({"itens": itens}, last_type="human")) == "items_pending"
+    assert classify_followup(_row({"itens": itens, "tipo_entrega": "entrega"})) == "address_missing"
+    assert classify_followup(_row({"itens": itens, "tipo_entrega": "retirada"})) == "payment_missing"
+    assert classify_followup(_row({"itens": itens, "tipo_entrega": "retirada", "pagamento": "pix"})) == "confirm_order"
+    assert classify_followup(_row({"itens": itens}, "A chave PIX é 09103543000109, pode me enviar o comprovante?")) == "awaiting_payment"
+
+
+def test_ambiguous_cases_go_to_llm():
+    assert classify_followup(_row({"itens": [{"nome": "X"}], "pendencias": [{"nome": "Y"}]})) is None
+    assert classify_followup(_row(None, "Quer incluir alguma bebida junto com o lanche?")) is None
+    assert render_followup(_row(None, "Qual sabor?")) == (None, None)
+
+
+def test_render_followup_fills_item_names():
+    cart = '{"itens": [{"nome": "X Salada"}, {"nome": "Coca-Cola Lata"}, {"nome": "Batata"}], "tipo_entrega": "entrega"}'
+    state, text = render_followup(_row(cart))
+    assert state == "address_missing"
+    assert "X Salada, Coca-Cola Lata e mais 1" in text
@@ -0,0 +1,36 @@
+import hashlib
+import json
+
+import pytest
+
+from app.utils.json_stream import iter_json_array_items
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+ITEMS = [
+    {"codigo_saipos": "100", "item": "Pão de queijo", "price": 12.5},
+    {"codigo_saipos": "200", "item": "Açaí 500ml", "price": 1e2, "tags": ["doce", {"x": None}]},
+    {"codigo_saipos": "300", "item": "Suco \"natural\"", "price": 7},
+]
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64, 100000])
+def test_iter_json_array_items_handles_any_chunking(size):
+    data = json.dumps({"meta": {"page": 1}, "items": ITEMS, "total": 3}, ensure_ascii=False).encode()
+    assert list(iter_json_array_items(_chunks(data, size))) == ITEMS
+
+
+def test_iter_json_array_items_top_level_array_and_hash():
+    data = json.dumps(ITEMS).encode()
+    hasher = hashlib.sha256()
+    assert list(iter_json_array_items(_chunks(data, 5), hasher=hasher)) == ITEMS
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_iter_json_array_items_without_array_yields_nothing():
+    assert list(iter_json_array_items([b'{"error": "x"}'])) == []
+    with pytest.raises(ValueError):
+        list(iter_json_array_items([b'[{"a": 1},']))
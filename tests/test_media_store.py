@@ -0,0 +1,54 @@
+import base64
+import os
+import time
+
+import pytest
+
+from app.services import pix_validator
+from app.services.media_store import MediaStore
+from app.settings import settings
+
+
+def test_media_store_round_trip_and_dedupe(tmp_path):
+    store = MediaStore(tmp_path)
+    raw = os.urandom(300_000)
+    media_id = store.put_base64("data:image/png;base64," + base64.b64encode(raw).decode(), "image/png")
+    assert store.put(memoryview(raw), "image/png") == media_id
+    assert store.get_bytes(media_id) == raw
+    assert store.meta(media_id) == {"mime_type": "image/png", "size": len(raw)}
+    assert store.data_url(media_id).startswith("data:image/png;base64,")
+    assert len(list(tmp_path.glob("*/*"))) == 2
+
+
+def test_media_store_purges_old_files(tmp_path):
+    store = MediaStore(tmp_path, ttl_seconds=60)
+    media_id = store.put(b"comprovante", "image/jpeg")
+    assert store.purge(older_than_seconds=60, now=time.time() + 120) == 1
+    assert not list(tmp_path.glob("*/*"))
+    assert media_id
+
+
+def test_validate_pix_receipt_reads_media_by_reference(tmp_path, monkeypatch):
+    store = MediaStore(tmp_path)
+    media_id = store.put(b"\xff\xd8fake-jpeg", "image/jpeg")
+    monkeypatch.setattr(pix_validator, "get_media_store", lambda: store)
+    monkeypatch.setattr(pix_validator.settings, "openai_api_key", "")
+
+    assert pix_validator.validate_pix_receipt(media_id=media_id) == {"valid": True, "reason": "no_api_key"}
+    assert pix_validator.validate_pix_receipt(media_id="0" * 64) == {"error": "media_not_found"}
+
+
+def test_media_store_purges_orphan_uploads_and_requires_dir_when_shared(tmp_path, monkeypatch):
+    store = MediaStore(tmp_path)
+    orphan = tmp_path / ".upload-abc"
+    orphan.write_bytes(b"meia escrita")
+    store.put(b"comprovante", "image/jpeg")
+
+    store.purge(older_than_seconds=10**6, now=time.time() + 7200)
+    assert not orphan.exists()
+    assert len(list(tmp_path.glob("*/*"))) == 2
+
+    monkeypatch.setattr(settings, "media_store_dir", "")
+    with pytest.raises(ValueError):
+        MediaStore(shared=True)
+    assert MediaStore(tmp_path / "vol", shared=True).root == tmp_path / "vol"
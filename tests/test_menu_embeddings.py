@@ -0,0 +1,80 @@
+import json
+
+import httpx
+
+from app.db import crud
+from app.services.embedding_client import EmbeddingClient
+from app.services.menu_service import MenuService, embedding_content_hash
+
+
+def _fake_transport(calls):
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content.decode())
+        calls.append(body["input"])
+        data = [{"index": i, "embedding": [float(len(t)), 1.0]} for i, t in enumerate(body["input"])]
+        return httpx.Response(200, json={"data": data})
+
+    return httpx.MockTransport(handler)
+
+
+def test_embed_batch_preserves_order():
+    calls = []
+    client = httpx.Client(transport=_fake_transport(calls))
+    embedder = EmbeddingClient("KEY", "model", client=client)
+    vectors = embedder.embed_batch(["a", "bbb"])
+    assert vectors == [[1.0, 1.0], [3.0, 1.0]]
+    assert calls == [["a", "bbb"]]
+
+
+def test_embed_batch_retries_on_429():
+    attempts = {"n": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts["n"] += 1
+        if attempts["n"] == 1:
+            return httpx.Response(429, json={"error": "rate_limited"})
+        return httpx.Response(200, json={"data": [{"index": 0, "embedding": [0.5]}]})
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    embedder = EmbeddingClient("KEY", "model", client=client, max_retries=3)
+    assert embedder.embed_batch(["x"]) == [[0.5]]
+    assert attempts["n"] == 2
+
+
+def test_generate_embeddings_skips_unchanged_and_batches(monkeypatch):
+    items = [
+        {"pdv": "1", "display_name": "X Salada", "category": "Lanches", "price": 10},
+        {"pdv": "2", "display_name": "X Bacon", "category": "Lanches", "price": 12},
+        {"pdv": "3", "display_name": "Coca Lata", "category": "Bebidas", "price": 6},
+        {"pdv": "3", "display_name": "Coca Lata", "category": "Bebidas", "price": 6},
+    ]
+    upserted = []
+    monkeypatch.setattr(crud, "fetch_menu_catalog", lambda db: items)
+    monkeypatch.setattr(
+        crud,
+        "fetch_menu_embedding_hashes",
+        lambda db: {"1": embedding_content_hash("X Salada", "Lanches", "model"), "2": embedding_content_hash("X Bacon", "Lanches", "old-model")},
+    )
+    monkeypatch.setattr(crud, "upsert_menu_embeddings", lambda db, rows: upserted.extend(rows))
+
+    class _BatchEmbedder(EmbeddingClient):
+        def __init__(self):
+            super().__init__("KEY", "model")
+            self.batches = []
+
+        def embed_batch(self, texts, client=None):
+            self.batches.append(list(texts))
+            return [[0.1, 0.2] for _ in texts]
+
+    embedder = _BatchEmbedder()
+    service = MenuService(db=object(), saipos_client=None, embedder=embedder)
+    progress = []
+    result = service.generate_embeddings(batch_size=1, concurrency=2, progress=lambda d, t: progress.append((d, t)))
+
+    assert result["total"] == 3
+    assert result["skipped"] == 1
+    assert result["upserted"] == 2
+    assert result["batches"] == 2
+    assert sorted(r["pdv"] for r in upserted) == ["2", "3"]
+    assert upserted[0]["embedding"] == "[0.1,0.2]"
+    assert progress[-1] == (2, 2)
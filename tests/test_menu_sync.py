@@ -0,0 +1,217 @@
+import httpx
+
+from app.db import crud
+from app.services import saipos_client
+from app.services.menu_service import MenuService
+from app.services.saipos_client import SaiposClient
+from app.services.saipos_token_cache import SaiposTokenCache
+
+
+class _Saipos:
+    def __init__(self, items):
+        self.items = items
+
+    def fetch_catalog(self):
+        return {"items": self.items}
+
+
+CATALOG = [
+    {"codigo_saipos": "100", "item": "X Salada", "price": "28", "item_type": "product"},
+    {"codigo_saipos": "100.1", "id_store_choice": 7, "item": "Bacon", "price": "4", "item_type": "addition"},
+    {"codigo_saipos": "200", "item": "Coca Lata", "price": "7", "item_type": "product"},
+]
+
+
+def _existing(service, items):
+    return [{**service._map_row(row), "id": idx + 1} for idx, row in enumerate(items)]
+
+
+def test_diff_menu_detects_insert_update_delete():
+    service = MenuService(db=object(), saipos_client=None)
+    existing = _existing(service, CATALOG)
+    novo = [
+        {**CATALOG[0], "price": "30"},
+        CATALOG[1],
+        {"codigo_saipos": "300", "item": "Suco", "price": "10", "item_type": "product"},
+    ]
+    rows = [service._map_row(r) for r in novo]
+    inserts, updates, delete_ids = service.diff_menu(rows, existing)
+    assert [r["codigo_saipos"] for r in inserts] == ["300"]
+    assert [(r["codigo_saipos"], r["id"]) for r in updates] == [("100", 1)]
+    assert delete_ids == [3]
+
+
+def test_sync_menu_skips_write_when_unchanged(monkeypatch):
+    service = MenuService(db=object(), saipos_client=_Saipos(CATALOG))
+    existing = _existing(service, CATALOG)
+    applied = []
+    monkeypatch.setattr(crud, "fetch_saipos_menu_hashes", lambda db, client_id: existing)
+    monkeypatch.setattr(crud, "fetch_menu_version", lambda db, client_id: 4)
+    monkeypatch.setattr(crud, "apply_saipos_menu_diff", lambda *a, **k: applied.append(a) or 5)
+
+    result = service.sync_menu()
+    assert result["changed"] is False
+    assert result["menu_version"] == 4
+    assert result["unchanged"] == 3
+    assert applied == []
+
+
+def test_sync_menu_applies_diff_and_bumps_version(monkeypatch):
+    service = MenuService(db=object(), saipos_client=_Saipos(CATALOG))
+    existing = _existing(service, CATALOG[:2])
+    applied = {}
+
+    def _apply(db, client_id, inserts, updates, delete_ids):
+        applied.update(inserts=inserts, updates=updates, delete_ids=delete_ids)
+        return 5
+
+    monkeypatch.setattr(crud, "fetch_saipos_menu_hashes", lambda db, client_id: existing)
+    monkeypatch.setattr(crud, "apply_saipos_menu_diff", _apply)
+
+    result = service.sync_menu()
+    assert result["changed"] is True
+    assert result["inserted"] == 1
+    assert result["menu_version"] == 5
+    assert applied["updates"] == [] and applied["delete_ids"] == []
+
+
+class _RawSaipos:
+    def __init__(self, content, status=200):
+        self.content = content
+        self.status = status
+        self.etags = []
+
+    def fetch_catalog_raw(self, etag=None):
+        self.etags.append(etag)
+        return self.status, self.content, "W/1"
+
+
+def test_sync_menu_if_changed_short_circuits_on_same_hash(monkeypatch):
+    import hashlib
+    import json
+
+    content = json.dumps({"items": CATALOG}).encode()
+    service = MenuService(db=object(), saipos_client=_RawSaipos(content))
+    monkeypatch.setattr(crud, "fetch_menu_catalog_hash", lambda db, client_id: hashlib.sha256(content).hexdigest())
+    monkeypatch.setattr(crud, "fetch_saipos_menu_hashes", lambda *a: (_ for _ in ()).throw(AssertionError("db touched")))
+
+    result = service.sync_menu_if_changed()
+    assert result["skipped"] is True
+    assert result["reason"] == "same_hash"
+    assert result["payload_bytes"] == len(content)
+
+
+def test_menu_sync_job_records_skip_and_respects_lock(monkeypatch):
+    from contextlib import contextmanager
+
+    from app.services.menu_sync_service import MenuSyncService
+
+    class _Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def commit(self):
+            return None
+
+    class _Engine:
+        def connect(self):
+            return _Conn()
+
+    @contextmanager
+    def _db():
+        yield object()
+
+    locked = {"value": True}
+    monkeypatch.setattr(crud, "try_advisory_lock", lambda conn, name: locked["value"])
+    monkeypatch.setattr(crud, "advisory_unlock", lambda conn, name: None)
+    monkeypatch.setattr(
+        MenuService,
+        "sync_menu_if_changed",
+        lambda self, etag=None: {"skipped": True, "reason": "same_hash", "payload_bytes": 10, "etag": "W/1"},
+    )
+
+    job = MenuSyncService(_db, lambda: None, engine=_Engine())
+    result = job.run_once()
+    assert result["skipped"] is True
+    assert job.stats["runs"] == 1 and job.stats["skipped"] == 1
+    assert job.skip_rate() == 1.0
+    assert job._etag == "W/1"
+
+    locked["value"] = False
+    assert job.run_once()["status"] == "locked_elsewhere"
+    assert job.stats["lock_busy"] == 1
+
+
+def test_sync_menu_streaming_copies_in_chunks(monkeypatch):
+    class _StreamSaipos:
+        def stream_catalog(self, hasher=None, etag=None, meta=None):
+            hasher.update(b"catalogo")
+            yield from CATALOG
+
+    class _Db:
+        rolled_back = 0
+
+        def rollback(self):
+            self.rolled_back += 1
+
+    copied = []
+    monkeypatch.setattr(crud, "create_saipos_menu_stage", lambda db: None)
+    monkeypatch.setattr(crud, "copy_saipos_menu_stage", lambda db, rows: copied.append(len(rows)))
+    monkeypatch.setattr(crud, "fetch_menu_catalog_hash", lambda db, client_id: None)
+    monkeypatch.setattr(
+        crud,
+        "apply_saipos_menu_stage",
+        lambda db, client_id, catalog_hash=None: {"inserted": 1, "updated": 0, "deleted": 0, "total": 3, "version": 2},
+    )
+
+    db = _Db()
+    result = MenuService(db=db, saipos_client=_StreamSaipos()).sync_menu_streaming(chunk_size=2)
+    assert copied == [2, 1]
+    assert result["total"] == 3 and result["inserted"] == 1 and result["menu_version"] == 2
+    assert result["changed"] is True and db.rolled_back == 0
+
+
+def test_sync_menu_streaming_sends_etag_and_stops_on_304(monkeypatch):
+    requests = []
+
+    def handler(request):
+        if request.url.path == "/auth":
+            return httpx.Response(200, json={"token": "tok"})
+        requests.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"items": CATALOG}, headers={"etag": '"v1"'})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(saipos_client, "http_client", lambda name, timeout=None: httpx.Client(transport=transport, timeout=timeout))
+    monkeypatch.setattr(crud, "create_saipos_menu_stage", lambda db: None)
+    monkeypatch.setattr(crud, "copy_saipos_menu_stage", lambda db, rows: None)
+    monkeypatch.setattr(crud, "fetch_menu_catalog_hash", lambda db, client_id: None)
+    applied = []
+    monkeypatch.setattr(
+        crud,
+        "apply_saipos_menu_stage",
+        lambda db, client_id, catalog_hash=None: applied.append(catalog_hash)
+        or {"inserted": 3, "updated": 0, "deleted": 0, "total": 3, "version": 1},
+    )
+
+    class _Db:
+        rolled_back = 0
+
+        def rollback(self):
+            self.rolled_back += 1
+
+    client = SaiposClient("https://saipos.test", "partner", "secret", token_cache=SaiposTokenCache(shared=False))
+    db = _Db()
+    service = MenuService(db=db, saipos_client=client)
+
+    first = service.sync_menu_streaming()
+    assert first["etag"] == '"v1"' and first["payload_bytes"] > 0 and len(applied) == 1
+
+    again = service.sync_menu_streaming(etag=first["etag"])
+    assert again == {"skipped": True, "reason": "not_modified", "total": 0, "payload_bytes": 0, "etag": '"v1"'}
+    assert requests == [None, '"v1"']
+    assert len(applied) == 1 and db.rolled_back == 1
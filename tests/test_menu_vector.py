@@ -0,0 +1,67 @@
+import pytest
+
+from app.services.order_interpreter.menu_matcher import MenuMatcher
+from app.services.order_interpreter.vector_index import NumpyVectorIndex, QueryEmbeddingCache
+
+pytest.importorskip("numpy")
+
+
+class _FakeEmbedder:
+    VECTORS = {
+        "coca-cola 2 litros": [1.0, 0.0, 0.0],
+        "x salada": [0.0, 1.0, 0.0],
+        "refri de cola grande": [0.95, 0.05, 0.1],
+        "algo aleatorio": [0.0, 0.0, 1.0],
+    }
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, text):
+        self.calls += 1
+        return self.VECTORS.get(text.lower(), [0.0, 0.0, 0.0])
+
+
+MENU = [
+    {"item_type": "product", "fingerprint": "cocacola2litros", "pdv": "201", "nome_original": "Coca-Cola 2 Litros", "price": "16"},
+    {"item_type": "product", "fingerprint": "xsalada", "pdv": "101", "nome_original": "X Salada", "price": "28"},
+]
+
+
+def _index(embedder):
+    cache = QueryEmbeddingCache(embedder, max_size=8)
+    return NumpyVectorIndex(["201", "101"], [embedder.VECTORS["coca-cola 2 litros"], embedder.VECTORS["x salada"]], cache)
+
+
+def test_numpy_index_top_k_and_query_cache():
+    embedder = _FakeEmbedder()
+    index = _index(embedder)
+    hits = index.search("Refri de cola  grande", k=2)
+    assert [pdv for pdv, _ in hits] == ["201", "101"]
+    assert hits[0][1] > 0.9
+    index.search("refri de cola grande", k=1)
+    assert embedder.calls == 1
+    assert index.query_cache.hits == 1
+
+
+def test_menu_matcher_vector_layer_resolves_miss():
+    embedder = _FakeEmbedder()
+    matcher = MenuMatcher(db=None, vector_index=_index(embedder))
+    matcher._menu_cache = MENU
+    match, _ = matcher.match("refri de cola grande")
+    assert match is not None
+    assert match.pdv == "201"
+
+    baseline = MenuMatcher(db=None)
+    baseline._menu_cache = MENU
+    match, _ = baseline.match("refri de cola grande")
+    assert match is None
+
+
+def test_menu_matcher_vector_below_threshold_becomes_suggestion():
+    embedder = _FakeEmbedder()
+    matcher = MenuMatcher(db=None, vector_index=_index(embedder))
+    matcher._menu_cache = MENU
+    match, sugestoes = matcher.match("algo aleatorio")
+    assert match is None
+    assert len(sugestoes) <= 3
@@ -0,0 +1,144 @@
+import httpx
+import pytest
+
+from app.db import crud
+from app.services import llm_agent
+from app.utils import metrics
+from app.utils.http_client import HTTP_CLIENT_SECONDS, InstrumentedTransport, _env_proxy_mounts, http_client
+from app.utils.metrics import MetricsRegistry, StageTimer, dict_collector, timed
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    hist = registry.histogram("t_seconds", "teste", ("stage",), buckets=(0.1, 1.0))
+    hist.observe(0.05, stage="agent")
+    hist.observe(0.5, stage="agent")
+    hist.observe(5.0, stage="agent")
+
+    body = registry.render()
+    assert "# TYPE t_seconds histogram" in body
+    assert 't_seconds_bucket{stage="agent",le="0.1"} 1' in body
+    assert 't_seconds_bucket{stage="agent",le="1.0"} 2' in body
+    assert 't_seconds_bucket{stage="agent",le="+Inf"} 3' in body
+    assert 't_seconds_count{stage="agent"} 3' in body
+    assert 't_seconds_sum{stage="agent"} 5.55' in body
+
+
+def test_label_values_beyond_cap_fall_into_overflow(monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_SERIES", 2)
+    counter = MetricsRegistry().counter("t_total", "teste", ("fn",))
+    for name in ("a", "b", "c", "d"):
+        counter.inc(fn=name)
+
+    assert counter.value(fn="a") == 1
+    assert counter.value(fn="c") == 0
+    assert counter.value(fn="other") == 2
+
+
+def test_timed_observes_calls_that_raise():
+    hist = MetricsRegistry().histogram("t_seconds", "teste", ("fn",))
+
+    @timed(hist, fn="boom")
+    def boom():
+        raise RuntimeError("x")
+
+    with pytest.raises(RuntimeError):
+        boom()
+    assert hist.count(fn="boom") == 1
+
+
+def test_stage_timer_observes_each_lap():
+    hist = MetricsRegistry().histogram("t_seconds", "teste", ("stage",))
+    stages = StageTimer(hist)
+    stages.lap("ingest")
+    stages.lap("agent")
+    assert hist.count(stage="ingest") == 1
+    assert hist.count(stage="agent") == 1
+
+
+def test_dict_collector_exposes_only_numbers():
+    registry = MetricsRegistry()
+    registry.add_collector(dict_collector("lia_x", lambda: {"sent": 3, "running": True, "tables": {"a": 1}}))
+    body = registry.render()
+    assert "lia_x_sent 3" in body
+    assert "lia_x_running 1" in body
+    assert "lia_x_tables" not in body
+
+
+def test_instrumented_transport_labels_by_status_class():
+    transport = InstrumentedTransport("teste", httpx.MockTransport(lambda request: httpx.Response(503)))
+    before = HTTP_CLIENT_SECONDS.count(client="teste", method="POST", status="5xx")
+    with httpx.Client(transport=transport) as client:
+        client.post("https://example.test/x")
+    assert HTTP_CLIENT_SECONDS.count(client="teste", method="POST", status="5xx") == before + 1
+
+
+def test_crud_nested_calls_are_timed_once():
+    class _Result:
+        def mappings(self):
+            return self
+
+        def first(self):
+            return {"cart_json": {"itens": []}}
+
+    class _Db:
+        info = {}
+
+        def execute(self, sql, params=None):
+            return _Result()
+
+        def commit(self):
+            pass
+
+    assert crud.DB_CALL_SECONDS.labelnames == ("fn",)
+    assert crud.fetch_cart.__wrapped__.__name__ == "fetch_cart"
+    # só o caminho quente é medido
+    assert not hasattr(crud.get_schema_capabilities, "__wrapped__")
+
+    before = {fn: crud.DB_CALL_SECONDS.count(fn=fn) for fn in ("patch_cart", "fetch_cart", "update_cart")}
+    crud.patch_cart(_Db(), "5547999990001", {"tipo_entrega": "retirada"})
+    assert crud.DB_CALL_SECONDS.count(fn="patch_cart") == before["patch_cart"] + 1
+    assert crud.DB_CALL_SECONDS.count(fn="fetch_cart") == before["fetch_cart"]
+    assert crud.DB_CALL_SECONDS.count(fn="update_cart") == before["update_cart"]
+
+
+def test_agent_records_iterations_and_unknown_tools(monkeypatch):
+    replies = iter(
+        [
+            {"choices": [{"message": {"tool_calls": [{"id": "1", "function": {"name": "inventada", "arguments": "{}"}}]}}]},
+            {"choices": [{"message": {"content": "Olá!"}}]},
+        ]
+    )
+    monkeypatch.setattr(llm_agent, "_openai_chat", lambda *a, **k: next(replies))
+    monkeypatch.setattr(crud, "fetch_cart", lambda db, telefone: {})
+    monkeypatch.setattr(crud, "fetch_chat_history", lambda db, telefone, limit=20: [])
+    monkeypatch.setattr(crud, "increment_session_tokens", lambda *a, **k: None)
+    agent = llm_agent.LLMAgent(None, None, None, None, "prompt", "followup")
+
+    iterations_before = llm_agent.AGENT_ITERATIONS.count(result="reply")
+    unknown_before = llm_agent.AGENT_TOOL_SECONDS.count(tool="unknown", result="error")
+    assert agent.run("oi", "5547999999999", "", {}) == "Olá!"
+    assert llm_agent.AGENT_ITERATIONS.count(result="reply") == iterations_before + 1
+    assert llm_agent.AGENT_TOOL_SECONDS.count(tool="unknown", result="error") == unknown_before + 1
+    assert llm_agent.AGENT_LLM_SECONDS.count(iteration=2) >= 1
+
+
+def test_http_client_keeps_environment_proxies(monkeypatch):
+    for var in ("HTTP_PROXY", "http_proxy", "ALL_PROXY", "all_proxy", "no_proxy"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.internal:3128")
+    monkeypatch.setenv("NO_PROXY", "evolution.local,10.0.0.5")
+
+    mounts = _env_proxy_mounts("teste", None)
+    assert set(mounts) == {"https://", "all://*evolution.local", "all://10.0.0.5"}
+    assert isinstance(mounts["https://"], InstrumentedTransport)
+    assert mounts["all://*evolution.local"] is None
+    with http_client("teste"):
+        pass
+
+    monkeypatch.setenv("NO_PROXY", "*")
+    assert _env_proxy_mounts("teste", None) == {}
+
+def test_metric_base_requires_render():
+    with pytest.raises(TypeError):
+        metrics._Metric("x", "teste")
@@ -0,0 +1,160 @@
+import httpx
+import pytest
+from tenacity import wait_none
+
+from app.db import crud
+from app.services import order_dispatcher, order_service
+from app.services.order_dispatcher import OrderDispatcher, is_retryable
+from app.settings import settings
+
+
+def _status_error(code):
+    request = httpx.Request("POST", "https://saipos.test/order")
+    return httpx.HTTPStatusError("erro", request=request, response=httpx.Response(code, request=request))
+
+
+class _Saipos:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def send_order(self, payload):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def saipos_crud(monkeypatch, record_crud):
+    monkeypatch.setattr(settings, "saipos_dry_run", False)
+    return {
+        "outbox": record_crud("complete_order_outbox", returns=0.25),
+        "audit": record_crud("update_order_audit_saipos"),
+        "order": record_crud("update_order_status"),
+    }
+
+
+def test_is_retryable_only_for_transient_errors():
+    assert is_retryable(httpx.ConnectTimeout("timeout"))
+    assert is_retryable(_status_error(503)) and is_retryable(_status_error(429))
+    assert not is_retryable(_status_error(400))
+    assert not is_retryable(ValueError("payload"))
+
+
+def test_dispatch_retries_transient_errors_then_records_success(db, saipos_crud, outbox_row):
+    saipos = _Saipos(httpx.ConnectTimeout("t"), _status_error(502), {"ok": True})
+    dispatcher = OrderDispatcher(None, None, attempts_per_dispatch=4, wait=wait_none())
+
+    assert dispatcher.dispatch(db, saipos, outbox_row()) == "sent"
+    assert saipos.calls == 3
+    assert [(c["status"], c["retry_in_seconds"]) for c in saipos_crud["outbox"]] == [("sent", 0)]
+    assert saipos_crud["audit"][0]["status"] == "sent"
+    assert saipos_crud["order"] == [{"order_id": "1700000000000123", "status": "created", "response": {"ok": True}}]
+    metrics = dispatcher.metrics()
+    assert metrics["retries"] == 2 and metrics["latency_ms_avg"] == 250.0
+
+
+def test_dispatch_requeues_with_backoff_then_fails(db, saipos_crud, outbox_row):
+    dispatcher = OrderDispatcher(None, None, attempts_per_dispatch=2, max_dispatches=3, wait=wait_none())
+
+    assert dispatcher.dispatch(db, _Saipos(httpx.ReadTimeout("t"), httpx.ReadTimeout("t")), outbox_row(attempts=2)) == "pending"
+    assert [(c["status"], c["retry_in_seconds"]) for c in saipos_crud["outbox"]] == [("pending", settings.order_dispatch_requeue_seconds * 2)]
+    assert saipos_crud["order"] == [] and saipos_crud["audit"] == []
+
+    assert dispatcher.dispatch(db, _Saipos(httpx.ReadTimeout("t"), httpx.ReadTimeout("t")), outbox_row(attempts=3)) == "failed"
+    assert saipos_crud["order"][-1]["status"] == "failed" and saipos_crud["audit"][-1]["status"] == "failed"
+
+
+def test_dispatch_does_not_retry_client_errors_and_accepts_duplicates(db, saipos_crud, outbox_row):
+    dispatcher = OrderDispatcher(None, None, attempts_per_dispatch=4, wait=wait_none())
+    saipos = _Saipos(_status_error(400))
+    assert dispatcher.dispatch(db, saipos, outbox_row()) == "failed"
+    assert saipos.calls == 1
+
+    assert dispatcher.dispatch(db, _Saipos(_status_error(409)), outbox_row()) == "sent"
+    assert saipos_crud["order"][-1]["response"]["status"] == "duplicate"
+
+
+def test_process_order_returns_queued_order_for_repeated_submission(monkeypatch, db):
+    monkeypatch.setattr(settings, "order_outbox_enabled", True)
+    monkeypatch.setattr(crud, "insert_order_audit", lambda db, **kwargs: 11)
+    keys = []
+
+    def enqueue(db, idempotency_key, **kwargs):
+        keys.append(idempotency_key)
+        return {"id": 1, "order_id": "1700000000000999", "created": False}
+
+    monkeypatch.setattr(crud, "enqueue_order_outbox", enqueue)
+    saipos = _Saipos()
+    service = order_service.OrderService(db, saipos)
+    pedido = {"session_id": "5547999990001", "itens": [{"pdv": "101", "nome": "X Salada", "qtd": 1, "valor_unitario": 28}], "tipo_entrega": "retirada"}
+
+    first = service.process_order(dict(pedido))
+    service.process_order(dict(pedido))
+
+    assert first["response"] == {"status": "already_queued", "order_id": "1700000000000999"}
+    assert keys[0] == keys[1]
+    assert saipos.calls == 0
+
+
+def test_failed_dispatch_notifies_customer(monkeypatch, db, saipos_crud, outbox_row):
+    sent, history = [], []
+    monkeypatch.setattr(order_dispatcher, "send_messages", lambda db, evolution, telefone, parts, **kwargs: sent.append((telefone, parts)))
+    monkeypatch.setattr(crud, "insert_chat_history", lambda db, session_id, role, content: history.append((session_id, role)))
+    dispatcher = OrderDispatcher(None, None, lambda: object(), attempts_per_dispatch=1, wait=wait_none())
+
+    row = outbox_row(telefone="5547999990001", session_id="5547999990001")
+    assert dispatcher.dispatch(db, _Saipos(_status_error(400)), row) == "failed"
+    assert saipos_crud["order"][-1]["status"] == "failed"
+    assert sent == [("5547999990001", [order_dispatcher.ORDER_FAILED_MESSAGE])]
+    assert history == [("5547999990001", "ai")]
+    assert dispatcher.metrics()["customers_notified"] == 1
+
+    # reenfileirado ainda não é falha: cliente não é avisado
+    assert dispatcher.dispatch(db, _Saipos(httpx.ReadTimeout("t")), row) == "pending"
+    assert len(sent) == 1
+
+
+def test_run_once_claims_one_order_per_lease(monkeypatch, db_factory, saipos_crud, outbox_row):
+    queue = [outbox_row(), outbox_row(id=8)]
+    claims = []
+
+    def claim(db, limit, lease_seconds):
+        claims.append((limit, lease_seconds))
+        return [queue.pop(0)] if queue else []
+
+    monkeypatch.setattr(crud, "claim_order_outbox", claim)
+
+    dispatcher = OrderDispatcher(db_factory, lambda: _Saipos({"ok": True}), attempts_per_dispatch=3, wait=wait_none())
+    assert dispatcher.run_once(limit=10) == {"claimed": 2, "outcomes": ["sent", "sent"]}
+    assert [limit for limit, _ in claims] == [1, 1, 1]
+    # o lease cobre todas as tentativas de um envio (3 x timeout + backoff)
+    assert claims[0][1] >= 3 * order_dispatcher.SEND_TIMEOUT_SECONDS
+
+
+def test_process_order_survives_audit_insert_failure(monkeypatch, db):
+    monkeypatch.setattr(settings, "order_outbox_enabled", True)
+    monkeypatch.setattr(order_service, "notify_order_dispatcher", lambda: True)
+
+    def broken_audit(db, **kwargs):
+        raise RuntimeError("order_audit indisponível")
+
+    monkeypatch.setattr(crud, "insert_order_audit", broken_audit)
+    enqueued = []
+    monkeypatch.setattr(
+        crud,
+        "enqueue_order_outbox",
+        lambda db, idempotency_key, **kwargs: enqueued.append(kwargs) or {"id": 1, "order_id": kwargs["order_id"], "created": True},
+    )
+    persisted = []
+    monkeypatch.setattr(order_service.OrderService, "_persist_order", lambda self, *args, status: persisted.append(status))
+    service = order_service.OrderService(db, _Saipos())
+    pedido = {"session_id": "5547999990001", "itens": [{"pdv": "101", "nome": "X Salada", "qtd": 1, "valor_unitario": 28}], "tipo_entrega": "retirada"}
+
+    result = service.process_order(pedido)
+
+    assert result["response"]["status"] == "queued"
+    assert enqueued[0]["audit_id"] is None
+    assert persisted == ["queued"]
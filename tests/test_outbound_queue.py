@@ -0,0 +1,83 @@
+import threading
+
+from app.db import crud
+from app.services.outbound_queue import OutboundSender, send_messages
+from app.settings import settings
+from conftest import FakeDb
+
+
+def test_send_messages_sends_inline_in_order_without_running_sender(monkeypatch, db, fake_evolution):
+    monkeypatch.setattr(OutboundSender, "_current", None)
+    monkeypatch.setattr(crud, "enqueue_outbound_messages", lambda *a, **k: (_ for _ in ()).throw(AssertionError("enfileirou")))
+    evolution = fake_evolution()
+
+    result = send_messages(db, evolution, "5547999990001", ["um", "dois"], instance="inst1", base_url="https://evo")
+
+    assert result == {"queued": 0, "sent": 2}
+    assert [s[2] for s in evolution.sent] == ["um", "dois"]
+    assert evolution.sent[0][4] == "https://evo"
+
+
+def test_send_messages_only_enqueues_when_sender_runs(monkeypatch, db, db_factory, fake_evolution):
+    sender = OutboundSender(db_factory, fake_evolution, concurrency=1)
+    sender._thread = threading.current_thread()
+    monkeypatch.setattr(OutboundSender, "_current", sender)
+    monkeypatch.setattr(settings, "outbound_queue_enabled", True)
+    enqueued = []
+    monkeypatch.setattr(
+        crud, "enqueue_outbound_messages", lambda db, telefone, parts, **kwargs: enqueued.append((telefone, parts, kwargs)) or [1, 2, 3]
+    )
+    evolution = fake_evolution()
+
+    result = send_messages(db, evolution, "5547999990001", ["a", "b", "c"], instance="inst1", source="reply")
+
+    assert result == {"queued": 3, "sent": 0}
+    assert evolution.sent == [] and enqueued[0][1] == ["a", "b", "c"]
+    assert sender._wakeup.is_set() and sender.metrics()["enqueued"] == 3
+
+
+def test_deliver_paces_number_and_retries_then_dead_letters(monkeypatch, db_factory, record_crud, fake_evolution, outbound_row):
+    completed = record_crud("complete_outbound_message", returns=0.5)
+    monkeypatch.setattr(settings, "outbound_retry_seconds", 2.0)
+    evolution = fake_evolution(fail=2)
+    sender = OutboundSender(db_factory, lambda: evolution, instance_rate=0, number_interval=1.5, max_attempts=2, typing_delay_ms=1200)
+
+    assert sender._deliver(outbound_row(attempts=1)) == "pending"
+    assert sender._deliver(outbound_row(attempts=2)) == "dead"
+    assert sender._deliver(outbound_row(attempts=1)) == "sent"
+
+    assert [(c["status"], c["retry_in_seconds"], c["pace_seconds"]) for c in completed] == [("pending", 2.0, 1.5), ("dead", 0, 1.5), ("sent", 0, 1.5)]
+    assert evolution.sent[0][3] == 1200
+    metrics = sender.metrics()
+    assert metrics["retried"] == 1 and metrics["dead"] == 1 and metrics["latency_ms_avg"] == 500.0
+
+
+def test_run_once_sends_claimed_heads_with_one_limiter_per_instance(monkeypatch, db_factory, record_crud, fake_evolution, outbound_row):
+    record_crud("complete_outbound_message", returns=0.5)
+    rows = [outbound_row(instance="a"), outbound_row(instance="b")]
+    monkeypatch.setattr(crud, "claim_outbound_messages", lambda db, limit, lease_seconds: rows)
+    evolution = fake_evolution()
+    sender = OutboundSender(db_factory, lambda: evolution, concurrency=2, instance_rate=100)
+
+    assert sender.run_once()["outcomes"] == ["sent", "sent"]
+    assert set(sender._limiters) == {"a", "b"}
+
+
+def test_claim_outbound_messages_takes_only_the_head_of_each_phone():
+    class _Rows:
+        def mappings(self):
+            return self
+
+        def all(self):
+            return []
+
+    class _CaptureDb(FakeDb):
+        def execute(self, sql, params=None):
+            self.sql, self.params = str(sql), params
+            return _Rows()
+
+    db = _CaptureDb()
+    crud.claim_outbound_messages(db, limit=4, lease_seconds=90)
+    assert "DISTINCT ON (telefone)" in db.sql and "ORDER BY telefone, id" in db.sql
+    assert "FOR UPDATE OF m SKIP LOCKED" in db.sql
+    assert db.params == {"limit": 4, "lease": 90}
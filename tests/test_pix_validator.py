@@ -0,0 +1,81 @@
+import base64
+import struct
+
+from app.services import pix_validator
+from app.utils.images import image_dimensions
+
+
+def _png(width, height):
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, height) + b"\x08\x02\x00\x00\x00" + b"\x00" * 8
+
+
+def _jpeg(width, height):
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    return b"\xff\xd8" + app0 + b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+
+
+def _webp_vp8x(width, height):
+    body = b"VP8X" + struct.pack("<I", 10) + b"\x00" * 4 + (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little")
+    return b"RIFF" + struct.pack("<I", 4 + len(body)) + b"WEBP" + body
+
+
+def test_image_dimensions_from_headers():
+    assert image_dimensions(_png(1080, 2340)) == (1080, 2340)
+    assert image_dimensions(_jpeg(828, 1792)) == (828, 1792)
+    assert image_dimensions(_webp_vp8x(512, 512)) == (512, 512)
+    assert image_dimensions(b"%PDF-1.4 qualquer coisa aqui") is None
+
+
+def test_prescreen_is_inconclusive_never_invalid():
+    sticker = pix_validator.prescreen_image(_webp_vp8x(512, 512), "image/webp")
+    assert sticker["reason"] == "prescreen_sticker" and sticker["status"] == "inconclusive" and sticker["valid"] is None
+    assert pix_validator.prescreen_image(_jpeg(96, 160), "image/jpeg")["status"] == "inconclusive"
+    # paisagem sem legenda vai ao modelo
+    assert pix_validator.prescreen_image(_jpeg(4032, 3024), "image/jpeg", "olha o lanche") is None
+    assert pix_validator.prescreen_image(_png(1080, 2340), "image/png") is None
+    assert pix_validator.prescreen_image(b"%PDF-1.4", "application/pdf") is None
+
+
+def test_prescreen_sends_payment_caption_straight_to_model():
+    small = _jpeg(200, 180)
+    assert pix_validator.prescreen_image(small, "image/jpeg", "segue a foto")["status"] == "inconclusive"
+    # legenda de pagamento (pix + comprovante): miniatura ou não, quem decide é o modelo
+    assert pix_validator.prescreen_image(small, "image/jpeg", "Comprovante do PIX") is None
+    # figurinha continua inconclusiva
+    assert pix_validator.prescreen_image(_webp_vp8x(512, 512), "image/webp", "comprovante pix")["status"] == "inconclusive"
+
+
+def test_validate_pix_receipt_caches_model_verdict(monkeypatch):
+    calls = []
+
+    def fake_model(data_url, return_usage):
+        calls.append(data_url)
+        return {"valid": True, "reason": "ok", "amount": 42.0, "_usage": {"total_tokens": 10}}
+
+    monkeypatch.setattr(pix_validator.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(pix_validator, "_ask_model", fake_model)
+    monkeypatch.setattr(pix_validator, "_verdicts", pix_validator._VerdictCache(8))
+    media = base64.b64encode(_png(1080, 2340) + b"cache-test").decode()
+
+    first = pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png", return_usage=True, session_id="5547999990001")
+    second = pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png", return_usage=True, session_id="5547999990001")
+
+    assert first["_usage"] == {"total_tokens": 10}
+    assert second == {"valid": True, "reason": "ok", "amount": 42.0, "cached": True}
+    assert len(calls) == 1
+
+    # o mesmo arquivo vindo de outro cliente (ou sem sessão) vai ao modelo
+    pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png", session_id="5547999990002")
+    pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png")
+    assert len(calls) == 3
+
+
+def test_validate_pix_receipt_does_not_cache_request_errors(monkeypatch):
+    results = [{"error": "openai_request_failed", "message": "timeout"}, {"valid": False, "reason": "nao_e_pix"}]
+    monkeypatch.setattr(pix_validator.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(pix_validator, "_ask_model", lambda data_url, return_usage: results.pop(0))
+    monkeypatch.setattr(pix_validator, "_verdicts", pix_validator._VerdictCache(8))
+    media = base64.b64encode(_png(1080, 2340) + b"error-test").decode()
+
+    assert pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png", session_id="s1")["error"] == "openai_request_failed"
+    assert pix_validator.validate_pix_receipt(media_base64=media, mime_type="image/png", session_id="s1") == {"valid": False, "reason": "nao_e_pix"}
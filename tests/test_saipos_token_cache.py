@@ -0,0 +1,86 @@
+import threading
+import time
+
+import httpx
+
+from app.services import saipos_client
+from app.services.saipos_client import SaiposClient
+from app.services.saipos_token_cache import SaiposTokenCache
+
+
+def _mock_saipos(monkeypatch, expired_tokens=()):
+    calls = {"auth": 0, "order": []}
+
+    def handler(request):
+        if request.url.path == "/auth":
+            calls["auth"] += 1
+            return httpx.Response(200, json={"token": f"tok-{calls['auth']}"})
+        token = request.headers.get("Authorization")
+        calls["order"].append(token)
+        if token in expired_tokens:
+            return httpx.Response(401, json={"error": "expired"})
+        return httpx.Response(200, json={"ok": True})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(
+        saipos_client, "http_client", lambda name, timeout=None: httpx.Client(transport=transport, timeout=timeout)
+    )
+    return calls
+
+
+def test_clients_share_process_token(monkeypatch):
+    calls = _mock_saipos(monkeypatch)
+    cache = SaiposTokenCache(refresh_margin=60, shared=False)
+
+    for _ in range(3):
+        SaiposClient("https://saipos.test", "partner", "secret", token_cache=cache).send_order({"id": 1})
+
+    assert calls["auth"] == 1
+    assert calls["order"] == ["tok-1"] * 3
+    assert cache.metrics()["auth_calls_last_hour"] == 1
+
+
+def test_401_renews_token_and_retries_once(monkeypatch):
+    calls = _mock_saipos(monkeypatch, expired_tokens={"tok-1"})
+    cache = SaiposTokenCache(refresh_margin=60, shared=False)
+    client = SaiposClient("https://saipos.test", "partner", "secret", token_cache=cache)
+
+    assert client.send_order({"id": 1}) == {"ok": True}
+    assert calls["order"] == ["tok-1", "tok-2"]
+    assert cache.metrics()["retries_401"] == 1
+
+
+def test_single_flight_refresh_under_concurrency():
+    cache = SaiposTokenCache(refresh_margin=60, shared=False)
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        time.sleep(0.05)
+        return "tok"
+
+    barrier = threading.Barrier(8)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(cache.get("k", fetch, 3500))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(fetches) == 1 and results == ["tok"] * 8
+
+
+def test_refreshes_before_expiry():
+    now = [1000.0]
+    cache = SaiposTokenCache(refresh_margin=300, shared=False, clock=lambda: now[0])
+    tokens = iter(["tok-1", "tok-2"])
+
+    assert cache.get("k", lambda: next(tokens), 3500) == "tok-1"
+    now[0] += 3300  # ainda válido, mas dentro da margem
+    assert cache.get("k", lambda: next(tokens), 3500) == "tok-2"
+    assert cache.metrics()["auth_calls"] == 2
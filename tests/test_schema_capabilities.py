@@ -0,0 +1,104 @@
+import pytest
+
+from app.db import crud
+from app.db.schema import SchemaCapabilities, probe_schema, schema_metrics, set_schema_capabilities
+
+NEW_ORDERS = {"id", "order_id", "client_id", "status", "payment_method", "subtotal", "total_amount", "payload_snapshot", "updated_at"}
+LEGACY_ORDERS = {"id", "order_id", "status", "payload", "response", "cod_store", "updated_at"}
+
+
+class _Result:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def mappings(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+    def scalar_one(self):
+        return 42
+
+
+class _DB:
+    def __init__(self, responses=None):
+        self.responses = list(responses or [])
+        self.calls = []
+
+    def execute(self, sql, params=None):
+        self.calls.append((str(sql), params))
+        return _Result(self.responses.pop(0) if self.responses else ())
+
+    def commit(self):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def _reset_registry():
+    yield
+    set_schema_capabilities(None)
+
+
+def _caps(orders, unique=(("order_id",),), extensions=("unaccent",), sessions=("total_tokens", "tokens_updated_at")):
+    return SchemaCapabilities(
+        {"public.orders": orders, "public.active_sessions": sessions},
+        {"public.orders": unique},
+        extensions,
+    )
+
+
+def test_probe_schema_reads_catalog_once_per_kind():
+    db = _DB(
+        [
+            [
+                {"tbl": "public.orders", "column_name": "order_id"},
+                {"tbl": "public.orders", "column_name": "payload_snapshot"},
+                {"tbl": "public.active_sessions", "column_name": "total_tokens"},
+            ],
+            [{"tbl": "public.orders", "cols": ["order_id"]}],
+            [{"extname": "plpgsql"}],
+        ]
+    )
+    caps = probe_schema(db)
+    assert len(db.calls) == 3
+    assert caps.orders_new_schema and caps.has_unique("public.orders", "order_id")
+    assert not caps.session_tokens and not caps.has_extension("unaccent")
+    assert "archive.clients" in caps.as_dict()["missing_tables"]
+
+
+def test_insert_order_new_schema_never_touches_information_schema():
+    set_schema_capabilities(_caps(NEW_ORDERS))
+    db = _DB()
+    for _ in range(3):
+        assert crud.insert_order(db, "1", "5547999990001", "queued", {"total_amount": 34}) == "42"
+    assert len(db.calls) == 3
+    sql = db.calls[0][0]
+    assert "information_schema" not in sql
+    assert "ON CONFLICT (order_id) DO UPDATE" in sql and "RETURNING id" in sql
+    assert "CAST(:payload_snapshot AS jsonb)" in sql
+    assert "telefone" not in db.calls[0][1]
+
+
+def test_insert_order_legacy_schema_skips_missing_columns_and_conflict():
+    set_schema_capabilities(_caps(LEGACY_ORDERS, unique=()))
+    db = _DB()
+    assert crud.insert_order(db, "1", "5547999990001", "created", {"a": 1}, response={"ok": True}) is None
+    sql, params = db.calls[0]
+    assert "ON CONFLICT" not in sql and "RETURNING" not in sql
+    assert "telefone" not in params and "CAST(:response AS jsonb)" in sql
+
+
+def test_capabilities_drive_optional_features():
+    set_schema_capabilities(_caps(LEGACY_ORDERS - {"response"}, extensions=(), sessions=()))
+    db = _DB([[{"bairro": "Centro", "taxa_entrega": 5, "cidade": "Itajaí"}]])
+    assert crud.fetch_delivery_fee(db, "centro")[0]["bairro"] == "Centro"
+    assert "unaccent" not in db.calls[0][0]
+
+    crud.update_order_status(db, "1", "sent", {"ok": True})
+    assert "response" not in db.calls[-1][0]
+
+    calls = len(db.calls)
+    crud.increment_session_tokens(db, "5547999990001", 10, 5, 15)
+    assert len(db.calls) == calls
+    assert schema_metrics()["probed"] is True
@@ -5,6 +5,8 @@ from app.db.session import _normalize_db_url
 
 
 class DummyResult:
+    rowcount = 0
+
     def mappings(self):
         return self
 
@@ -48,3 +50,56 @@ def test_insert_chat_history_uses_text():
     assert isinstance(db.sql, TextClause)
     assert "n8n_historico_mensagens" in str(db.sql)
     assert "CAST(:message AS jsonb)" in str(db.sql)
+
+
+def test_claim_followup_candidates_keyset_matches_partial_index():
+    class _Rows(DummyResult):
+        def all(self):
+            return []
+
+    class _DB(DummyDB):
+        def execute(self, sql, params=None):
+            super().execute(sql, params)
+            return _Rows()
+
+    db = _DB()
+    crud.claim_followup_candidates(db, limit=50)
+    assert "(updated_at, id) >" not in str(db.sql)
+    crud.claim_followup_candidates(db, limit=50, after=("2024-01-01T00:00:00+00:00", 10))
+    sql = str(db.sql)
+    assert "COALESCE(followup_count,0) < 2" in sql and "followup_sent_at IS NULL" in sql
+    assert "(updated_at, id) > (CAST(:after_ts AS timestamptz), CAST(:after_id AS bigint))" in sql
+    assert db.params["after_id"] == 10
+
+
+def test_insert_order_items_is_a_single_statement():
+    db = DummyDB()
+    calls = []
+    db.execute = lambda sql, params=None: calls.append((sql, params)) or DummyResult()
+    itens = [
+        {"pdv": "101", "nome": "X Salada", "quantidade": 1, "valor_unitario": 28, "adicionais": [{"pdv": "901", "nome": "Bacon"}]},
+        {"pdv": "202", "nome": "Coca-Cola Lata", "quantidade": 2, "valor_unitario": 7},
+    ]
+    crud.insert_order_items(db, "order-uuid", itens)
+    inserts = [sql for sql, _ in calls if "order_items" in str(sql)]
+    assert len(inserts) == 1
+    assert "jsonb_populate_recordset(NULL::public.order_items, CAST(:rows AS jsonb))" in str(inserts[0])
+
+
+def test_record_order_status_event_dedupes_and_coalesces_in_one_statement():
+    db = DummyDB()
+    result = crud.record_order_status_event(db, order_id="1", event="DISPATCHED", rank=30, delay_seconds=5)
+    sql = str(db.sql)
+    assert "ON CONFLICT (order_id, event) DO NOTHING" in sql
+    assert "SET status = 'superseded'" in sql and "e.rank <= ins.rank" in sql
+    assert db.params["delay"] == 5.0
+    assert result == {"id": None, "status": None, "superseded": 0}
+
+
+def test_archive_finished_sessions_never_drops_conflicting_rows():
+    db = DummyDB()
+    crud.archive_finished_sessions(db, 30, 100)
+    sql = str(db.sql)
+    # DO NOTHING apagaria de active_sessions uma sessão que não chegou ao arquivo
+    assert "ON CONFLICT (id) DO UPDATE" in sql and "DO NOTHING" not in sql
+    assert db.params == {"days": 30, "batch": 100}
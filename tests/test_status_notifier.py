@@ -0,0 +1,121 @@
+import pytest
+
+from app.db import crud
+from app.services import status_notifier
+from app.services.status_notifier import StatusNotifier, record_intake, status_notify_metrics
+from app.services.status_service import StatusService, parse_status_event
+from app.settings import settings
+from conftest import FakeDb
+
+
+@pytest.fixture
+def status_crud(record_crud):
+    return {
+        "orders": record_crud("update_order_status"),
+        "completed": record_crud("complete_order_status_event", returns=1.5),
+    }
+
+
+def test_parse_status_event_accepts_body_envelope():
+    parsed = parse_status_event({"body": {"event": "CONFIRMED", "order_id": "1", "customer": {"phone": "47999990001", "name": "Ana"}}})
+    assert parsed == {"event": "CONFIRMED", "order_id": "1", "telefone": "47999990001", "nome": "Ana"}
+    assert parse_status_event({"event": "CONFIRMED", "body": {"customer": None}})["telefone"] is None
+
+
+def test_record_event_only_stores_and_never_calls_evolution(monkeypatch, db, fake_evolution):
+    calls = []
+
+    def record(db, **kwargs):
+        calls.append(kwargs)
+        return {"id": None if len(calls) > 1 else 1, "status": "pending" if len(calls) == 1 else None, "superseded": 0}
+
+    monkeypatch.setattr(crud, "record_order_status_event", record)
+    monkeypatch.setattr(settings, "status_coalesce_seconds", 5.0)
+    evolution = fake_evolution()
+    service = StatusService(db, evolution)
+    payload = {"event": "READY_TO_DELIVER", "order_id": 123, "telefone": "47999990001"}
+
+    first = service.record_event(payload)
+    again = service.record_event(payload)
+
+    assert first["queued"] is True and again["duplicate"] is True
+    assert calls[0]["order_id"] == "123" and calls[0]["rank"] == 20 and calls[0]["delay_seconds"] == 5.0
+    assert evolution.sent == []
+
+
+def test_unknown_events_stay_out_of_the_coalescing():
+    class _Rows:
+        def mappings(self):
+            return self
+
+        def first(self):
+            return {"id": 1, "status": "pending", "superseded": 0}
+
+    class _CaptureDb(FakeDb):
+        def execute(self, sql, params=None):
+            self.sql, self.params = str(sql), params
+            return _Rows()
+
+    db = _CaptureDb()
+    crud.record_order_status_event(db, order_id="123", event="PRINTED", rank=0)
+    # rank 0 nunca nasce superseded, não substitui nem é substituído: o worker sempre aplica o status
+    assert "CAST(:rank AS int) > 0 AND EXISTS" in db.sql
+    assert "ins.rank > 0" in db.sql and "e.rank > 0" in db.sql
+    assert db.params["rank"] == 0
+
+
+def test_deliver_sends_then_skips_unknown_events(db, status_crud, fake_evolution, status_event_row):
+    evolution = fake_evolution()
+    notifier = StatusNotifier(None, lambda: evolution, send_rate=0)
+    service = StatusService(db, evolution, send_limiter=notifier.send_limiter)
+
+    assert notifier.deliver(db, service, status_event_row()) == "sent"
+    assert notifier.deliver(db, service, status_event_row(event="PRINTED")) == "skipped"
+
+    assert len(evolution.sent) == 1 and "sair para entrega" in evolution.sent[0][2]
+    assert [c["status"] for c in status_crud["orders"]] == ["DISPATCHED", "PRINTED"]
+    assert [c["status"] for c in status_crud["completed"]] == ["sent", "skipped"]
+    assert notifier.metrics()["latency_ms_avg"] == 1500.0
+
+
+def test_deliver_requeues_with_backoff_then_fails(db, status_crud, fake_evolution, status_event_row):
+    evolution = fake_evolution(fail=2)
+    notifier = StatusNotifier(None, lambda: evolution, send_rate=0, max_attempts=2)
+    service = StatusService(db, evolution)
+
+    assert notifier.deliver(db, service, status_event_row(attempts=1)) == "pending"
+    assert notifier.deliver(db, service, status_event_row(attempts=2)) == "failed"
+    assert [(c["status"], c["retry_in_seconds"]) for c in status_crud["completed"]] == [("pending", 5), ("failed", 0)]
+    assert db.rollbacks == 2
+    assert notifier.metrics()["requeued"] == 1
+
+
+def test_run_once_claims_and_reports_intake(monkeypatch, db_factory, status_crud, fake_evolution, status_event_row):
+    rows = [status_event_row(), status_event_row(event="CONCLUDED")]
+    monkeypatch.setattr(crud, "claim_order_status_events", lambda db, limit, lease_seconds: rows)
+    monkeypatch.setattr(status_notifier, "_intake", {"received": 0, "duplicates": 0, "superseded": 0})
+
+    evolution = fake_evolution()
+    notifier = StatusNotifier(db_factory, lambda: evolution, send_rate=0)
+    assert notifier.run_once()["outcomes"] == ["sent", "sent"]
+
+    record_intake({"id": 1, "status": "pending", "superseded": 2, "duplicate": False})
+    record_intake({"id": None, "status": None, "superseded": 0, "duplicate": True})
+    metrics = status_notify_metrics()
+    assert metrics["received"] == 1 and metrics["duplicates"] == 1 and metrics["superseded"] == 2
+
+
+def test_run_once_claims_only_what_fits_the_lease(monkeypatch, db_factory, status_crud, fake_evolution):
+    limits = []
+    monkeypatch.setattr(crud, "claim_order_status_events", lambda db, limit, lease_seconds: limits.append((limit, lease_seconds)) or [])
+
+    notifier = StatusNotifier(db_factory, fake_evolution, send_rate=5)
+    monkeypatch.setattr(status_notifier, "sends_are_queued", lambda: False)
+    notifier.run_once()
+    monkeypatch.setattr(status_notifier, "sends_are_queued", lambda: True)
+    notifier.run_once()
+
+    (sync_limit, lease), (queued_limit, _) = limits
+    # envio síncrono: o lote inteiro termina antes de o lease vencer
+    assert sync_limit * status_notifier.SYNC_SEND_SECONDS <= lease
+    assert queued_limit == 20
@@ -0,0 +1,154 @@
+import logging
+import threading
+
+import httpx
+
+from app.db import crud
+from app.services.outbound_queue import OutboundSender, send_messages
+from app.settings import settings
+from app.utils import tracing
+from app.utils.http_client import InstrumentedTransport
+from app.utils.metrics import MetricsRegistry, StageTimer
+from app.utils.tracing import OtlpHttpSink, SpanExporter, TraceContextFilter, current_trace_id, span, start_trace
+
+
+class _ListSink:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def _exporter(monkeypatch, sample_rate=1.0, slow_ms=0):
+    monkeypatch.setattr(settings, "trace_sample_rate", sample_rate)
+    sink = _ListSink()
+    exporter = SpanExporter(sink, slow_ms=slow_ms, interval_seconds=3600)
+    monkeypatch.setattr(tracing, "_instance", exporter)
+    # "rodando" sem a thread: o teste drena com run_once
+    exporter._thread = threading.current_thread()
+    return exporter, sink
+
+
+def test_span_outside_trace_is_a_noop():
+    with span("tool.x") as child:
+        assert child is None
+    assert current_trace_id() == ""
+
+
+def test_children_share_trace_and_point_to_parent():
+    with start_trace("turn", trace_id="ABC-1") as root:
+        assert current_trace_id() == "ABC-1"
+        with span("llm.chat", iteration=1) as child:
+            assert child.parent_id == root.span_id
+            assert child.traceparent().startswith(f"00-{root.trace.trace_id}-{child.span_id}-")
+    assert current_trace_id() == ""
+
+
+def test_log_records_get_trace_id_from_context():
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "msg", None, None)
+    with start_trace("turn", trace_id="ABC-2") as root:
+        TraceContextFilter().filter(record)
+    assert record.trace_id == "ABC-2" and record.span_id == root.span_id
+
+
+def test_http_client_propagates_traceparent():
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.headers.get("traceparent"))
+        return httpx.Response(200)
+
+    with httpx.Client(transport=InstrumentedTransport("teste", httpx.MockTransport(handler))) as client:
+        client.get("https://example.test/a")
+        with start_trace("turn", trace_id="ABC-3") as root:
+            client.get("https://example.test/b")
+
+    assert seen[0] is None
+    assert seen[1].startswith(f"00-{root.trace.trace_id}-")
+
+
+def test_exporter_writes_sampled_trace_with_stages(monkeypatch):
+    exporter, sink = _exporter(monkeypatch, sample_rate=1.0)
+    hist = MetricsRegistry().histogram("t_seconds", "teste", ("stage",))
+
+    with start_trace("turn", trace_id="ABC-4"):
+        StageTimer(hist).lap("debounce")
+        with span("tool.carrinho_obter"):
+            pass
+    exporter.run_once()
+
+    names = {s["name"] for s in sink.spans}
+    assert names == {"turn", "stage.debounce", "tool.carrinho_obter"}
+    assert exporter.metrics()["sampled"] == 1
+
+
+def test_unsampled_traces_only_export_when_slow(monkeypatch):
+    exporter, sink = _exporter(monkeypatch, sample_rate=0.0, slow_ms=10**9)
+    with start_trace("turn", trace_id="ABC-5"):
+        pass
+    exporter.run_once()
+    assert sink.spans == []
+
+    exporter.slow_ms = 1
+    with start_trace("turn", trace_id="ABC-6") as root:
+        root.start_ns -= 5_000_000
+    exporter.run_once()
+    assert [s["name"] for s in sink.spans] == ["turn"]
+    assert exporter.metrics()["slow"] == 1
+
+
+def test_sampling_decision_is_stable_per_trace_id():
+    trace_id = tracing._otel_trace_id("3EB0-1712345678")
+    decisions = {tracing.should_sample(trace_id, 0.5) for _ in range(5)}
+    assert len(decisions) == 1
+
+
+def test_otlp_payload_shape():
+    with start_trace("turn", trace_id="ABC-7") as root:
+        pass
+    payload = OtlpHttpSink("http://collector/v1/traces", "lia").payload([root.to_dict()])
+    otlp = payload["resourceSpans"][0]["scopeSpans"][0]["spans"][0]
+    assert otlp["traceId"] == root.trace.trace_id and len(otlp["traceId"]) == 32
+    assert "parentSpanId" not in otlp
+    assert {"key": "lia.trace_id", "value": {"stringValue": "ABC-7"}} in otlp["attributes"]
+
+
+def test_enqueued_messages_carry_the_turn_trace(monkeypatch):
+    sender = OutboundSender(lambda: None, lambda: None, concurrency=1)
+    sender._thread = threading.current_thread()
+    monkeypatch.setattr(OutboundSender, "_current", sender)
+    monkeypatch.setattr(settings, "outbound_queue_enabled", True)
+    enqueued = []
+    monkeypatch.setattr(crud, "enqueue_outbound_messages", lambda db, telefone, parts, **kwargs: enqueued.append(kwargs) or [1])
+
+    with start_trace("turn", trace_id="ABC-8"):
+        send_messages(None, None, "5547999990001", ["oi"])
+
+    assert enqueued[0]["trace_id"] == "ABC-8"
+
+
+def test_pool_work_keeps_the_turn_trace(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.services.transcription_service import TranscriptionService
+
+    seen = []
+
+    class _Evolution:
+        def get_base64_from_media(self, instance, message_id, base_url=None):
+            seen.append(("download", current_trace_id()))
+            return {"base64": "dm96", "mimetype": "audio/mp4"}
+
+    def _transcriber(fileobj, filename, mime):
+        seen.append(("transcribe", current_trace_id()))
+        return "oi"
+
+    service = TranscriptionService(max_workers=1, max_bytes=1000, transcriber=_transcriber)
+    with start_trace("turn", trace_id="ABC-9"):
+        service.transcribe_message(_Evolution(), {"id_mensagem": "m1"})
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            ids = list(pool.map(tracing.bind_context(lambda _: current_trace_id()), range(4)))
+
+    assert seen == [("download", "ABC-9"), ("transcribe", "ABC-9")]
+    assert ids == ["ABC-9"] * 4
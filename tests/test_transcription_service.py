@@ -0,0 +1,108 @@
+import base64
+import threading
+
+from app.services.transcription_service import TranscriptionService, audio_filename, decode_base64_to_spool
+
+
+class _Evolution:
+    def __init__(self, payloads):
+        self.payloads = payloads
+        self.calls = 0
+
+    def get_base64_from_media(self, instance, message_id, base_url=None):
+        self.calls += 1
+        return {"base64": self.payloads[message_id], "mimetype": "audio/mp4"}
+
+
+def _info(message_id, size=0):
+    return {"id_mensagem": message_id, "instancia": "inst", "media_size": size}
+
+
+def test_decode_base64_to_spool_matches_full_decode():
+    raw = bytes(range(256)) * 1000
+    encoded = "data:audio/mp4;base64," + base64.b64encode(raw).decode()
+    spool, size, _ = decode_base64_to_spool(encoded, max_bytes=len(raw))
+    assert size == len(raw)
+    assert spool.read() == raw
+    assert audio_filename("audio/ogg; codecs=opus") == ("audio.ogg", "audio/ogg")
+    assert audio_filename(None) == ("audio.mp4", "audio/mp4")
+
+
+def test_transcription_cache_by_message_and_content():
+    audio = base64.b64encode(b"voice-note" * 100).decode()
+    evolution = _Evolution({"m1": audio, "m2": audio})
+    calls = []
+
+    def _transcriber(fileobj, filename, mime):
+        calls.append((fileobj.read(), filename, mime))
+        return "quero um x salada"
+
+    service = TranscriptionService(max_workers=1, max_bytes=10_000, transcriber=_transcriber)
+    assert service.transcribe_message(evolution, _info("m1")) == "quero um x salada"
+    assert service.transcribe_message(evolution, _info("m1")) == "quero um x salada"
+    assert service.transcribe_message(evolution, _info("m2")) == "quero um x salada"
+    assert len(calls) == 1 and calls[0][1:] == ("audio.mp4", "audio/mp4")
+    assert evolution.calls == 2
+    metrics = service.metrics()
+    assert metrics["cache_hits"] == 2 and metrics["completed"] == 2
+    assert metrics["queue_depth"] == 0 and metrics["in_flight"] == 0
+
+
+def test_transcription_rejects_oversized_and_bounds_workers():
+    big = base64.b64encode(b"x" * 5000).decode()
+    evolution = _Evolution({"big": big, **{f"m{i}": base64.b64encode(bytes([i]) * 10).decode() for i in range(6)}})
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+    gate = threading.Event()
+
+    def _transcriber(fileobj, filename, mime):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        gate.wait(0.05)
+        with lock:
+            active["now"] -= 1
+        return "ok"
+
+    service = TranscriptionService(max_workers=2, max_bytes=1000, transcriber=_transcriber)
+    assert service.transcribe_message(evolution, _info("big", size=5000)) == ""
+    assert evolution.calls == 0
+    assert service.transcribe_message(evolution, _info("big")) == ""
+    assert service.metrics()["rejected_too_large"] == 2
+
+    threads = [threading.Thread(target=service.transcribe_message, args=(evolution, _info(f"m{i}"))) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert active["max"] <= 2
+    assert service.metrics()["completed"] == 6
+
+
+def test_decode_base64_to_spool_accepts_mime_wrapped_base64():
+    raw = bytes(range(256)) * 1000
+    wrapped = base64.encodebytes(raw).decode()  # linhas de 76 caracteres com "\n"
+    spool, size, _ = decode_base64_to_spool(wrapped, max_bytes=len(raw))
+    assert size == len(raw)
+    assert spool.read() == raw
+
+
+def test_transcription_failure_falls_back_to_text_path():
+    audio = base64.b64encode(b"voice-note").decode()
+    release = threading.Event()
+
+    def _slow(fileobj, filename, mime):
+        release.wait(5)
+        return "tarde demais"
+
+    def _broken(fileobj, filename, mime):
+        raise RuntimeError("openai 500")
+
+    slow = TranscriptionService(max_workers=1, max_bytes=10_000, timeout_seconds=0.05, transcriber=_slow)
+    assert slow.transcribe_message(_Evolution({"m1": audio}), _info("m1")) == ""
+    assert slow.metrics()["timeouts"] == 1
+    release.set()
+
+    broken = TranscriptionService(max_workers=1, max_bytes=10_000, transcriber=_broken)
+    assert broken.transcribe_message(_Evolution({"m2": audio}), _info("m2")) == ""
+    assert broken.metrics()["failed"] == 1
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from app.db import crud, session
+
+
+class _RecordingDb:
+    def __init__(self):
+        self.info = {}
+        self.executed = 0
+        self.commits = 0
+        self.savepoints = 0
+
+    def execute(self, *args, **kwargs):
+        self.executed += 1
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    @contextmanager
+    def begin_nested(self):
+        self.savepoints += 1
+        yield
+
+
+def test_crud_does_not_commit_inside_unit_of_work():
+    db = _RecordingDb()
+    crud.clear_messages(db, "5547999999999")
+    assert db.commits == 1
+
+    with session.unit_of_work(db):
+        crud.clear_messages(db, "5547999999999")
+        crud.update_active_session_ai(db, "5547999999999", "oi")
+        with session.unit_of_work(db):
+            crud.clear_cart(db, "5547999999999")
+        assert db.commits == 1
+    assert db.commits == 2
+    assert db.executed == 4
+    assert not session.in_unit_of_work(db)
+
+
+def test_track_db_stats_counts_statements_and_commits(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'uow.db'}")
+    session.instrument_engine(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE fila (id INTEGER PRIMARY KEY, msg TEXT)"))
+
+    with session.track_db_stats() as stats:
+        with Session(engine) as db, session.unit_of_work(db):
+            for idx in range(3):
+                db.execute(text("INSERT INTO fila (msg) VALUES (:msg)"), {"msg": f"m{idx}"})
+    assert stats.statements == 3
+    assert stats.commits == 1
+
+    with Session(engine) as db:
+        assert db.execute(text("SELECT count(*) FROM fila")).scalar() == 3
+    engine.dispose()
+
+
+def test_media_download_and_transcription_run_outside_the_transaction(monkeypatch):
+    from app.api import routes_webhooks
+
+    db = _RecordingDb()
+    seen = {}
+
+    @contextmanager
+    def _get_db():
+        yield db
+
+    def _media(evolution, info):
+        seen["in_uow"] = session.in_unit_of_work(db)
+        return "transcrição do áudio"
+
+    class _Agent:
+        def run(self, content, telefone, horario, historico):
+            seen["content"] = content
+            return ""
+
+    monkeypatch.setattr(routes_webhooks, "get_db", _get_db)
+    monkeypatch.setattr(routes_webhooks, "process_queue", lambda db, telefone, message_id, wait: [{"id": 1, "mensagem": "x"}])
+    monkeypatch.setattr(routes_webhooks, "_media_content", _media)
+    monkeypatch.setattr(routes_webhooks, "_build_agent", lambda db: _Agent())
+    monkeypatch.setattr(crud, "fetch_client_snapshot", lambda db, telefone: {})
+    monkeypatch.setattr(crud, "insert_chat_history", lambda *a, **k: None)
+    monkeypatch.setattr(crud, "clear_messages", lambda *a, **k: None)
+
+    result = routes_webhooks._handle_message({"telefone": "5547999999999", "id_mensagem": "m1", "message_type": "audio"})
+
+    assert result == "silent"
+    assert seen == {"in_uow": False, "content": "transcrição do áudio"}
+
+
+def test_best_effort_history_runs_in_savepoints(monkeypatch):
+    from app.api import routes_webhooks
+
+    db = _RecordingDb()
+    closed = []
+
+    @contextmanager
+    def _get_db():
+        yield db
+
+    class _Agent:
+        def run(self, content, telefone, horario, historico):
+            return "Olá!"
+
+    def _broken_history(*args, **kwargs):
+        raise RuntimeError("n8n_historico_mensagens indisponível")
+
+    monkeypatch.setattr(routes_webhooks, "get_db", _get_db)
+    monkeypatch.setattr(routes_webhooks, "process_queue", lambda db, telefone, message_id, wait: [{"id": 1, "mensagem": "oi"}])
+    monkeypatch.setattr(routes_webhooks, "_media_content", lambda evolution, info: "")
+    monkeypatch.setattr(routes_webhooks, "_build_agent", lambda db: _Agent())
+    monkeypatch.setattr(routes_webhooks, "send_messages", lambda *a, **k: None)
+    monkeypatch.setattr(crud, "fetch_client_snapshot", lambda db, telefone: {})
+    monkeypatch.setattr(crud, "insert_chat_history", _broken_history)
+    monkeypatch.setattr(crud, "clear_messages", lambda db, telefone, ids=None: closed.append("clear"))
+    monkeypatch.setattr(crud, "update_active_session_ai", lambda db, telefone, reply: closed.append("ai"))
+
+    assert routes_webhooks._handle_message({"telefone": "5547999999999", "id_mensagem": "m1"}) not in ("error", "empty")
+    # snapshot + 2 históricos, cada um no seu savepoint: a falha não aborta o fechamento da mensagem
+    assert db.savepoints == 3
+    assert closed == ["clear", "ai"]
+    assert db.commits == 2
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from app.api.routes_webhooks import router
+from app.api.routes_webhooks import classify_webhook, router, validate_config
 from app.settings import settings
 
 
@@ -24,6 +24,7 @@ def test_v31_min_payload_degraded():
     settings.evolution_base_url = "https://evo.example"
     settings.evolution_api_key = "dummy"
     settings.openai_api_key = ""
+    validate_config()
 
     client = TestClient(make_app())
     payload = {
@@ -42,3 +43,82 @@ def test_v31_min_payload_degraded():
     assert body["status"] in ("degraded", "queued", "ignored")
     assert body["status"] == "degraded"
     assert body["reason"] == "missing_env"
+
+
+def test_v31_ingests_in_one_call_and_reports_duplicate(monkeypatch):
+    from contextlib import contextmanager
+
+    from app.api import routes_webhooks
+    from app.db import crud
+    from app.utils.dedupe import DuplicateMessageFilter, LruIdFilter
+
+    monkeypatch.setattr(routes_webhooks, "_MISSING_ENVS", [])
+
+    seen = set()
+    calls = []
+
+    def _ingest(db, data, last_message):
+        calls.append(data["id_mensagem"])
+        key = (data["telefone"], data["id_mensagem"])
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    @contextmanager
+    def _db():
+        yield object()
+
+    monkeypatch.setattr(crud, "ingest_inbound_message", _ingest)
+    monkeypatch.setattr(routes_webhooks, "get_db", _db)
+    monkeypatch.setattr(routes_webhooks, "_process_message", lambda info: None)
+
+    client = TestClient(make_app())
+    payload = {
+        "event": "messages.upsert",
+        "data": {
+            "key": {"id": "dup-1", "remoteJid": "5547999999999@s.whatsapp.net", "fromMe": False},
+            "message": {"conversation": "oi"},
+            "messageTimestamp": 1730000000,
+        },
+        "instance": "inst1",
+    }
+    monkeypatch.setattr(routes_webhooks, "get_message_filter", lambda: None)
+    assert client.post("/v3.1", json=payload).json()["status"] == "queued"
+    assert client.post("/v3.1", json=payload).json()["status"] == "duplicate"
+    assert calls == ["dup-1", "dup-1"]
+
+    # com o pré-filtro em memória, a reentrega não chega ao banco
+    dedupe = DuplicateMessageFilter(LruIdFilter(10))
+    monkeypatch.setattr(routes_webhooks, "get_message_filter", lambda: dedupe)
+    payload["data"]["key"]["id"] = "dup-2"
+    assert client.post("/v3.1", json=payload).json()["status"] == "queued"
+    assert client.post("/v3.1", json=payload).json()["status"] == "duplicate"
+    assert calls == ["dup-1", "dup-1", "dup-2"]
+    assert dedupe.metrics()["filtered"] == 1
+
+
+def test_classify_webhook_rejects_ignorable_events_before_full_parse(monkeypatch):
+    from app.api import routes_webhooks
+
+    monkeypatch.setattr(routes_webhooks, "_MISSING_ENVS", [])
+    monkeypatch.setattr(routes_webhooks, "parse_evolution_payload", lambda payload: (_ for _ in ()).throw(AssertionError))
+
+    def _payload(key, message=None, event="messages.upsert"):
+        return {"event": event, "data": {"key": key, "message": message or {"conversation": "oi"}}}
+
+    jid = "5547999999999@s.whatsapp.net"
+    assert classify_webhook(_payload({"id": "1", "remoteJid": jid, "fromMe": True}))["reason"] == "from_me"
+    assert classify_webhook(_payload({"id": "1", "remoteJid": "123@g.us"}))["reason"] == "group_message"
+    assert classify_webhook(_payload({"id": "1", "remoteJid": jid}, event="presence.update"))["reason"] == "unsupported_event"
+    assert (
+        classify_webhook(_payload({"id": "1", "remoteJid": jid}, message={"reactionMessage": {}}))["reason"]
+        == "unsupported_message_type"
+    )
+    assert classify_webhook(_payload({"id": "1", "remoteJid": jid})) is None
+
+    client = TestClient(make_app())
+    resp = client.post("/v3.1", json=_payload({"id": "1", "remoteJid": jid, "fromMe": True}))
+    assert resp.json() == {"status": "ignored", "reason": "from_me"}
+    resp = client.post("/v3.1", content=b"{not json", headers={"content-type": "application/json"})
+    assert resp.json()["reason"] == "invalid_json"